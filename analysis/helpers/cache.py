@@ -0,0 +1,113 @@
+"""
+Local disk cache of the remote (root://) input files.
+
+Files are copied with xrdcp, in background threads, into a directory of
+bounded size, ahead of the time they are needed. The urls handed to the
+executors are rewritten to the local copies when these are complete;
+the other files are still read remotely. When the directory is over its
+size, the least recently used copies are removed, except the ones that
+are being read.
+"""
+import concurrent.futures
+import hashlib
+import os
+import subprocess
+import threading
+import warnings
+
+class Cache(object):
+
+    def __init__(self, directory, maxsize, workers=4):
+        self._directory = directory
+        self._maxsize = maxsize
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._fetching = set()
+        self._failed = set()
+        self._inuse = set()
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self._directory, hashlib.md5(url.encode()).hexdigest()[:16]+'_'+os.path.basename(url))
+
+    def get(self, url):
+        """
+        Local copy of url if it is in the cache, url otherwise. The copy is
+        protected from eviction until it is released.
+        """
+        if not url.startswith('root://'): return url
+        path = self.path(url)
+        with self._lock:
+            if not os.path.exists(path):
+                self.misses += 1
+                return url
+            self.hits += 1
+            self._inuse.add(path)
+        os.utime(path)
+        return path
+
+    def release(self, urls):
+        with self._lock:
+            for url in urls:
+                self._inuse.discard(self.path(url))
+
+    def prefetch(self, urls):
+        """
+        Copy, in the background, the files of urls that are not in the
+        cache yet.
+        """
+        for url in urls:
+            if not url.startswith('root://'): continue
+            with self._lock:
+                if self._closed or url in self._fetching or url in self._failed: continue
+                if os.path.exists(self.path(url)): continue
+                self._fetching.add(url)
+            self._executor.submit(self._fetch, url)
+
+    def _fetch(self, url):
+        path = self.path(url)
+        try:
+            if self._closed: return
+            if subprocess.call(['xrdcp', '-s', '-f', url, path+'.part']) != 0:
+                warnings.warn('Could not copy '+url)
+                self._failed.add(url)
+                if os.path.exists(path+'.part'): os.remove(path+'.part')
+                return
+            os.rename(path+'.part', path)
+            os.utime(path)
+            self._evict()
+        finally:
+            with self._lock:
+                self._fetching.discard(url)
+
+    def _evict(self):
+        """
+        Remove the least recently used copies until the cache fits in its
+        maximum size.
+        """
+        with self._lock:
+            files = []
+            total = 0
+            for name in os.listdir(self._directory):
+                path = os.path.join(self._directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                total += stat.st_size
+                if name.endswith('.part') or path in self._inuse: continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            for mtime, size, path in sorted(files):
+                if total <= self._maxsize: break
+                os.remove(path)
+                total -= size
+
+    def close(self):
+        """
+        Stop prefetching. The copies already started are completed.
+        """
+        self._closed = True
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,156 @@
+"""
+Local catalog of the input NanoAOD files.
+
+Every file is inspected once and its number of entries, size, branch list
+and Runs tree sums are stored in a SQLite database, together with the
+outcome of the last attempt at reading it. The catalog is filled by
+macros/pack.py and read by run.py and run_condor.py.
+"""
+import concurrent.futures
+import json
+import sqlite3
+import time
+import warnings
+
+import uproot
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path     TEXT PRIMARY KEY,
+    nevents  INTEGER,
+    bytes    INTEGER,
+    uuid     TEXT,
+    branches TEXT,
+    sumw     REAL,
+    sumw2    REAL,
+    ngen     REAL,
+    good     INTEGER,
+    error    TEXT,
+    lastseen REAL
+)
+"""
+
+def runsum(runs, name):
+    for branch in [name, name+'_']:
+        if branch.encode() in runs.keys():
+            return float(runs.array(branch).sum())
+    return None
+
+def inspect(url):
+    """
+    Open a file and read everything the catalog stores about it.
+    Only tree headers and the (tiny) Runs tree are read.
+    """
+    try:
+        rootfile = uproot.open(url)
+        tree = rootfile['Events']
+        info = {
+            'nevents':  tree.numentries,
+            'bytes':    tree.compressedbytes(),
+            'uuid':     bytes(rootfile._context.uuid).hex(),
+            'branches': json.dumps([k.decode() for k in tree.keys()]),
+            'sumw':     None,
+            'sumw2':    None,
+            'ngen':     None,
+            'good':     1,
+            'error':    None,
+        }
+        try:
+            runs = rootfile['Runs']
+        except KeyError:
+            runs = None
+        if runs is not None:
+            info['sumw']  = runsum(runs, 'genEventSumw')
+            info['sumw2'] = runsum(runs, 'genEventSumw2')
+            info['ngen']  = runsum(runs, 'genEventCount')
+    except Exception as e:
+        warnings.warn('Could not read '+url+': '+str(e))
+        info = {'good': 0, 'error': str(e)}
+    info['lastseen'] = time.time()
+    return info
+
+class Catalog(object):
+
+    def __init__(self, path='metadata/catalog.db'):
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(schema)
+
+    def get(self, url):
+        row = self._db.execute('SELECT * FROM files WHERE path=?', (url,)).fetchone()
+        if row is None: return None
+        return dict(row)
+
+    def update(self, url, **info):
+        keys = sorted(info.keys())
+        self._db.execute('INSERT OR IGNORE INTO files (path) VALUES (?)', (url,))
+        self._db.execute('UPDATE files SET '+', '.join(k+'=?' for k in keys)+' WHERE path=?',
+                         tuple(info[k] for k in keys)+(url,))
+
+    def mark(self, urls, good, error=None):
+        """
+        Record the outcome of reading urls. Files that are not in the
+        catalog are left out: they have not been inspected yet.
+        """
+        for url in urls:
+            self._db.execute('UPDATE files SET good=?, error=?, lastseen=? WHERE path=?', (int(good), error, time.time(), url))
+        self._db.commit()
+
+    def known(self, urls):
+        """
+        Files that were inspected, successfully or not.
+        """
+        known = set()
+        for url in urls:
+            row = self.get(url)
+            if row is not None and (row['nevents'] is not None or not row['good']): known.add(url)
+        return known
+
+    def bad(self, urls):
+        """
+        Files that failed the last time they were read.
+        """
+        bad = set()
+        for url in urls:
+            row = self.get(url)
+            if row is not None and row['good'] == 0: bad.add(url)
+        return bad
+
+    def fill(self, urls, workers=16, refresh=False):
+        """
+        Inspect, in parallel, the files that were not inspected yet
+        (or all of them, if refresh is set).
+        """
+        if not refresh:
+            known = self.known(urls)
+            urls = [url for url in urls if url not in known]
+        if not urls: return
+        print('Adding',len(urls),'files to the catalog')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for url, info in zip(urls, executor.map(inspect, urls)):
+                self.update(url, **info)
+        self._db.commit()
+
+    def nentries(self, urls):
+        nentries = {}
+        for url in urls:
+            row = self.get(url)
+            if row is None or not row['good'] or row['nevents'] is None: continue
+            nentries[url] = row['nevents']
+        return nentries
+
+    def metadata_cache(self, urls, treename='Events'):
+        """
+        Pre-populated coffea metadata cache, so that run_uproot_job does
+        not need to open the files again to learn their number of entries.
+        """
+        from coffea.processor.executor import FileMeta
+        cache = {}
+        for url in urls:
+            row = self.get(url)
+            if row is None or not row['good'] or row['nevents'] is None: continue
+            cache[FileMeta(None, url, treename)] = {'numentries': row['nevents'], 'uuid': bytes.fromhex(row['uuid'])}
+        return cache
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,91 @@
+"""
+Automatic discovery of the NanoAOD branches a processor reads.
+
+The processor is run on the first few events of one file per primary
+dataset, with a NanoEvents cache that records the name of every branch
+that gets materialized. Since the processors are columnar, the branches
+they touch do not depend on the content of the events, only on the kind
+of dataset (data or MC, V+jets, signal...), hence one trace per primary
+dataset.
+
+The lists are cached in data/<processor>.columns, next to the processor
+file, and traced again when the processor file is newer than the cache.
+"""
+import json
+import os
+
+import awkward
+from coffea.nanoaod import NanoEvents
+
+class Tracer(dict):
+    """
+    NanoEvents cache that remembers which branches were read.
+    The cache keys end with the branch name.
+    """
+
+    def __init__(self):
+        super(Tracer, self).__init__()
+        self.branches = set()
+
+    def __setitem__(self, key, value):
+        self.branches.add(key.split(';')[-1])
+        super(Tracer, self).__setitem__(key, value)
+
+def trace(processor_instance, dataset, filename, entrystop=100, treename='Events'):
+    tracer = Tracer()
+    metadata = {
+        'dataset':    dataset,
+        'filename':   filename,
+        'treename':   treename,
+        'entrystart': 0,
+        'entrystop':  entrystop,
+    }
+    events = NanoEvents.from_file(file=filename, treename=treename, entrystart=0, entrystop=entrystop, metadata=metadata, cache=tracer)
+    processor_instance.process(events)
+    return sorted(tracer.branches)
+
+def discover(processor_name, processor_instance, fileset):
+    """
+    Return {dataset: [branches]} for the datasets in fileset, tracing the
+    primary datasets that are not in the cache yet.
+    """
+    path = 'data/'+processor_name+'.columns'
+    cache = {}
+    if os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime('data/'+processor_name+'.processor'):
+        with open(path) as fin:
+            cache = json.load(fin)
+
+    columns = {}
+    for dataset, files in fileset.items():
+        if not files: continue
+        pdi = dataset.split("____")[0]
+        if pdi not in cache:
+            print('Tracing the columns read for',pdi)
+            cache[pdi] = trace(processor_instance, dataset, files[0])
+            print(len(cache[pdi]),'columns found')
+        columns[dataset] = cache[pdi]
+
+    with open(path, 'w') as fout:
+        json.dump(cache, fout, indent=4)
+    return columns
+
+def load(tree, columns, entrystart, entrystop, metadata):
+    """
+    Read only the given branches of a chunk, in one go, and build the
+    NanoEvents from them.
+    """
+    available = set(k.decode() for k in tree.keys())
+    branches = [c for c in columns if c in available]
+    arrays = tree.arrays(branches, entrystart=entrystart, entrystop=entrystop, flatten=True, namedecode='ascii')
+    return from_arrays(arrays, metadata)
+
+def from_arrays(arrays, metadata):
+    """
+    NanoEvents from the flat arrays of the branches. They are wrapped in
+    VirtualArrays here: NanoEvents.from_arrays would print every one of
+    them, reading them all up front.
+    """
+    virtual = {}
+    for name, array in arrays.items():
+        virtual[name] = awkward.VirtualArray(lambda array=array: array, type=awkward.type.ArrayType(len(array), array.dtype))
+    return NanoEvents.from_arrays(virtual, metadata=metadata)
@@ -1,66 +0,0 @@
-import functools
-import logging
-import struct
-import sys
-
-logger = logging.getLogger()
-
-
-def patch_mp_connection_bpo_17560():
-    print('Inside',sys.version_info)
-    """Apply PR-10305 / bpo-17560 connection send/receive max size update
-
-    See the original issue at https://bugs.python.org/issue17560 and 
-    https://github.com/python/cpython/pull/10305 for the pull request.
-
-    This only supports Python versions 3.3 - 3.7, this function
-    does nothing for Python versions outside of that range.
-
-    """
-    patchname = "Multiprocessing connection patch for bpo-17560"
-    if not (3, 3) < sys.version_info < (3, 8):
-        logger.info(
-            patchname + " not applied, not an applicable Python version: %s",
-            sys.version
-        )
-        return
-
-    from multiprocessing.connection import Connection
-
-    orig_send_bytes = Connection._send_bytes
-    orig_recv_bytes = Connection._recv_bytes
-    if (
-        orig_send_bytes.__code__.co_filename == __file__
-        and orig_recv_bytes.__code__.co_filename == __file__
-    ):
-        logger.info(patchname + " already applied, skipping")
-        return
-
-    @functools.wraps(orig_send_bytes)
-    def send_bytes(self, buf):
-        print("send_bytes patched version")
-        n = len(buf)
-        if n > 0x7fffffff:
-            pre_header = struct.pack("!i", -1)
-            header = struct.pack("!Q", n)
-            self._send(pre_header)
-            self._send(header)
-            self._send(buf)
-        else:
-            orig_send_bytes(self, buf)
-
-    @functools.wraps(orig_recv_bytes)
-    def recv_bytes(self, maxsize=None):
-        print("recv_bytes patched version")
-        buf = self._recv(4)
-        size, = struct.unpack("!i", buf.getvalue())
-        if size == -1:
-            buf = self._recv(8)
-            size, = struct.unpack("!Q", buf.getvalue())
-        if maxsize is not None and size > maxsize:
-            return None
-        return self._recv(size)
-
-    Connection._send_bytes = send_bytes
-    Connection._recv_bytes = recv_bytes
-    logger.info(patchname + " applied")
@@ -0,0 +1,277 @@
+"""
+Compact storage of the coffea histograms saved by run.py and summed by
+reduce.py and merge.py.
+
+A coffea Hist keeps one float64 array per combination of the categories
+of its sparse axes (dataset, region, systematic...), and a second one for
+the sums of squared weights. A DenseHist keeps all of them in a single
+contiguous array, whose leading dimensions run over the categories of the
+sparse axes, with a map from each category to its position. The array can
+be float32, and the sums of squared weights are not stored when they are
+equal to the sums of weights, as for data.
+
+compact() and expand() convert the histograms of an output dictionary
+back and forth; expand() gives the hist.Hist objects used from scale.py
+on, by the models and the plots.
+
+save() and load() write and read these dictionaries as a sequence of
+independently lz4-compressed blocks, one per histogram and dataset,
+followed by an index of the blocks. A single histogram, or the datasets
+of a histogram that are needed, can be read without decompressing the
+rest of the file. Files written by coffea.util.save are still read.
+"""
+import os
+import struct
+
+import cloudpickle
+import lz4.frame as lz4f
+import numpy as np
+from coffea import util
+from coffea import hist, processor
+from coffea.hist.hist_tools import SparseAxis
+
+def _resize(array, shape):
+    """
+    array with its leading dimensions extended to shape, padded with zeros.
+    """
+    if array.shape[:len(shape)] == shape: return array
+    out = np.zeros(shape+array.shape[len(shape):], dtype=array.dtype)
+    out[tuple(slice(0, n) for n in array.shape[:len(shape)])] = array
+    return out
+
+class DenseHist(processor.AccumulatorABC):
+
+    def __init__(self, label, axes, dtype=np.float64, weighted=True):
+        self._label = label
+        # Fresh sparse axes, so that the categories seen by the original
+        # ones are not pickled along
+        self._axes = tuple(hist.Cat(ax.name, ax.label, sorting=ax.sorting) if isinstance(ax, SparseAxis) else ax for ax in axes)
+        self._sparse = [ax for ax in self._axes if isinstance(ax, SparseAxis)]
+        self._dense = [ax for ax in self._axes if not isinstance(ax, SparseAxis)]
+        self._dtype = np.dtype(dtype)
+        self._weighted = weighted
+        self._bins = [[] for ax in self._sparse]
+        self._index = [{} for ax in self._sparse]
+        self._filled = np.zeros((0,)*len(self._sparse), dtype=bool)
+        self._sumw = np.zeros(self._filled.shape+tuple(ax.size for ax in self._dense), dtype=self._dtype)
+        self._sumw2 = None
+
+    @classmethod
+    def from_hist(cls, h, dtype=np.float64):
+        out = cls(h.label, h.axes(), dtype, h._sumw2 is not None)
+        keys = list(h._sumw.keys())
+        if not keys: return out
+        positions = out._positions([[key[i] for key in keys] for i in range(len(out._sparse))])
+        out._filled[positions] = True
+        out._sumw[positions] = np.stack([h._sumw[key] for key in keys])
+        if h._sumw2 is not None and not all(np.array_equal(h._sumw[key], h._sumw2[key]) for key in keys):
+            out._sumw2 = np.zeros_like(out._sumw)
+            out._sumw2[positions] = np.stack([h._sumw2[key] for key in keys])
+        return out
+
+    @property
+    def label(self):
+        return self._label
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def axes(self):
+        return self._axes
+
+    def _positions(self, bins):
+        """
+        Positions of bins (one list of StringBin per sparse axis) along the
+        leading dimensions, adding the categories that are not there yet.
+        """
+        positions = []
+        for i, axbins in enumerate(bins):
+            position = []
+            for b in axbins:
+                if b.name not in self._index[i]:
+                    self._index[i][b.name] = len(self._bins[i])
+                    self._bins[i].append(b)
+                position.append(self._index[i][b.name])
+            positions.append(np.array(position, dtype=np.intp))
+        shape = tuple(len(b) for b in self._bins)
+        self._filled = _resize(self._filled, shape)
+        self._sumw = _resize(self._sumw, shape)
+        if self._sumw2 is not None: self._sumw2 = _resize(self._sumw2, shape)
+        return tuple(positions)
+
+    def identity(self):
+        return DenseHist(self._label, self._axes, self._dtype, self._weighted)
+
+    def split(self, axis):
+        """
+        (name, DenseHist) for every category of the sparse axis axis, with
+        the bins of that category only.
+        """
+        i = [ax.name for ax in self._sparse].index(axis)
+        for p, b in enumerate(self._bins[i]):
+            out = self.identity()
+            out._bins = [list(bins) for bins in self._bins]
+            out._bins[i] = [b]
+            out._index = [{b.name: j for j, b in enumerate(bins)} for bins in out._bins]
+            out._filled = np.take(self._filled, [p], axis=i)
+            out._sumw = np.take(self._sumw, [p], axis=i)
+            if self._sumw2 is not None: out._sumw2 = np.take(self._sumw2, [p], axis=i)
+            yield b.name, out
+
+    @classmethod
+    def join(cls, blocks, axis):
+        """
+        Inverse of split(): the DenseHist with the categories of blocks
+        along the sparse axis axis.
+        """
+        out = blocks[0].identity()
+        i = [ax.name for ax in out._sparse].index(axis)
+        others = lambda h: [[b.name for b in bins] for j, bins in enumerate(h._bins) if j != i]
+        if any(others(block) != others(blocks[0]) for block in blocks):
+            for block in blocks: out.add(block)
+            return out
+        out._bins = [list(bins) for bins in blocks[0]._bins]
+        out._bins[i] = [b for block in blocks for b in block._bins[i]]
+        out._index = [{b.name: j for j, b in enumerate(bins)} for bins in out._bins]
+        out._filled = np.concatenate([block._filled for block in blocks], axis=i)
+        out._sumw = np.concatenate([block._sumw for block in blocks], axis=i)
+        if any(block._sumw2 is not None for block in blocks):
+            out._sumw2 = np.concatenate([block._sumw2 if block._sumw2 is not None else block._sumw for block in blocks], axis=i)
+        out._weighted = any(block._weighted for block in blocks)
+        return out
+
+    def add(self, other):
+        if isinstance(other, hist.Hist):
+            other = DenseHist.from_hist(other, self._dtype)
+        if [ax.name for ax in self._sparse] != [ax.name for ax in other._sparse] or not all(a == b for a, b in zip(self._dense, other._dense)):
+            raise ValueError("Cannot add this histogram with histogram %r of dissimilar dimensions" % other)
+        index = np.ix_(*self._positions(other._bins))
+        if self._sumw2 is not None or other._sumw2 is not None:
+            if self._sumw2 is None: self._sumw2 = self._sumw.copy()
+            self._sumw2[index] += other._sumw2 if other._sumw2 is not None else other._sumw
+        self._sumw[index] += other._sumw
+        self._filled[index] |= other._filled
+        self._weighted = self._weighted or other._weighted
+        return self
+
+    def to_hist(self):
+        """
+        Equivalent hist.Hist, in double precision.
+        """
+        out = hist.Hist(self._label, *self._axes)
+        if self._weighted: out._sumw2 = {}
+        sumw2 = self._sumw2 if self._sumw2 is not None else self._sumw
+        for position in map(tuple, np.argwhere(self._filled)):
+            key = tuple(ax.index(self._bins[i][p]) for i, (ax, p) in enumerate(zip(out.sparse_axes(), position)))
+            out._sumw[key] = self._sumw[position].astype(np.float64)
+            if self._weighted: out._sumw2[key] = sumw2[position].astype(np.float64)
+        return out
+
+    def __repr__(self):
+        return "<%s (%s) instance at 0x%0x>" % (self.__class__.__name__, ",".join(ax.name for ax in self._axes), id(self))
+
+def compact(output, dtype=np.float64):
+    """
+    Copy of the dictionary output, with its hist.Hist as DenseHist.
+    """
+    out = output.__class__()
+    for key, value in output.items():
+        out[key] = DenseHist.from_hist(value, dtype) if isinstance(value, hist.Hist) else value
+    return out
+
+def expand(output):
+    """
+    Copy of the dictionary output, with its DenseHist as hist.Hist.
+    """
+    out = output.__class__()
+    for key, value in output.items():
+        out[key] = value.to_hist() if isinstance(value, DenseHist) else value
+    return out
+
+_MAGIC = b'decafhst'
+_TRAILER = struct.Struct('!Q8s')
+
+def save(output, filename, axis='dataset'):
+    """
+    Write the dictionary output to filename, with a block for each
+    category of axis of every DenseHist (and one for each other value).
+    """
+    index = {}
+    with open(filename, 'wb') as fout:
+        fout.write(_MAGIC)
+        def write(value):
+            payload = lz4f.compress(cloudpickle.dumps(value))
+            offset = fout.tell()
+            fout.write(payload)
+            return offset, len(payload)
+        for key, value in output.items():
+            if isinstance(value, DenseHist) and axis in [ax.name for ax in value._sparse]:
+                index[key] = (write(value.identity()), [(name,)+write(block) for name, block in value.split(axis)])
+            else:
+                index[key] = (write(value), None)
+        offset = fout.tell()
+        fout.write(lz4f.compress(cloudpickle.dumps((output.__class__, axis, index))))
+        fout.write(_TRAILER.pack(offset, _MAGIC))
+
+def _index(fin):
+    """
+    Class of the saved dictionary, axis it was split along and index of
+    its blocks, or None if fin was not written by save().
+    """
+    if fin.read(len(_MAGIC)) != _MAGIC: return None
+    fin.seek(-_TRAILER.size, os.SEEK_END)
+    end = fin.tell()
+    offset, magic = _TRAILER.unpack(fin.read(_TRAILER.size))
+    if magic != _MAGIC: raise IOError('Truncated histogram file '+fin.name)
+    fin.seek(offset)
+    return cloudpickle.loads(lz4f.decompress(fin.read(end-offset)))
+
+def _read(fin, location):
+    offset, size = location
+    fin.seek(offset)
+    return cloudpickle.loads(lz4f.decompress(fin.read(size)))
+
+def keys(filename):
+    """
+    Keys of the dictionary saved in filename, read from its index only.
+    """
+    with open(filename, 'rb') as fin:
+        index = _index(fin)
+    if index is None: return list(util.load(filename).keys())
+    return list(index[2].keys())
+
+def datasets(filename, key):
+    """
+    Categories of the split axis of the histogram key of filename.
+    """
+    with open(filename, 'rb') as fin:
+        index = _index(fin)
+    if index is None: return [b.name for b in util.load(filename)[key].identifiers('dataset')]
+    skeleton, blocks = index[2][key]
+    return [block[0] for block in blocks or []]
+
+def load(filename, keys=None, datasets=None):
+    """
+    Dictionary saved in filename, with only the values of keys (all of
+    them if None) and, for the histograms split by dataset, only the
+    datasets for which datasets(name) is true (all of them if None). Only
+    the blocks that are needed are read.
+    """
+    with open(filename, 'rb') as fin:
+        index = _index(fin)
+        if index is None:
+            output = util.load(filename)
+            if keys is None: return output
+            return output.__class__((key, output[key]) for key in keys if key in output)
+        cls, axis, entries = index
+        output = cls()
+        for key in (entries if keys is None else keys):
+            if key not in entries: continue
+            skeleton, blocks = entries[key]
+            if blocks is None:
+                output[key] = _read(fin, skeleton)
+                continue
+            blocks = [_read(fin, block[1:]) for block in blocks if datasets is None or datasets(block[0])]
+            output[key] = DenseHist.join(blocks, axis) if blocks else _read(fin, skeleton)
+    return output
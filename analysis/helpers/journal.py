@@ -0,0 +1,77 @@
+"""
+Append-only journal of the chunks processed for a dataset.
+
+Every record holds the (filename, entrystart, entrystop) of a chunk and
+the accumulator it produced, compressed with lz4. If a run dies, the
+records are replayed on restart, so that only the missing chunks have to
+be processed again. A record cut short by the crash is dropped.
+
+The journal starts with the version of the processor that wrote it, and
+a journal written by another processor, or by another version of it, is
+discarded instead of being replayed.
+"""
+import os
+import struct
+
+import cloudpickle
+import lz4.frame as lz4f
+
+class Journal(object):
+
+    def __init__(self, path, version=None):
+        self._path = path
+        self._header = ('journal', version)
+
+    def _read(self, fin):
+        """
+        Next record of fin, or None at the end of the file or at a record
+        cut short.
+        """
+        header = fin.read(8)
+        if len(header) < 8: return None
+        size, = struct.unpack('!Q', header)
+        payload = fin.read(size)
+        if len(payload) < size: return None
+        return cloudpickle.loads(lz4f.decompress(payload))
+
+    def _write(self, fout, value):
+        payload = lz4f.compress(cloudpickle.dumps(value))
+        fout.write(struct.pack('!Q', len(payload)))
+        fout.write(payload)
+
+    def replay(self, accumulator):
+        """
+        Add the journaled outputs to accumulator and return the set of
+        chunks they come from.
+        """
+        done = set()
+        if not os.path.exists(self._path): return done
+        with open(self._path, 'rb') as fin:
+            if self._read(fin) != self._header:
+                print('Discarding',self._path,'written by another version of the processor')
+                valid = 0
+            else:
+                valid = fin.tell()
+                while True:
+                    record = self._read(fin)
+                    if record is None: break
+                    key, output = record
+                    accumulator.add(output)
+                    done.add(key)
+                    valid = fin.tell()
+        if valid == 0:
+            os.remove(self._path)
+        elif valid < os.path.getsize(self._path):
+            with open(self._path, 'r+b') as fout:
+                fout.truncate(valid)
+        return done
+
+    def record(self, key, output):
+        with open(self._path, 'ab') as fout:
+            if fout.tell() == 0: self._write(fout, self._header)
+            self._write(fout, (key, output))
+            fout.flush()
+            os.fsync(fout.fileno())
+
+    def remove(self):
+        if os.path.exists(self._path): os.remove(self._path)
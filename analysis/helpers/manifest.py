@@ -0,0 +1,51 @@
+"""
+Manifests of the files summed into a .reduced or .merged file.
+
+The manifest of an output is a JSON file next to it, with the md5 of
+every input file it was made from (and, for the .merged files, the
+datasets each input contributed). Comparing it with the current inputs
+tells which of them are new, changed or gone, so that only those have to
+be summed again. The md5 of the output itself is recorded too: a
+manifest that does not describe the output next to it (for instance one
+left behind when the output was brought back from a condor job) is
+ignored, and everything is summed again.
+"""
+import hashlib
+import json
+import os
+
+def path(output):
+    return os.path.splitext(output)[0]+'.manifest'
+
+def digest(filename):
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 24), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def load(output):
+    """
+    Manifest of output, empty if output or its manifest do not exist, or
+    if the manifest was written for another version of output.
+    """
+    if not os.path.exists(output) or not os.path.exists(path(output)): return {}
+    with open(path(output)) as fin:
+        manifest = json.load(fin)
+    if manifest.get('output') != digest(output):
+        print('The manifest of',output,'does not match it, ignoring it')
+        return {}
+    return manifest['inputs']
+
+def save(output, entries):
+    with open(path(output), 'w') as fout:
+        json.dump({'output': digest(output), 'inputs': entries}, fout, indent=4, sort_keys=True)
+
+def compare(old, entries):
+    """
+    Names of the inputs of entries that are new or changed, and names of
+    the inputs of old that are changed or gone.
+    """
+    added = [name for name in entries if name not in old or old[name]['md5'] != entries[name]['md5']]
+    stale = [name for name in old if name not in entries or old[name]['md5'] != entries[name]['md5']]
+    return added, stale
@@ -0,0 +1,142 @@
+"""
+Streaming tree reduction of the histograms saved by run.py and reduce.py.
+
+The workers of a single pool, kept for the whole job, read the histograms
+from the files themselves and add them in place, up to fanin at a time.
+The partial sums are added fanin at a time too, as soon as enough of them
+have come back, so that the files are read while the first sums are being
+made. At most inflight histograms are read or held at any time.
+
+The histograms do not go through the pipes of the pool: the arrays of a
+sum are saved to a scratch directory (in /dev/shm, when there is one) and
+only their file names are sent along, the receiving process maps them in
+memory. The pipes therefore never carry more than a few kB, whatever the
+size of the histograms. A sum that does not fit in the scratch directory
+is saved in the temporary directory ($TMPDIR) instead.
+"""
+import concurrent.futures
+import copy
+import errno
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from helpers import histogram
+
+_ARRAYS = ('_filled', '_sumw', '_sumw2')
+
+def _put(h, directories):
+    """
+    Copy of the DenseHist h with its arrays saved in the first of
+    directories with enough free space, and replaced by the names of the
+    files.
+    """
+    nbytes = sum(getattr(h, name).nbytes for name in _ARRAYS if getattr(h, name) is not None)
+    for directory in directories:
+        last = directory == directories[-1]
+        if not last and shutil.disk_usage(directory).free < nbytes + (1 << 20): continue
+        fd, path = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        os.remove(path)
+        out = copy.copy(h)
+        try:
+            for name in _ARRAYS:
+                array = getattr(h, name)
+                if array is None: continue
+                setattr(out, name, path+name+'.npy')
+                np.save(path+name+'.npy', array)
+            return out
+        except OSError as e:
+            # Filled up by the other workers in the meantime
+            for name in _ARRAYS:
+                if isinstance(getattr(out, name), str) and os.path.exists(getattr(out, name)): os.remove(getattr(out, name))
+            if last or e.errno != errno.ENOSPC: raise
+
+def _get(h):
+    """
+    Inverse of _put(). The arrays are mapped copy-on-write, and their files
+    removed.
+    """
+    out = copy.copy(h)
+    for name in _ARRAYS:
+        filename = getattr(h, name)
+        if filename is None: continue
+        setattr(out, name, np.load(filename, mmap_mode='c'))
+        os.remove(filename)
+    return out
+
+def _load(filenames, key, directories):
+    """
+    Sum of the histogram key of filenames.
+    """
+    out = None
+    for filename in filenames:
+        h = histogram.compact(histogram.load(filename, [key]))[key]
+        if out is None: out = h
+        else: out.add(h)
+    return _put(out, directories)
+
+def _add(hists, directories):
+    return _put(_sum([_get(h) for h in hists]), directories)
+
+def _sum(hists):
+    out = hists[0]
+    for h in hists[1:]:
+        out.add(h)
+    return out
+
+class Reduction(object):
+
+    def __init__(self, workers=8, fanin=4, inflight=None, directory=None):
+        """
+        The partial sums are saved in directory (by default /dev/shm, when
+        there is one) and, when it is full, in the temporary directory.
+        """
+        if directory is None and os.path.isdir('/dev/shm'): directory = '/dev/shm'
+        self._directories = [tempfile.mkdtemp(prefix='reduction', dir=directory)]
+        if directory is not None and os.path.realpath(directory) != os.path.realpath(tempfile.gettempdir()):
+            self._directories.append(tempfile.mkdtemp(prefix='reduction'))
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self._fanin = max(fanin, 2)
+        self._inflight = max(inflight or 2*workers, self._fanin)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def sum(self, filenames, key):
+        """
+        Sum, as a DenseHist, of the histogram key of filenames.
+        """
+        leaves = [filenames[i:i+self._fanin] for i in range(0, len(filenames), self._fanin)]
+        partial = []
+        futures = set()
+        try:
+            while leaves or futures:
+                while leaves and len(futures)+len(partial) < self._inflight:
+                    futures.add(self._executor.submit(_load, leaves.pop(0), key, self._directories))
+                finished, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                partial.extend(job.result() for job in finished)
+                while len(partial) >= self._fanin:
+                    futures.add(self._executor.submit(_add, partial[:self._fanin], self._directories))
+                    partial = partial[self._fanin:]
+        except KeyboardInterrupt:
+            print("Ok quitter")
+            for job in futures: job.cancel()
+            raise
+        except:
+            for job in futures: job.cancel()
+            raise
+        out = _sum([_get(h) for h in partial])
+        for name in _ARRAYS:
+            if getattr(out, name) is not None: setattr(out, name, np.array(getattr(out, name)))
+        return out
+
+    def close(self):
+        self._executor.shutdown()
+        for directory in self._directories:
+            shutil.rmtree(directory, ignore_errors=True)
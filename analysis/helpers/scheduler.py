@@ -0,0 +1,301 @@
+"""
+Run a processor over the chunks of many datasets from a single pool of
+worker processes.
+
+All files are put in the same queue, largest first, so that workers
+freed by one dataset immediately pick up chunks of the next one instead
+of waiting for the pool to drain. The output of a dataset is handed back
+as soon as its last chunk is done.
+
+The processor instance is inherited by the workers when they are forked,
+rather than being pickled with every chunk.
+
+Chunks are cut from the queue only when a worker is about to be free, so
+that their size can follow a Controller: given a target time per chunk
+and/or a memory ceiling per worker, the chunk size is re-estimated from
+the time and peak memory of the chunks done so far.
+
+If a journal directory is given, the output of every chunk is recorded
+there as soon as it arrives, and a restarted run of the same processor
+only processes the entries that are missing from the journal, whatever
+the chunk size.
+
+With a Cache (see helpers/cache.py), the files that come next in the
+queue are copied locally in the background, and chunks are read from the
+local copies when they are ready.
+
+Skims (.parquet files, see helpers/skim.py) can be given in place of the
+original NanoAOD files.
+
+Every chunk also reports the resources it used: events, compressed bytes
+of the baskets read, CPU time and peak RSS of the worker. They are summed
+per dataset and handed to the callback together with the output.
+"""
+import concurrent.futures
+import math
+import os
+import resource
+import time
+
+import uproot
+from coffea.nanoaod import NanoEvents
+from helpers.journal import Journal
+from helpers import columns as _columns
+from helpers import skim as _skim
+
+_processor = None
+
+def numentries(filename, treename='Events'):
+    if filename.endswith('.parquet'):
+        return _skim.numentries(filename)
+    return uproot.open(filename)[treename].numentries
+
+def gaps(nentries, done):
+    """
+    Ranges of [0, nentries) not covered by the (entrystart, entrystop)
+    ranges in done. An empty file is one empty range, unless it is done,
+    so that its sum of weights is still accounted for.
+    """
+    if nentries == 0:
+        return [] if (0, 0) in done else [(0, 0)]
+    ranges, start = [], 0
+    for entrystart, entrystop in sorted(done):
+        if entrystart > start: ranges.append((start, entrystart))
+        start = max(start, entrystop)
+    if nentries > start: ranges.append((start, nentries))
+    return ranges
+
+def memory():
+    """
+    Current and peak RSS of the process in bytes, resetting the peak so
+    that the next call measures the peak in between. Falls back to the
+    peak over the whole life of the process where /proc does not allow it.
+    """
+    try:
+        rss = {}
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    rss[line.split(':')[0]] = int(line.split()[1]) * 1024
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+        return rss['VmRSS'], rss['VmHWM']
+    except (OSError, KeyError):
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return maxrss, maxrss
+
+class Controller(object):
+    """
+    Chunk size converging to target_seconds of processing per chunk, with
+    the peak RSS of a worker below max_memory bytes. The time and the
+    memory per event are averaged over the chunks done so far; until the
+    first ones are back, the initial chunksize is used.
+    """
+
+    def __init__(self, chunksize, target_seconds=None, max_memory=None, minimum=1000):
+        self.chunksize = chunksize
+        self._target_seconds = target_seconds
+        self._max_memory = max_memory
+        self._minimum = minimum
+        self._events = 0
+        self._seconds = 0.
+        self._growth = 0.
+        self._baseline = 0
+
+    def update(self, usage):
+        if self._target_seconds is None and self._max_memory is None: return
+        if usage['events'] == 0: return
+        self._events += usage['events']
+        self._seconds += usage['seconds']
+        self._growth += max(usage['maxrss'] - usage['rss'], 0)
+        self._baseline = max(self._baseline, usage['rss'])
+        sizes = []
+        if self._target_seconds is not None and self._seconds > 0:
+            sizes.append(self._target_seconds * self._events / self._seconds)
+        if self._max_memory is not None and self._growth > 0:
+            sizes.append((self._max_memory - self._baseline) * self._events / self._growth)
+        if sizes: self.chunksize = max(int(min(sizes)), self._minimum)
+
+def chunkbytes(tree, branches, entrystart, entrystop):
+    """
+    Compressed size of the baskets of branches that overlap the chunk.
+    """
+    available = set(k.decode() for k in tree.keys())
+    total = 0
+    for name in branches:
+        if name not in available: continue
+        branch = tree[name]
+        for i in range(branch.numbaskets):
+            if branch.basket_entrystart(i) < entrystop and branch.basket_entrystop(i) > entrystart:
+                total += branch.basket_compressedbytes(i)
+    return total
+
+def work(dataset, filename, entrystart, entrystop, columns=None, path=None, treename='Events'):
+    tstart = time.time()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    rss, _ = memory()
+    metadata = {
+        'dataset':    dataset,
+        'filename':   filename,
+        'treename':   treename,
+        'entrystart': entrystart,
+        'entrystop':  entrystop,
+    }
+    if filename.endswith('.parquet'):
+        events = _skim.load(filename, entrystart, entrystop, metadata)
+        output = _processor.process(events)
+        nbytes = os.path.getsize(filename)
+    else:
+        rootfile = uproot.open(path or filename)
+        tree = rootfile[treename]
+        if columns is None:
+            tracer = _columns.Tracer()
+            events = NanoEvents.from_file(file=rootfile, treename=treename, entrystart=entrystart, entrystop=entrystop, metadata=metadata, cache=tracer)
+            output = _processor.process(events)
+            columns = tracer.branches
+        else:
+            events = _columns.load(tree, columns, entrystart, entrystop, metadata)
+            output = _processor.process(events)
+        nbytes = chunkbytes(tree, columns, entrystart, entrystop)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    _, maxrss = memory()
+    usage = {
+        'events':  entrystop - entrystart,
+        'bytes':   nbytes,
+        'cpu':     (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime),
+        'seconds': time.time() - tstart,
+        'rss':     rss,
+        'maxrss':  maxrss,
+    }
+    return dataset, (filename, entrystart, entrystop), output, usage
+
+def run(fileset, processor_instance, callback, workers=8, nentries=None, chunksize=100000, journal=None, columns=None, target_seconds=None, max_memory=None, cache=None, failed=None, version=None):
+    """
+    Process all the datasets in fileset ({dataset: [files]}) and call
+    callback(dataset, output, usage) with the postprocessed output of each
+    one and the resources used by its chunks in this run.
+    nentries can provide the number of entries of the files, for instance
+    from the catalog; the missing ones are read from the files.
+    columns ({dataset: [branches]}) restricts the branches that are read.
+    target_seconds and max_memory make the chunk size adaptive, starting
+    from chunksize. cache copies the upcoming files locally. failed(filename,
+    error) is called before re-raising the error of a chunk that failed.
+    version identifies the processor in the journals: the ones written
+    with another version are discarded.
+    """
+    global _processor
+    _processor = processor_instance
+    controller = Controller(chunksize, target_seconds, max_memory)
+    columns = columns or {}
+
+    nentries = dict(nentries or {})
+    missing = list(set(filename for files in fileset.values() for filename in files if filename not in nentries))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for filename, n in zip(missing, executor.map(numentries, missing)):
+            nentries[filename] = n
+
+        outputs = {dataset: processor_instance.accumulator.identity() for dataset in fileset}
+        journals = {}
+        done = {}
+        if journal is not None:
+            os.makedirs(journal, exist_ok=True)
+            for dataset in fileset:
+                journals[dataset] = Journal(os.path.join(journal, dataset+'.journal'), version)
+                for filename, entrystart, entrystop in journals[dataset].replay(outputs[dataset]):
+                    done.setdefault((dataset, filename), set()).add((entrystart, entrystop))
+            if done: print('Resuming from',sum(len(ranges) for ranges in done.values()),'journaled chunks')
+
+        pending = []
+        for dataset, files in fileset.items():
+            for filename in files:
+                for entrystart, entrystop in gaps(nentries[filename], done.get((dataset, filename), set())):
+                    pending.append((dataset, filename, entrystart, entrystop))
+        pending.sort(key=lambda item: item[3]-item[2], reverse=True)
+        print('Processing',sum(item[3]-item[2] for item in pending),'entries from',len(fileset),'datasets')
+
+        usage = {dataset: {'events': 0, 'bytes': 0, 'cpu': 0., 'maxrss': 0} for dataset in fileset}
+        started = {}
+
+        def finish(dataset):
+            # From the first chunk of the dataset submitted to its last one
+            # done, not from the start of the run: with several datasets in
+            # the pool, each one only occupies part of it
+            usage[dataset]['wall'] = time.time() - started.get(dataset, time.time())
+            callback(dataset, processor_instance.postprocess(outputs.pop(dataset)), usage.pop(dataset))
+            if dataset in journals: journals.pop(dataset).remove()
+            if cache is not None: cache.release(fileset[dataset])
+
+        remaining = {dataset: 0 for dataset in fileset}
+        for item in pending:
+            remaining[item[0]] += 1
+        for dataset in fileset:
+            if remaining[dataset] == 0: finish(dataset)
+
+        def submit():
+            """
+            Cut the next chunk from the first pending range with the current
+            chunk size, splitting the range evenly the same way coffea does.
+            """
+            dataset, filename, entrystart, entrystop = pending[0]
+            n = max(round((entrystop - entrystart) / controller.chunksize), 1)
+            size = math.ceil((entrystop - entrystart) / n)
+            if entrystart + size < entrystop:
+                pending[0] = (dataset, filename, entrystart + size, entrystop)
+                remaining[dataset] += 1
+            else:
+                pending.pop(0)
+            path = cache.get(filename) if cache is not None else None
+            started.setdefault(dataset, time.time())
+            job = executor.submit(work, dataset, filename, entrystart, entrystart + size, columns=columns.get(dataset), path=path)
+            origin[job] = filename
+            return job
+
+        def prefetch():
+            """
+            Copy the next files in the queue, after the ones being read.
+            """
+            if cache is None: return
+            upcoming = []
+            for item in pending[1:]:
+                if item[1] not in upcoming: upcoming.append(item[1])
+                if len(upcoming) == workers: break
+            cache.prefetch(upcoming)
+
+        futures = set()
+        origin = {}
+        try:
+            while pending and len(futures) < 2*workers:
+                futures.add(submit())
+            prefetch()
+            while futures:
+                finished, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for job in finished:
+                    try:
+                        dataset, key, output, chunk = job.result()
+                    except Exception as e:
+                        if failed is not None: failed(origin[job], e)
+                        raise
+                    del origin[job]
+                    if dataset in journals: journals[dataset].record(key, output)
+                    outputs[dataset].add(output)
+                    controller.update(chunk)
+                    for k in ['events', 'bytes', 'cpu']:
+                        usage[dataset][k] += chunk[k]
+                    usage[dataset]['maxrss'] = max(usage[dataset]['maxrss'], chunk['maxrss'])
+                    remaining[dataset] -= 1
+                    if remaining[dataset] == 0: finish(dataset)
+                while pending and len(futures) < 2*workers:
+                    futures.add(submit())
+                prefetch()
+        except KeyboardInterrupt:
+            # Re-raised, so that run.py neither saves the datasets that are
+            # not done nor marks their files good
+            print("Ok quitter")
+            for job in futures: job.cancel()
+            raise
+        except:
+            for job in futures: job.cancel()
+            raise
+    if target_seconds is not None or max_memory is not None:
+        print('Final chunk size:',controller.chunksize)
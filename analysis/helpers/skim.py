@@ -0,0 +1,129 @@
+"""
+Skims of the input NanoAOD files, stored as local Parquet files.
+
+The processor is run in preselection mode: when events.metadata has a
+'skim' entry, it returns the union of its region selections, leaving out
+the cuts whose name starts with one of the given prefixes, instead of
+filling histograms. Only the surviving events and the branches the
+processor reads are written, one Parquet file per input file. Jagged
+branches become list columns; the genEventSumw of the original file is
+kept in the file metadata, since the skim has no Runs tree.
+
+The skims are read back as NanoEvents by the scheduler, in place of the
+original files.
+"""
+import hashlib
+import os
+
+import awkward
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import uproot
+from helpers.catalog import runsum
+from helpers.columns import from_arrays
+
+_processor = None
+
+def path(directory, dataset, filename):
+    """
+    Location of the skim of a file. The hash of the full url avoids
+    clashes between files with the same name in different folders.
+    """
+    name = os.path.basename(filename).replace('.root', '')
+    return os.path.join(directory, dataset, name+'_'+hashlib.md5(filename.encode()).hexdigest()[:8]+'.parquet')
+
+def concatenate(pieces):
+    if isinstance(pieces[0], awkward.JaggedArray):
+        pieces = [piece.compact() for piece in pieces]
+        counts = np.concatenate([piece.counts for piece in pieces])
+        return awkward.JaggedArray.fromcounts(counts, np.concatenate([piece.content for piece in pieces]))
+    return np.concatenate(pieces)
+
+def write(output, arrays, sumw=None, row_group_size=None):
+    names = sorted(arrays.keys())
+    columns = []
+    for name in names:
+        array = arrays[name]
+        if isinstance(array, awkward.JaggedArray):
+            columns.append(pa.ListArray.from_arrays(pa.array(array.offsets.astype(np.int32)), pa.array(array.content)))
+        else:
+            columns.append(pa.array(array))
+    table = pa.Table.from_arrays(columns, names=names)
+    if sumw is not None:
+        table = table.replace_schema_metadata({b'genEventSumw': str(sumw).encode()})
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    pq.write_table(table, output+'.tmp', row_group_size=row_group_size)
+    os.rename(output+'.tmp', output)
+
+def skim(dataset, filename, output, columns, exclude, chunksize=100000, treename='Events'):
+    """
+    Write the events of filename that pass the preselection to output and
+    return the number of events read and kept.
+    """
+    rootfile = uproot.open(filename)
+    tree = rootfile[treename]
+    available = set(k.decode() for k in tree.keys())
+    branches = [c for c in columns if c in available]
+
+    sumw = None
+    try:
+        sumw = runsum(rootfile['Runs'], 'genEventSumw')
+    except KeyError:
+        pass
+
+    pieces = {branch: [] for branch in branches}
+    for entrystart in range(0, max(tree.numentries, 1), chunksize):
+        entrystop = min(tree.numentries, entrystart+chunksize)
+        arrays = tree.arrays(branches, entrystart=entrystart, entrystop=entrystop, namedecode='ascii')
+        metadata = {
+            'dataset':    dataset,
+            'filename':   filename,
+            'treename':   treename,
+            'entrystart': entrystart,
+            'entrystop':  entrystop,
+            'skim':       exclude,
+        }
+        flat = {k: v.flatten() if isinstance(v, awkward.JaggedArray) else v for k, v in arrays.items()}
+        mask = _processor.process(from_arrays(flat, metadata))
+        if not isinstance(mask, np.ndarray):
+            raise RuntimeError('The processor does not support the preselection mode')
+        for branch in branches:
+            pieces[branch].append(arrays[branch][mask])
+
+    arrays = {branch: concatenate(pieces[branch]) for branch in branches}
+    write(output, arrays, sumw, chunksize)
+    return tree.numentries, len(arrays[branches[0]]) if branches else 0
+
+def numentries(filename):
+    return pq.ParquetFile(filename).metadata.num_rows
+
+def load(filename, entrystart, entrystop, metadata):
+    """
+    Read a chunk of a skim as NanoEvents, from the row groups that overlap
+    it only. The genEventSumw of the original file is passed on in
+    metadata['sumw'].
+    """
+    parquetfile = pq.ParquetFile(filename)
+    filemetadata = parquetfile.metadata
+    if filemetadata.metadata and b'genEventSumw' in filemetadata.metadata:
+        metadata['sumw'] = float(filemetadata.metadata[b'genEventSumw'])
+    groups = []
+    first = None
+    start = 0
+    for i in range(filemetadata.num_row_groups):
+        stop = start + filemetadata.row_group(i).num_rows
+        if start < entrystop and stop > entrystart:
+            groups.append(i)
+            if first is None: first = start
+        start = stop
+    table = parquetfile.read_row_groups(groups)
+    table = table.slice(entrystart-(first or 0), entrystop-entrystart)
+    arrays = {}
+    for name, column in zip(table.column_names, table.columns):
+        if isinstance(column.type, pa.ListType):
+            chunks = [chunk.flatten().to_numpy(zero_copy_only=False) for chunk in column.chunks]
+        else:
+            chunks = [chunk.to_numpy(zero_copy_only=False) for chunk in column.chunks]
+        arrays[name] = np.concatenate(chunks) if chunks else np.array([])
+    return from_arrays(arrays, metadata)
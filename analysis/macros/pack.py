@@ -9,9 +9,14 @@ import subprocess
 import concurrent.futures
 import warnings
 import os
+import sys
 import difflib
 from optparse import OptionParser
+
+# data and helpers live in the parent directory, analysis/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from data.process import *
+from helpers.catalog import Catalog
 
 parser = OptionParser()
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset')
@@ -19,6 +24,13 @@ parser.add_option('-y', '--year', help='year', dest='year')
 parser.add_option('-m', '--metadata', help='metadata', dest='metadata')
 parser.add_option('-p', '--pack', help='pack', dest='pack')
 parser.add_option('-s', '--special', help='special', dest='special')
+parser.add_option('-w', '--workers', help='Number of concurrent xrdfs calls', dest='workers', type=int, default=16)
+parser.add_option('-c', '--cache', help='Directory listing cache', dest='cache', default='metadata/.xrdfs_cache.json')
+parser.add_option('-r', '--refresh', action='store_true', dest='refresh', help='Ignore the listing cache')
+parser.add_option('-e', '--events', help='Target number of events per batch', dest='events', type=int)
+parser.add_option('-b', '--bytes', help='Target number of compressed bytes per batch', dest='bytes', type=int)
+parser.add_option('-k', '--catalog', help='File catalog', dest='catalog', default='metadata/catalog.db')
+parser.add_option('--recheck', action='store_true', dest='recheck', help='Inspect again the files marked bad in the catalog')
 (options, args) = parser.parse_args()
 fnaleos = "root://cmseos.fnal.gov/"
 #fnaleos = "root://cmsxrootd.fnal.gov/"
@@ -49,17 +61,80 @@ def split(arr, size):
      arrs.append(arr)
      return arrs
 
-def find(_list):
-     if not _list:
-          return []
-     files=[]
-     print('Looking into',_list)
-     for path in _list:
-          command='xrdfs '+fnaleos+' ls '+path
-          results=os.popen(command).read()
-          files.extend(results.split())
-     if not any('.root' in _file for _file in files):
-          files=find(files)
+def balance(arr, sizes, target):
+     """
+     Pack consecutive files until the sum of their sizes reaches target,
+     so that batches have comparable numbers of events (or bytes) rather
+     than comparable numbers of files.
+     """
+     arrs = []
+     pice = []
+     total = 0
+     for url in arr:
+          pice.append(url)
+          total += sizes[url]
+          if total >= target:
+               arrs.append(pice)
+               pice = []
+               total = 0
+     if pice or not arrs: arrs.append(pice)
+     return arrs
+
+def xrdls(path):
+     """
+     List a directory through xrdfs, returning one (path, isdir, mtime)
+     tuple per entry.
+     """
+     command='xrdfs '+fnaleos+' ls -l '+path
+     results=subprocess.run(command.split(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+     entries=[]
+     for line in results.splitlines():
+          fields=line.split()
+          if len(fields)<5: continue
+          entries.append((fields[-1], fields[0].startswith('d'), fields[1]+' '+fields[2]))
+     return entries
+
+def xrdmtime(path):
+     command='xrdfs '+fnaleos+' stat '+path
+     results=subprocess.run(command.split(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+     for line in results.splitlines():
+          if line.startswith('MTime:'): return line.split(':',1)[1].strip()
+     return None
+
+def visit(path, mtime, cache):
+     """
+     Return the entries of a directory, listing it only if its mtime
+     differs from the one recorded in the cache. When the mtime is not
+     known from a fresh listing of the parent, it is obtained with a stat.
+     """
+     if mtime is None: mtime=xrdmtime(path)
+     cached=cache.get(path)
+     if mtime is not None and cached is not None and cached['mtime']==mtime:
+          # Subdirectory mtimes stored in the cache may be stale: stat them again
+          return [(_path, isdir, None if isdir else _mtime) for _path, isdir, _mtime in cached['entries']]
+     entries=xrdls(path)
+     if mtime is not None and entries: cache[path]={'mtime': mtime, 'entries': entries}
+     return entries
+
+def find(_list, cache, workers):
+     """
+     Crawl the directories in _list breadth-first, with at most workers
+     concurrent xrdfs calls. As soon as a directory contains rootfiles,
+     its entries are returned and its subdirectories are not explored.
+     """
+     files={path:[] for path, mtime in _list}
+     frontier=[(path, mtime, path) for path, mtime in _list]
+     with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+          while frontier:
+               print('Looking into',len(frontier),'directories')
+               jobs=[(root, executor.submit(visit, path, mtime, cache)) for path, mtime, root in frontier]
+               frontier=[]
+               for root, job in jobs:
+                    entries=job.result()
+                    if any('.root' in _path for _path, isdir, _mtime in entries):
+                         files[root].extend(_path for _path, isdir, _mtime in entries if not isdir)
+                    else:
+                         frontier.extend((_path, _mtime, root) for _path, isdir, _mtime in entries if isdir)
      return files
   
 xsections={}
@@ -73,46 +148,86 @@ for k,v in processes.items():
      else:
           xsections[k] = -1
 
-datadef = {}
+cache={}
+if not options.refresh and os.path.exists(options.cache):
+     with open(options.cache) as fin:
+          cache = json.load(fin)
+
+roots = []
 for folder in beans[options.year]:
-    for dataset in xsections.keys():
+    for path, isdir, mtime in visit(folder, None, cache):
+        if not isdir: continue
+        dataset = path.split('/')[-1]
+        if dataset not in xsections: continue
         if options.dataset:
              if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
-        xs = xsections[dataset]
+        roots.append((path, mtime))
+listings = find(roots, cache, options.workers)
+
+with open(options.cache, "w") as fout:
+    json.dump(cache, fout)
+
+urllists = {}
+for folder in beans[options.year]:
+    for dataset in xsections.keys():
         path=folder+'/'+dataset
-        urllist = find([path])
-        for url in urllist:
-            if 'failed' in url: 
-                 urllist.remove(url)
-                 continue
-            if '.root' not in url: 
-                 urllist.remove(url)
-                 continue
-            if 'nano' not in url: 
-                 urllist.remove(url)
-                 continue
-            urllist[urllist.index(url)]=url.replace('/store/',fnaleos+'/store/')
+        if path not in listings: continue
+        urllists[path] = [url.replace('/store/',fnaleos+'/store/') for url in listings[path]
+                          if 'failed' not in url and '.root' in url and 'nano' in url]
+
+catalog = Catalog(options.catalog)
+catalog.fill([url for urllist in urllists.values() for url in urllist], options.workers)
+if options.recheck:
+     catalog.fill(list(catalog.bad([url for urllist in urllists.values() for url in urllist])), options.workers, refresh=True)
+sizes = {}
+for path in urllists:
+     bad = catalog.bad(urllists[path])
+     if bad: print('Skipping',len(bad),'files that could not be read in',path)
+     urllists[path] = [url for url in urllists[path] if url not in bad]
+     for url in urllists[path]:
+          row = catalog.get(url)
+          sizes[url] = {'nevents': row['nevents'], 'bytes': row['bytes'], 'sumw': row['sumw']}
+catalog.close()
+
+datadef = {}
+for folder in beans[options.year]:
+    for dataset in xsections.keys():
+        path=folder+'/'+dataset
+        if path not in urllists: continue
+        xs = xsections[dataset]
+        urllist = urllists[path]
             
         print('list lenght:',len(urllist))
-        if options.special:
+        if options.events:
+             print('Packing',options.events,'events per batch for dataset',dataset)
+             batches = balance(urllist, {url: sizes[url]['nevents'] for url in urllist}, options.events)
+        elif options.bytes:
+             print('Packing',options.bytes,'bytes per batch for dataset',dataset)
+             batches = balance(urllist, {url: sizes[url]['bytes'] for url in urllist}, options.bytes)
+        elif options.special:
              for special in options.special.split(','):
                   sdataset, spack = special.split(':')
                   if sdataset in dataset:
                        print('Packing',spack,'files for dataset',dataset)
-                       urllists = split(urllist, int(spack))
+                       batches = split(urllist, int(spack))
                   else:
                        print('Packing',int(options.pack),'files for dataset',dataset)
-                       urllists = split(urllist, int(options.pack))
+                       batches = split(urllist, int(options.pack))
         else:
              print('Packing',int(options.pack),'files for dataset',dataset)
-             urllists = split(urllist, int(options.pack))
-        print(len(urllists))
+             batches = split(urllist, int(options.pack))
+        print(len(batches))
         if urllist:
-            for i in range(0,len(urllists)) :
+            for i in range(0,len(batches)) :
                  datadef[dataset+"____"+str(i)+"_"] = {
-                      'files': urllists[i],
+                      'files': batches[i],
                       'xs': xs,
                       }
+                 if sizes:
+                      datadef[dataset+"____"+str(i)+"_"]['nevents'] = sum(sizes[url]['nevents'] for url in batches[i])
+                      datadef[dataset+"____"+str(i)+"_"]['bytes'] = sum(sizes[url]['bytes'] for url in batches[i])
+                      if xs != -1 and all(sizes[url]['sumw'] is not None for url in batches[i]):
+                           datadef[dataset+"____"+str(i)+"_"]['sumw'] = sum(sizes[url]['sumw'] for url in batches[i])
         
 folder = "metadata/"+options.metadata+".json"
 with open(folder, "w") as fout:
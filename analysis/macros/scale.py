@@ -1,11 +1,20 @@
 import cloudpickle
 import pickle
 import gzip
+import json
+import math
 import os
+import re
+import sys
+import warnings
 from collections import defaultdict, OrderedDict
 from coffea import hist, processor 
 from coffea.util import load, save
 
+# helpers lives in the parent directory, analysis/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helpers import histogram
+
 xsec = {
     ### 2018 signal, mhs = 50 GeV
     "Mz200_mhs50_Mdm100": 0.06606,
@@ -116,10 +125,31 @@ xsec = {
     "Mz3000_mhs150_Mdm1500": 0.000004007,
 }
 
-def scale_file(file):
+def load_sumw(metadata):
+    """
+    Sum of the generator weights per primary dataset, as stored by
+    macros/pack.py in the metadata JSON files from the Runs trees.
+    Datasets with any batch lacking the information are left out.
+    """
+    sumw = {}
+    missing = set()
+    for name in metadata.split(','):
+        with open('metadata/'+name+'.json') as fin:
+            datadef = json.load(fin)
+        for dataset, info in datadef.items():
+            pdi = dataset.split("____")[0]
+            if 'sumw' not in info:
+                missing.add(pdi)
+                continue
+            sumw[pdi] = sumw.get(pdi, 0.) + info['sumw']
+    for pdi in missing:
+        sumw.pop(pdi, None)
+    return sumw
+
+def scale_file(file, sumw=None):
 
     print('Loading file:',file)    
-    hists=load(file)
+    hists=histogram.expand(histogram.load(file))
 
     pd = []
     for d in hists['sumw'].identifiers('dataset'):
@@ -140,35 +170,61 @@ def scale_file(file):
         hists[key] = hists[key].group(dataset_cats, dataset, dataset_map)
     print('Datasets aggregated')
 
-    return scale(hists)
+    return scale(hists, sumw)
 
-def scale_directory(directory):
+def scale_directory(directory, sumw=None):
 
     hists = {}
     for filename in os.listdir(directory):
         if '.merged' not in filename: continue
         print('Opening:', filename)
-        hin = load(directory+'/'+filename)
+        hin = histogram.expand(histogram.load(directory+'/'+filename))
         hists.update(hin)
 
-    return scale(hists)
+    return scale(hists, sumw)
+
+def resolve(mapping, datasets):
+    """
+    mapping with its glob patterns replaced by the list of the datasets
+    they match, as hist.Hist.group would match them.
+    """
+    out = OrderedDict()
+    for key, pattern in mapping.items():
+        if isinstance(pattern, tuple): pattern, = pattern
+        regex = re.compile("^" + re.escape(pattern).replace(r'\*', '.*') + "$")
+        out[key] = [d for d in datasets if regex.match(d)]
+    return out
 
-def scale(hists):
+def scale(hists, sumw=None):
 
     ###
     # Rescaling MC histograms using the xsec weight
     ###
 
+    datasets = [d.name for d in hists['sumw'].identifiers('dataset')]
     scale={}
-    for d in hists['sumw'].identifiers('dataset'):
-        scale[d]=hists['sumw'].integrate('dataset', d).values(overflow='all')[()][1]
+    for (d,), values in hists['sumw'].values(overflow='all').items():
+        scale[d]=values[1]
+        # The metadata sums cover every file listed for the dataset, including
+        # the ones that were skipped or failed: they are only used when the
+        # files that were processed add up to the same sum
+        pdi = d.split('--')[-1]
+        if sumw and pdi in sumw:
+            if math.isclose(sumw[pdi], values[1], rel_tol=1e-4): scale[d]=sumw[pdi]
+            else: warnings.warn('The sumw of '+d+' from the metadata ('+str(sumw[pdi])+') differs from the one of the processed files ('+str(values[1])+'), some files were not processed: keeping the latter')
     print('Sumw extracted')
 
+    isdata = lambda d: 'MET' in d or 'SingleElectron' in d or 'SinglePhoton' in d or 'EGamma' in d or 'BTagMu' in d
+    weight={}
+    for d in datasets:
+        if isdata(d): continue
+        weight[d]=1/scale[d]
     for key in hists.keys():
         if key=='sumw': continue
-        for d in hists[key].identifiers('dataset'):
-            if 'MET' in d.name or 'SingleElectron' in d.name or 'SinglePhoton' in d.name or 'EGamma' in d.name or 'BTagMu' in d.name: continue
-            hists[key].scale({d:1/scale[d]},axis='dataset')
+        present = set(d.name for d in hists[key].identifiers('dataset'))
+        missing = [d for d in present if d not in weight and not isdata(d)]
+        if missing: raise KeyError('No sumw for the datasets '+', '.join(sorted(missing))+' of '+key)
+        hists[key].scale({d: w for d, w in weight.items() if d in present},axis='dataset')
     print('Histograms scaled')
 
 
@@ -215,12 +271,15 @@ def scale(hists):
     data_map["SinglePhoton"] = ("SinglePhoton*", )
     data_map["EGamma"] = ("EGamma*", )
     data_map["BTagMu"] = ("BTagMu*", )
-    for signal in hists['sumw'].identifiers('dataset'):
-        if 'mhs' not in str(signal): continue
+    for signal in datasets:
+        if 'mhs' not in signal: continue
         print(signal)
-        sig_map[str(signal)] = (str(signal),)  ## signals
+        sig_map[signal] = (signal,)  ## signals
+    maps = [resolve(m, datasets) for m in (bkg_map, data_map, sig_map)]
     print('Processes defined')
-    
+    for signal in sig_map:
+        print('Scaling '+signal+' by xsec '+str(xsec[signal]))
+
     ###
     # Storing signal and background histograms
     ###
@@ -228,12 +287,12 @@ def scale(hists):
     sig_hists={}
     data_hists={}
     for key in hists.keys():
-        bkg_hists[key] = hists[key].group(cats, process, bkg_map)
-        data_hists[key] = hists[key].group(cats, process, data_map)
-        sig_hists[key] = hists[key].group(cats, process, sig_map)
-        for signal in sig_hists[key].identifiers('process'):
-            print('Scaling '+str(signal)+' by xsec '+str(xsec[str(signal)]))
-            sig_hists[key].scale({signal:xsec[str(signal)]},axis='process')
+        present = set(d.name for d in hists[key].identifiers('dataset'))
+        bkg, data, sig = [OrderedDict((p, ([d for d in names if d in present],)) for p, names in m.items()) for m in maps]
+        bkg_hists[key] = hists[key].group(cats, process, bkg)
+        data_hists[key] = hists[key].group(cats, process, data)
+        sig_hists[key] = hists[key].group(cats, process, sig)
+        sig_hists[key].scale({signal: xsec[signal] for signal in sig if sig[signal][0]},axis='process')
         
     print('Histograms grouped')
 
@@ -244,13 +303,18 @@ if __name__ == '__main__':
     parser = OptionParser()
     parser.add_option('-f', '--file', help='file', dest='file')
     parser.add_option('-d', '--directory', help='directory', dest='directory')
+    parser.add_option('-m', '--metadata', help='Check sumw against the Runs trees recorded in these metadata files', dest='metadata')
     (options, args) = parser.parse_args()
 
+    sumw = None
+    if options.metadata:
+        sumw = load_sumw(options.metadata)
+
     if options.directory: 
-        bkg_hists, sig_hists, data_hists = scale_directory(options.directory)
+        bkg_hists, sig_hists, data_hists = scale_directory(options.directory, sumw)
         name = options.directory
     if options.file: 
-        bkg_hists, sig_hists, data_hists = scale_file(options.file)
+        bkg_hists, sig_hists, data_hists = scale_file(options.file, sumw)
         name = options.file.split(".")[0]
 
     hists={
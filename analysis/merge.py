@@ -7,70 +7,47 @@ import numpy as np
 from collections import defaultdict, OrderedDict
 from coffea import hist, processor 
 from coffea.util import load, save
-from helpers.futures_patch import patch_mp_connection_bpo_17560
+from helpers import histogram, manifest
+from helpers.reduction import Reduction
 
-def add(chunk_tmp_arr):
-     print('Job started')
-     return np.sum(chunk_tmp_arr)
+def merge(folder,variable=None, exclude=None, workers=16, fanin=4, inflight=None, rebuild=False, scratch=None):
 
-def futuresum(tmp_arr):
-     while np.size(tmp_arr)>1:
-          chunk_sum=[]
-          chunk_tmp_arr = np.array_split(tmp_arr, int(np.size(tmp_arr)/2))
-          if len(chunk_tmp_arr)>1:
-               with concurrent.futures.ProcessPoolExecutor(max_workers=16) as executor:
-                    futures = set()
-                    futures.update(executor.submit(add,chunk_tmp_arr[i]) for i in range(0,len(chunk_tmp_arr)))
-                    if(len(futures)==0): continue
-                    try:
-                         total = len(futures)
-                         processed = 0
-                         while len(futures) > 0:
-                              finished = set(job for job in futures if job.done())
-                              for job in finished:
-                                   chunk_i = job.result()
-                                   chunk_sum.append(chunk_i)
-                              futures -= finished
-                         del finished
-                    except KeyboardInterrupt:
-                         print("Ok quitter")
-                         for job in futures: job.cancel()
-                    except:
-                         for job in futures: job.cancel()
-                         raise
-          else:
-               chunk_sum.append(add(chunk_tmp_arr[0]))
-          tmp_arr=np.array(chunk_sum)
-          print(tmp_arr)
-     return tmp_arr
+     with Reduction(workers, fanin, inflight, scratch) as reduction:
+          lists = {}
+          for filename in os.listdir(folder):
+               if '.reduced' not in filename: continue
+               if filename.split('--')[0] not in lists: lists[filename.split('--')[0]] = []
+               lists[filename.split('--')[0]].append(folder+'/'+filename)
 
-def merge(folder,variable=None, exclude=None):
-
-     lists = {}
-     for filename in os.listdir(folder):
-          if '.reduced' not in filename: continue
-          if filename.split('--')[0] not in lists: lists[filename.split('--')[0]] = []
-          lists[filename.split('--')[0]].append(folder+'/'+filename)
-
-     for var in lists.keys():
-          tmp={}
-          if variable is not None:
-               if not any(v==var for v in variable.split(',')): continue
-          if exclude is not None:
-               if any(v==var for v in exclude.split(',')): continue
-          print(lists[var])
-          for filename in lists[var]:
-               print('Opening:',filename)
-               hin = load(filename)
-               if var not in tmp: tmp[var]=[hin[var]]
-               else: tmp[var].append(hin[var])
-               del hin
-          print(tmp)
-          tmp_arr=futuresum(np.array(tmp[var]))
-          hists = {}
-          hists[var]=tmp_arr[0]
-          print(hists)
-          save(hists, folder+'/'+var+'.merged')
+          for var in lists.keys():
+               if variable is not None:
+                    if not any(v==var for v in variable.split(',')): continue
+               if exclude is not None:
+                    if any(v==var for v in exclude.split(',')): continue
+               print(lists[var])
+               output = folder+'/'+var+'.merged'
+               entries = {}
+               for filename in lists[var]:
+                    entries[os.path.basename(filename)] = {'md5': manifest.digest(filename), 'datasets': histogram.datasets(filename, var)}
+               old = {} if rebuild else manifest.load(output)
+               added, stale = manifest.compare(old, entries)
+               if old and not added and not stale:
+                    print('Variable',var,'is up to date')
+                    continue
+               # The datasets of the changed or removed files are dropped from
+               # the existing sum, and summed again from the current files
+               stale_datasets = set(d for name in stale for d in old[name]['datasets'])
+               files = [filename for filename in lists[var] if not old or os.path.basename(filename) in added or stale_datasets.intersection(entries[os.path.basename(filename)]['datasets'])]
+               print('Merging',len(files),'files')
+               hists = {}
+               if old:
+                    hists[var] = histogram.load(output, [var], lambda d: d not in stale_datasets)[var]
+                    if files: hists[var].add(reduction.sum(files, var))
+               else:
+                    hists[var]=reduction.sum(files, var)
+               print(hists)
+               histogram.save(hists, output)
+               manifest.save(output, entries)
 
 
 def postprocess(folder):
@@ -86,7 +63,7 @@ def postprocess(folder):
      for variable in variables:
           filename = folder+'/'+variable+'.merged'
           print('Opening:',filename)
-          hin = load(filename)
+          hin = histogram.expand(histogram.load(filename))
           hists.update(hin)
      print(hists)
      save(hists,folder+'.merged')
@@ -100,10 +77,14 @@ if __name__ == '__main__':
     parser.add_option('-v', '--variable', help='variable', dest='variable', default=None)
     parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default=None)
     parser.add_option('-p', '--postprocess', action='store_true', dest='postprocess')
+    parser.add_option('-w', '--workers', help='Number of workers', dest='workers', type=int, default=16)
+    parser.add_option('--scratch', help='Directory where the partial sums are handed between the workers (default: /dev/shm, or $TMPDIR when full)', dest='scratch')
+    parser.add_option('--rebuild', action='store_true', dest='rebuild', help='Sum all the files again, even the ones already in the .merged files')
+    parser.add_option('--fanin', help='Number of histograms added by each worker task', dest='fanin', type=int, default=4)
+    parser.add_option('--inflight', help='Maximum number of histograms read or held at once (default: twice the workers)', dest='inflight', type=int)
     (options, args) = parser.parse_args()
 
-    patch_mp_connection_bpo_17560()    
     if options.postprocess:
          postprocess(options.folder)
     else:
-         merge(options.folder,options.variable,options.exclude)
+         merge(options.folder,options.variable,options.exclude,options.workers,options.fanin,options.inflight,options.rebuild,options.scratch)
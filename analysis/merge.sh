@@ -48,3 +48,4 @@ echo "python merge.py --folder ${1} --variable ${2}"
 python merge.py --folder ${1} --variable ${2}
 ls ${1}/${2}.merged
 cp ${1}/${2}.merged ${_CONDOR_SCRATCH_DIR}/${2}.merged
+cp ${1}/${2}.manifest ${_CONDOR_SCRATCH_DIR}/${2}.manifest
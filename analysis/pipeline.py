@@ -0,0 +1,90 @@
+import os
+from collections import OrderedDict
+from coffea import hist
+from coffea.util import save
+from helpers import histogram
+from helpers.reduction import Reduction
+from macros.scale import scale, load_sumw
+
+def group(h):
+     """
+     h with its datasets aggregated into primary datasets, as done by
+     reduce.py.
+     """
+     dataset = hist.Cat("dataset", "dataset", sorting='placement')
+     dataset_cats = ("dataset",)
+     dataset_map = OrderedDict()
+     for d in h.identifiers('dataset'):
+          pdi = d.name.split("____")[0]
+          if pdi not in dataset_map: dataset_map[pdi] = ([],)
+          dataset_map[pdi][0].append(d.name)
+     return h.group(dataset_cats, dataset, dataset_map)
+
+def pipeline(folder,_dataset=None,_exclude=None,variable=None,sumw=None,workers=32,fanin=4,inflight=None,debug=False,scratch=None):
+
+     lists = {}
+     for filename in os.listdir(folder):
+          if '.futures' not in filename: continue
+          pdi = filename.split("____")[0]
+          if _dataset is not None:
+               if not any(_d in pdi for _d in _dataset.split(',')): continue
+          if _exclude is not None:
+               if any(_d in pdi for _d in _exclude.split(',')): continue
+          for k in histogram.keys(folder+'/'+filename):
+               if variable is not None and k!='sumw':
+                    if not any(v==k for v in variable.split(',')): continue
+               if k not in lists: lists[k]=[]
+               lists[k].append(folder+'/'+filename)
+
+     bkg_hists={}
+     sig_hists={}
+     data_hists={}
+     with Reduction(workers, fanin, inflight, scratch) as reduction:
+          hsumw = None
+          for k in ['sumw']+[k for k in lists if k!='sumw']:
+               print('Reducing variable',k,'from',len(lists[k]),'files')
+               tmp_sum = reduction.sum(lists[k], k)
+               h = group(tmp_sum.to_hist())
+               if debug:
+                    # The .reduced and .merged files that reduce.py and
+                    # merge.py would have written
+                    merged = histogram.DenseHist.from_hist(h, tmp_sum.dtype)
+                    histogram.save({k: merged}, folder+'/'+k+'.merged')
+                    for pdi, reduced in merged.split('dataset'):
+                         histogram.save({k: reduced}, folder+'/'+k+'--'+pdi+'.reduced')
+               del tmp_sum
+               if k=='sumw':
+                    hsumw = h
+                    continue
+               bkg, sig, data = scale({'sumw': hsumw, k: h}, sumw)
+               bkg_hists.update(bkg)
+               sig_hists.update(sig)
+               data_hists.update(data)
+
+     hists={
+          'bkg': bkg_hists,
+          'sig': sig_hists,
+          'data': data_hists
+     }
+     save(hists,folder+'.scaled')
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('-f', '--folder', help='folder', dest='folder')
+    parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default=None)
+    parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default=None)
+    parser.add_option('-v', '--variable', help='variable', dest='variable', default=None)
+    parser.add_option('-m', '--metadata', help='Check sumw against the Runs trees recorded in these metadata files', dest='metadata')
+    parser.add_option('-w', '--workers', help='Number of workers', dest='workers', type=int, default=32)
+    parser.add_option('--fanin', help='Number of histograms added by each worker task', dest='fanin', type=int, default=4)
+    parser.add_option('--inflight', help='Maximum number of histograms read or held at once (default: twice the workers)', dest='inflight', type=int)
+    parser.add_option('--scratch', help='Directory where the partial sums are handed between the workers (default: /dev/shm, or $TMPDIR when full)', dest='scratch')
+    parser.add_option('--debug', action='store_true', dest='debug', help='Also write the .reduced and .merged files')
+    (options, args) = parser.parse_args()
+
+    sumw = None
+    if options.metadata:
+        sumw = load_sumw(options.metadata)
+
+    pipeline(options.folder,options.dataset,options.exclude,options.variable,sumw,options.workers,options.fanin,options.inflight,options.debug,options.scratch)
@@ -56,6 +56,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         self._year = year
         self._lumi = 1000.*float(AnalysisProcessor.lumis[year])
         self._xsec = xsec
+        self.timing = False
 
         self._samples = {
             'sr':('ZJets','WJets','DY','TT','ST','WW','WZ','ZZ','QCD','HToBB','HTobb','MET','mhs'),
@@ -308,7 +309,8 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         isData = 'genWeight' not in events.columns
         selection = processor.PackedSelection()
-        hout = self.accumulator.identity()
+        timer = self._common['Timer'](self.timing, events.size)
+        hout = self._common['LazyOutput'](self.accumulator, timer.watch)
 
         ###
         #Getting corrections, ids from .coffea files
@@ -347,7 +349,12 @@ class AnalysisProcessor(processor.ProcessorABC):
         isGoodFatJet    = self._ids['isGoodFatJet']    
         isHEMJet        = self._ids['isHEMJet']        
         
-        match = self._common['match']
+        match = timer.wrap('match', self._common['match'])
+        fill_multi = timer.wrap('fill template', self._common['fill_multi'])
+        Weights = self._common['Weights']
+        cutflow = self._common['cutflow']
+        fill_cutflow = timer.wrap('fill cutflow', self._common['fill_cutflow'])
+        get_sumw = self._common['get_sumw']
         deepflavWPs = self._common['btagWPs']['deepflav'][self._year]
         deepcsvWPs = self._common['btagWPs']['deepcsv'][self._year]
 
@@ -366,6 +373,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         ###
 
         mu = events.Muon
+        timer.lap('objects')
         rochester = get_mu_rochester_sf
         _muon_offsets = mu.pt.offsets
         _charge = mu.charge
@@ -393,6 +401,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         rochester_pt[~mask] = _pt[~mask]
         rochester_pt[mask] = (_k * _pt)[mask]
         mu['pt'] = rochester_pt
+        timer.lap('rochester')
         mu['isloose'] = isLooseMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.looseId,self._year)
         mu['istight'] = isTightMuon(mu.pt,mu.eta,mu.pfRelIso04_all,mu.tightId,self._year)
         mu['T'] = TVector2Array.from_polar(mu.pt, mu.phi)
@@ -420,7 +429,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         leading_e = leading_e[leading_e.istight.astype(np.bool)]
 
         tau = events.Tau
-        tau['isclean']=~match(tau,mu_loose,0.4)&~match(tau,e_loose,0.4)
+        tau['isclean']=~match(tau,[mu_loose,e_loose],0.4)
         tau['isloose']=isLooseTau(tau.pt,tau.eta,tau.idDecayMode,tau.idDecayModeNewDMs,tau.idDeepTau2017v2p1VSe,tau.idDeepTau2017v2p1VSjet,tau.idDeepTau2017v2p1VSmu,self._year)
         tau_clean=tau[tau.isclean.astype(np.bool)]
         tau_loose=tau_clean[tau_clean.isloose.astype(np.bool)]
@@ -428,7 +437,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         tau_nloose=tau_loose.counts
 
         pho = events.Photon
-        pho['isclean']=~match(pho,mu_loose,0.5)&~match(pho,e_loose,0.5)&~match(pho,tau_loose,0.5)
+        pho['isclean']=~match(pho,[mu_loose,e_loose,tau_loose],0.5)
         _id = 'cutBasedBitmap'
         if self._year=='2016': 
             _id = 'cutBased'
@@ -447,7 +456,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         fj = events.AK15Puppi
         fj['sd'] = fj.subjets.sum()
-        fj['isclean'] =~match(fj.sd,pho_loose,1.5)&~match(fj.sd,mu_loose,1.5)&~match(fj.sd,e_loose,1.5)&~match(fj.sd,tau_loose,1.5)
+        fj['isclean'] =~match(fj.sd,[pho_loose,mu_loose,e_loose,tau_loose],1.5)
         fj['isgood'] = isGoodFatJet(fj.sd.pt, fj.sd.eta, fj.jetId)
         fj['T'] = TVector2Array.from_polar(fj.pt, fj.phi)
         fj['msd_raw'] = (fj.subjets * (1 - fj.subjets.rawFactor)).sum().mass
@@ -465,7 +474,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         j = events.Jet
         j['isgood'] = isGoodJet(j.pt, j.eta, j.jetId, j.puId, j.neHEF, j.chHEF)
         j['isHEM'] = isHEMJet(j.pt, j.eta, j.phi)
-        j['isclean'] = ~match(j,e_loose,0.4)&~match(j,mu_loose,0.4)&~match(j,pho_loose,0.4)&~match(j,tau_loose,0.4)
+        j['isclean'] = ~match(j,[e_loose,mu_loose,pho_loose,tau_loose],0.4)
         j['isiso'] = ~match(j,fj_clean[fj_clean.pt.argmax()],1.5)
         j['isdcsvL'] = (j.btagDeepB>deepcsvWPs['loose'])
         j['isdflvL'] = (j.btagDeepFlavB>deepflavWPs['loose'])
@@ -510,6 +519,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             'wmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
             'tmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))) 
         }
+        timer.lap('objects')
 
         ###
         #Calculating weights
@@ -636,6 +646,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             print('btagSFlight_correlatedUp',btagSFlight_correlatedUp)
             print('btagSFlight_uncorrelatedUp',btagSFlight_uncorrelatedUp)
             '''
+        timer.lap('weights')
 
         ###
         # Selections
@@ -684,6 +695,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         selection.add('mindphi_qcdcr', (abs(u['qcdcr'].delta_phi(j_clean.T)).min()<0.1))
         selection.add('minDphi_qcdcr', (abs(u['qcdcr'].delta_phi(fj_clean.T)).min()>1.5))
         selection.add('calo_qcdcr', ( (abs(calomet.pt - met.pt) / u['qcdcr'].mag)<0.5))
+        timer.lap('selections')
             
         #selection.add('mindphimet',(abs(met.T.delta_phi(j_clean.T)).min())>0.7)
 
@@ -697,7 +709,63 @@ class AnalysisProcessor(processor.ProcessorABC):
             'qcdcr': ['recoil_qcdcr','mindphi_qcdcr','minDphi_qcdcr','calo_qcdcr','msd40','fatjet', 'noHEMj','iszeroL','noextrab','met_filters','met_triggers','noHEMmet'],
         }
 
+        ###
+        # Weights common to all regions, the regional ones are added in the loop
+        ###
+
+        if not isData:
+            shared_weights = Weights(events.size)
+            if 'L1PreFiringWeight' in events.columns: shared_weights.add('prefiring',events.L1PreFiringWeight.Nom)
+            shared_weights.add('genw',events.genWeight)
+            shared_weights.add('nlo_qcd',nlo_qcd)
+            shared_weights.add('nlo_ewk',nlo_ewk)
+            if 'cen' in nnlo_nlo:
+                #shared_weights.add('nnlo_nlo',nnlo_nlo['cen'])
+                shared_weights.add('qcd1',np.ones(events.size), nnlo_nlo['qcd1up']/nnlo_nlo['cen'], nnlo_nlo['qcd1do']/nnlo_nlo['cen'])
+                shared_weights.add('qcd2',np.ones(events.size), nnlo_nlo['qcd2up']/nnlo_nlo['cen'], nnlo_nlo['qcd2do']/nnlo_nlo['cen'])
+                shared_weights.add('qcd3',np.ones(events.size), nnlo_nlo['qcd3up']/nnlo_nlo['cen'], nnlo_nlo['qcd3do']/nnlo_nlo['cen'])
+                shared_weights.add('ew1',np.ones(events.size), nnlo_nlo['ew1up']/nnlo_nlo['cen'], nnlo_nlo['ew1do']/nnlo_nlo['cen'])
+                shared_weights.add('ew2G',np.ones(events.size), nnlo_nlo['ew2Gup']/nnlo_nlo['cen'], nnlo_nlo['ew2Gdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3G',np.ones(events.size), nnlo_nlo['ew3Gup']/nnlo_nlo['cen'], nnlo_nlo['ew3Gdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew2W',np.ones(events.size), nnlo_nlo['ew2Wup']/nnlo_nlo['cen'], nnlo_nlo['ew2Wdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3W',np.ones(events.size), nnlo_nlo['ew3Wup']/nnlo_nlo['cen'], nnlo_nlo['ew3Wdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew2Z',np.ones(events.size), nnlo_nlo['ew2Zup']/nnlo_nlo['cen'], nnlo_nlo['ew2Zdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3Z',np.ones(events.size), nnlo_nlo['ew3Zup']/nnlo_nlo['cen'], nnlo_nlo['ew3Zdo']/nnlo_nlo['cen'])
+                shared_weights.add('mix',np.ones(events.size), nnlo_nlo['mixup']/nnlo_nlo['cen'], nnlo_nlo['mixdo']/nnlo_nlo['cen'])
+                shared_weights.add('muF',np.ones(events.size), nnlo_nlo['muFup']/nnlo_nlo['cen'], nnlo_nlo['muFdo']/nnlo_nlo['cen'])
+                shared_weights.add('muR',np.ones(events.size), nnlo_nlo['muRup']/nnlo_nlo['cen'], nnlo_nlo['muRdo']/nnlo_nlo['cen'])
+            shared_weights.add('pileup',pu)
+            shared_weights.add('btagSF',btagSF)
+            shared_weights.add('btagSFbc_correlated',np.ones(events.size), btagSFbc_correlatedUp/btagSF, btagSFbc_correlatedDown/btagSF)
+            shared_weights.add('btagSFbc_uncorrelated',np.ones(events.size), btagSFbc_uncorrelatedUp/btagSF, btagSFbc_uncorrelatedDown/btagSF)
+            shared_weights.add('btagSFlight_correlated',np.ones(events.size), btagSFlight_correlatedUp/btagSF, btagSFlight_correlatedDown/btagSF)
+            shared_weights.add('btagSFlight_uncorrelated',np.ones(events.size), btagSFlight_uncorrelatedUp/btagSF, btagSFlight_uncorrelatedDown/btagSF)
+
+            ###
+            # AK15 doubleb-tagging weights
+            ###
+
+            if('mhs' in dataset):
+                doublebtag, doublebtagUp,  doublebtagDown= get_doublebtag_weight(leading_fj.sd.pt.sum())
+                shared_weights.add('doublebtag',doublebtag, doublebtagUp, doublebtagDown)
+
+        ###
+        # Derived columns used by several selections and histograms, computed
+        # once per chunk (and region)
+        ###
+
+        memo = self._common['Memo'](self.timing)
+        memo.define('recoil',                lambda region: u[region].mag)
+        memo.define('mindphirecoil',         lambda region: abs(u[region].delta_phi(j_clean.T)).min())
+        memo.define('minDphirecoil',         lambda region: abs(u[region].delta_phi(fj_clean.T)).min())
+        memo.define('CaloMinusPfOverRecoil', lambda region: abs(calomet.pt - met.pt) / u[region].mag)
+        memo.define('mindphimet',            lambda: abs(met.T.delta_phi(j_clean.T)).min())
+        memo.define('minDphimet',            lambda: abs(met.T.delta_phi(fj_clean.T)).min())
+        memo.define('fjmass',                lambda: leading_fj.msd_corr.sum())
+        memo.define('ZHbbvsQCD',             lambda: leading_fj.ZHbbvsQCD.sum())
+
         isFilled = False
+        preselection = np.zeros(events.size, dtype=bool)
 
         #for region in selected_regions: 
         for region, cuts in regions.items():
@@ -707,24 +775,35 @@ class AnalysisProcessor(processor.ProcessorABC):
             # Adding recoil and minDPhi requirements
             ###
 
-            selection.add('recoil_'+region, (u[region].mag>250))
-            selection.add('mindphi_'+region, (abs(u[region].delta_phi(j_clean.T)).min()>0.5))
-            selection.add('minDphi_'+region, (abs(u[region].delta_phi(fj_clean.T)).min()>1.5))
-            selection.add('calo_'+region, ( (abs(calomet.pt - met.pt) / u[region].mag) < 0.5))
+            selection.add('recoil_'+region, (memo('recoil', region)>250))
+            selection.add('mindphi_'+region, (memo('mindphirecoil', region)>0.5))
+            selection.add('minDphi_'+region, (memo('minDphirecoil', region)>1.5))
+            selection.add('calo_'+region, (memo('CaloMinusPfOverRecoil', region) < 0.5))
             if 'qcd' not in region:
                 regions[region].insert(0, 'recoil_'+region)
                 regions[region].insert(3, 'mindphi_'+region)
                 regions[region].insert(4, 'minDphi_'+region)
                 regions[region].insert(5, 'calo_'+region)
+            timer.lap('selections')
+
+            ###
+            # Preselection mode, used by skim.py: no histograms, only the
+            # union of the regions without the cuts that are left out
+            ###
+
+            if 'skim' in events.metadata:
+                preselection = preselection | selection.all(*[cut for cut in regions[region] if not cut.startswith(tuple(events.metadata['skim']))])
+                continue
+
             variables = {
-                'mindphirecoil':          abs(u[region].delta_phi(j_clean.T)).min(),
-                'minDphirecoil':          abs(u[region].delta_phi(fj_clean.T)).min(),
-                'CaloMinusPfOverRecoil':  abs(calomet.pt - met.pt) / u[region].mag,
+                'mindphirecoil':          memo('mindphirecoil', region),
+                'minDphirecoil':          memo('minDphirecoil', region),
+                'CaloMinusPfOverRecoil':  memo('CaloMinusPfOverRecoil', region),
                 'met':                    met.pt.flatten(),
                 'calomet':                calomet.pt.flatten(),
                 'metphi':                 met.phi.flatten(),
-                'mindphimet':             abs(met.T.delta_phi(j_clean.T)).min(),
-                'minDphimet':             abs(met.T.delta_phi(fj_clean.T)).min(),
+                'mindphimet':             memo('mindphimet'),
+                'minDphimet':             memo('minDphimet'),
                 'j1pt':                   leading_j.pt.sum(),
                 'j1eta':                  leading_j.eta.sum(),
                 'j1phi':                  leading_j.phi.sum(),
@@ -747,16 +826,14 @@ class AnalysisProcessor(processor.ProcessorABC):
                 variables['l1eta']     = leading_mu.eta.sum()
 
             def fill(dataset, weight, cut):
-                for histname, h in hout.items():
-                    if not isinstance(h, hist.Hist):
-                        continue
-                    if histname not in variables:
+                for histname in variables:
+                    if histname not in self.accumulator:
                         continue
                     flat_variable = {histname: variables[histname]}
-                    h.fill(dataset=dataset, 
+                    hout[histname].fill(dataset=dataset, 
                            region=region, 
                            **flat_variable, 
-                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                           ZHbbvsQCD=memo('ZHbbvsQCD'),
                            weight=weight*cut)
 
             if isData:
@@ -767,59 +844,27 @@ class AnalysisProcessor(processor.ProcessorABC):
                 hout['template'].fill(dataset=dataset,
                                       region=region,
                                       systematic='nominal',
-                                      recoil=u[region].mag,
-                                      fjmass=leading_fj.msd_corr.sum(),
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      recoil=memo('recoil', region),
+                                      fjmass=memo('fjmass'),
+                                      ZHbbvsQCD=memo('ZHbbvsQCD'),
                                       weight=np.ones(events.size)*cut)
                 hout['ZHbbvsQCD'].fill(dataset=dataset,
                                       region=region,
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      ZHbbvsQCD=memo('ZHbbvsQCD'),
                                       weight=np.ones(events.size)*cut)
                 fill(dataset, np.ones(events.size), cut)
             else:
-                weights = processor.Weights(len(events))
-                if 'L1PreFiringWeight' in events.columns: weights.add('prefiring',events.L1PreFiringWeight.Nom)
-                weights.add('genw',events.genWeight)
-                weights.add('nlo_qcd',nlo_qcd)
-                weights.add('nlo_ewk',nlo_ewk)
-                if 'cen' in nnlo_nlo:
-                    #weights.add('nnlo_nlo',nnlo_nlo['cen'])
-                    weights.add('qcd1',np.ones(events.size), nnlo_nlo['qcd1up']/nnlo_nlo['cen'], nnlo_nlo['qcd1do']/nnlo_nlo['cen'])
-                    weights.add('qcd2',np.ones(events.size), nnlo_nlo['qcd2up']/nnlo_nlo['cen'], nnlo_nlo['qcd2do']/nnlo_nlo['cen'])
-                    weights.add('qcd3',np.ones(events.size), nnlo_nlo['qcd3up']/nnlo_nlo['cen'], nnlo_nlo['qcd3do']/nnlo_nlo['cen'])
-                    weights.add('ew1',np.ones(events.size), nnlo_nlo['ew1up']/nnlo_nlo['cen'], nnlo_nlo['ew1do']/nnlo_nlo['cen'])
-                    weights.add('ew2G',np.ones(events.size), nnlo_nlo['ew2Gup']/nnlo_nlo['cen'], nnlo_nlo['ew2Gdo']/nnlo_nlo['cen'])
-                    weights.add('ew3G',np.ones(events.size), nnlo_nlo['ew3Gup']/nnlo_nlo['cen'], nnlo_nlo['ew3Gdo']/nnlo_nlo['cen'])
-                    weights.add('ew2W',np.ones(events.size), nnlo_nlo['ew2Wup']/nnlo_nlo['cen'], nnlo_nlo['ew2Wdo']/nnlo_nlo['cen'])
-                    weights.add('ew3W',np.ones(events.size), nnlo_nlo['ew3Wup']/nnlo_nlo['cen'], nnlo_nlo['ew3Wdo']/nnlo_nlo['cen'])
-                    weights.add('ew2Z',np.ones(events.size), nnlo_nlo['ew2Zup']/nnlo_nlo['cen'], nnlo_nlo['ew2Zdo']/nnlo_nlo['cen'])
-                    weights.add('ew3Z',np.ones(events.size), nnlo_nlo['ew3Zup']/nnlo_nlo['cen'], nnlo_nlo['ew3Zdo']/nnlo_nlo['cen'])
-                    weights.add('mix',np.ones(events.size), nnlo_nlo['mixup']/nnlo_nlo['cen'], nnlo_nlo['mixdo']/nnlo_nlo['cen'])
-                    weights.add('muF',np.ones(events.size), nnlo_nlo['muFup']/nnlo_nlo['cen'], nnlo_nlo['muFdo']/nnlo_nlo['cen'])
-                    weights.add('muR',np.ones(events.size), nnlo_nlo['muRup']/nnlo_nlo['cen'], nnlo_nlo['muRdo']/nnlo_nlo['cen'])
-                weights.add('pileup',pu)
+                weights = shared_weights.copy()
                 weights.add('trig', trig[region])
                 weights.add('ids', ids[region])
                 weights.add('reco', reco[region])
                 weights.add('isolation', isolation[region])
-                weights.add('btagSF',btagSF)
-                weights.add('btagSFbc_correlated',np.ones(events.size), btagSFbc_correlatedUp/btagSF, btagSFbc_correlatedDown/btagSF)
-                weights.add('btagSFbc_uncorrelated',np.ones(events.size), btagSFbc_uncorrelatedUp/btagSF, btagSFbc_uncorrelatedDown/btagSF)
-                weights.add('btagSFlight_correlated',np.ones(events.size), btagSFlight_correlatedUp/btagSF, btagSFlight_correlatedDown/btagSF)
-                weights.add('btagSFlight_uncorrelated',np.ones(events.size), btagSFlight_uncorrelatedUp/btagSF, btagSFlight_uncorrelatedDown/btagSF)
-
-                ###
-                # AK15 doubleb-tagging weights
-                ###
-                
-                if('mhs' in dataset):
-                    doublebtag, doublebtagUp,  doublebtagDown= get_doublebtag_weight(leading_fj.sd.pt.sum())
-                    weights.add('doublebtag',doublebtag, doublebtagUp, doublebtagDown)
+                timer.lap('weights')
 
                 if 'WJets' in dataset or 'ZJets' in dataset or 'DY' in dataset:
                     if not isFilled:
-                        hout['sumw'].fill(dataset='HF--'+dataset, sumw=1, weight=events.genWeight.sum())
-                        hout['sumw'].fill(dataset='LF--'+dataset, sumw=1, weight=events.genWeight.sum())
+                        hout['sumw'].fill(dataset='HF--'+dataset, sumw=1, weight=get_sumw(events))
+                        hout['sumw'].fill(dataset='LF--'+dataset, sumw=1, weight=get_sumw(events))
                         isFilled=True
                     whf = ((gen[gen.isb].counts>0)|(gen[gen.isc].counts>0)).astype(np.int)
                     wlf = (~(whf.astype(np.bool))).astype(np.int)
@@ -859,47 +904,38 @@ class AnalysisProcessor(processor.ProcessorABC):
                                    'ew3ZDown',
                                    'mixUp',
                                    'mixDown']
-                    for systematic in systematics:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset='HF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*whf*cut)
-                        hout['template'].fill(dataset='LF--'+dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*wlf*cut)
-                    ## Cutflow loop
-                    vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*whf)
-                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*wlf)
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
-                        vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut*whf)
-                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut*wlf)
+                    snames = ['nominal' if systematic is None else systematic for systematic in systematics]
+                    wmatrix = weights.stack(systematics)*cut[:,None]
+                    fill_multi(hout['template'], 'systematic', snames, wmatrix*whf[:,None],
+                               dataset='HF--'+dataset,
+                               region=region,
+                               recoil=memo('recoil', region),
+                               fjmass=memo('fjmass'),
+                               ZHbbvsQCD=memo('ZHbbvsQCD'))
+                    fill_multi(hout['template'], 'systematic', snames, wmatrix*wlf[:,None],
+                               dataset='LF--'+dataset,
+                               region=region,
+                               recoil=memo('recoil', region),
+                               fjmass=memo('fjmass'),
+                               ZHbbvsQCD=memo('ZHbbvsQCD'))
+                    ## Cutflow
+                    npassed = cutflow(selection, cuts)
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight()*whf, dataset='HF--'+dataset, region=region, ZHbbvsQCD=memo('ZHbbvsQCD'))
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight()*wlf, dataset='LF--'+dataset, region=region, ZHbbvsQCD=memo('ZHbbvsQCD'))
 
                     hout['ZHbbvsQCD'].fill(dataset='HF--'+dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                           ZHbbvsQCD=memo('ZHbbvsQCD'),
                                            weight=weights.weight()*whf*cut)
                     hout['ZHbbvsQCD'].fill(dataset='LF--'+dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                           ZHbbvsQCD=memo('ZHbbvsQCD'),
                                            weight=weights.weight()*wlf*cut)
                     fill('HF--'+dataset, weights.weight()*whf, cut)
                     fill('LF--'+dataset, weights.weight()*wlf, cut)
                 else:
                     if not isFilled:
-                        hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
+                        hout['sumw'].fill(dataset=dataset, sumw=1, weight=get_sumw(events))
                         isFilled=True
                     cut = selection.all(*regions[region])
                     systematics = [None, 
@@ -915,32 +951,28 @@ class AnalysisProcessor(processor.ProcessorABC):
                     if('mhs' in dataset):
                         systematics.append('doublebtagUp')
                         systematics.append('doublebtagDown')
-                    for systematic in systematics:
-                        sname = 'nominal' if systematic is None else systematic
-                        hout['template'].fill(dataset=dataset,
-                                              region=region,
-                                              systematic=sname,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
-                                              weight=weights.weight(modifier=systematic)*cut)
-                    ## Cutflow loop
-                    vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight())
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
-                        vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(), weight=weights.weight()*jcut)
+                    snames = ['nominal' if systematic is None else systematic for systematic in systematics]
+                    wmatrix = weights.stack(systematics)*cut[:,None]
+                    fill_multi(hout['template'], 'systematic', snames, wmatrix,
+                               dataset=dataset,
+                               region=region,
+                               recoil=memo('recoil', region),
+                               fjmass=memo('fjmass'),
+                               ZHbbvsQCD=memo('ZHbbvsQCD'))
+                    ## Cutflow
+                    npassed = cutflow(selection, cuts)
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight(), dataset=dataset, region=region, ZHbbvsQCD=memo('ZHbbvsQCD'))
 
                     hout['ZHbbvsQCD'].fill(dataset=dataset,
                                            region=region,
-                                           ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                           ZHbbvsQCD=memo('ZHbbvsQCD'),
                                            weight=weights.weight()*cut)
                     fill(dataset, weights.weight(), cut)
+            timer.lap('fill inputs')
 
-        return hout
+        if 'skim' in events.metadata:
+            return preselection
+        return timer.output(memo.output(hout.accumulator()))
 
     def postprocess(self, accumulator):
         scale = {}
@@ -161,6 +161,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         isHEMJet        = self._ids['isHEMJet']  
 
         match = self._common['match']
+        get_sumw = self._common['get_sumw']
 
         ###
         #Initialize physics objects
@@ -419,11 +420,11 @@ class AnalysisProcessor(processor.ProcessorABC):
             if 'QCD' in dataset:
                 weights.add('reweighting', get_reweighting(leading_fj.tau21.sum(), leading_fj.sd.pt.sum(), leading_fj.sd.eta.sum()))
                 if not isFilled:
-                    hout['sumw'].fill(dataset='bb--'+dataset, sumw=1, weight=events.genWeight.sum())
-                    hout['sumw'].fill(dataset='b--'+dataset, sumw=1, weight=events.genWeight.sum())
-                    hout['sumw'].fill(dataset='cc--'+dataset, sumw=1, weight=events.genWeight.sum())
-                    hout['sumw'].fill(dataset='c--'+dataset, sumw=1, weight=events.genWeight.sum())
-                    hout['sumw'].fill(dataset='l--'+dataset, sumw=1, weight=events.genWeight.sum())
+                    hout['sumw'].fill(dataset='bb--'+dataset, sumw=1, weight=get_sumw(events))
+                    hout['sumw'].fill(dataset='b--'+dataset, sumw=1, weight=get_sumw(events))
+                    hout['sumw'].fill(dataset='cc--'+dataset, sumw=1, weight=get_sumw(events))
+                    hout['sumw'].fill(dataset='c--'+dataset, sumw=1, weight=get_sumw(events))
+                    hout['sumw'].fill(dataset='l--'+dataset, sumw=1, weight=get_sumw(events))
                     isFilled=True
                 wbb=leading_fj.isbb.sum().astype(np.int)
                 hout['template'].fill(dataset='bb--'+dataset,
@@ -472,7 +473,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             else:
                 ##### template for bb SF #####
                 if not isFilled:
-                    hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
+                    hout['sumw'].fill(dataset=dataset, sumw=1, weight=get_sumw(events))
                     isFilled=True
                 whs=leading_fj.isHsbb.sum().astype(np.int)
                 hout['template'].fill(dataset=dataset,
@@ -146,6 +146,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         self._year = year
 
         self._lumi = 1000.*float(AnalysisProcessor.lumis[year])
+        self.timing = False
 
         self._xsec = xsec
 
@@ -532,7 +533,8 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         isData = 'genWeight' not in events.columns
         selection = processor.PackedSelection()
-        hout = self.accumulator.identity()
+        timer = self._common['Timer'](self.timing, events.size)
+        hout = self._common['LazyOutput'](self.accumulator, timer.watch)
 
         ###
         #Getting corrections, ids from .coffea files
@@ -573,7 +575,11 @@ class AnalysisProcessor(processor.ProcessorABC):
         isGoodFatJet    = self._ids['isGoodFatJet']    
         isHEMJet        = self._ids['isHEMJet']        
         
-        match = self._common['match']
+        match = timer.wrap('match', self._common['match'])
+        Weights = self._common['Weights']
+        cutflow = self._common['cutflow']
+        fill_cutflow = timer.wrap('fill cutflow', self._common['fill_cutflow'])
+        get_sumw = self._common['get_sumw']
         sigmoid = self._common['sigmoid'] #to calculate photon trigger efficiency
         deepflavWPs = self._common['btagWPs']['deepflav'][self._year]
         deepcsvWPs = self._common['btagWPs']['deepcsv'][self._year]
@@ -630,7 +636,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         leading_e = leading_e[leading_e.istight.astype(np.bool)]
 
         tau = events.Tau
-        tau['isclean']=~match(tau,mu_loose,0.4)&~match(tau,e_loose,0.4)
+        tau['isclean']=~match(tau,[mu_loose,e_loose],0.4)
         tau['isloose']=isLooseTau(tau.pt,tau.eta,tau.idDecayMode,tau.idMVAoldDM2017v2,self._year)
         tau_clean=tau[tau.isclean.astype(np.bool)]
         tau_loose=tau_clean[tau_clean.isloose.astype(np.bool)]
@@ -638,7 +644,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         tau_nloose=tau_loose.counts
 
         pho = events.Photon
-        pho['isclean']=~match(pho,mu_loose,0.5)&~match(pho,e_loose,0.5)
+        pho['isclean']=~match(pho,[mu_loose,e_loose],0.5)
         _id = 'cutBasedBitmap'
         if self._year=='2016': 
             _id = 'cutBased'
@@ -657,7 +663,7 @@ class AnalysisProcessor(processor.ProcessorABC):
 
         fj = events.AK15Puppi
         fj['sd'] = fj.subjets.sum()
-        fj['isclean'] =~match(fj.sd,pho_loose,1.5)&~match(fj.sd,mu_loose,1.5)&~match(fj.sd,e_loose,1.5)
+        fj['isclean'] =~match(fj.sd,[pho_loose,mu_loose,e_loose],1.5)
         fj['isgood'] = isGoodFatJet(fj.sd.pt, fj.sd.eta, fj.jetId)
         fj['T'] = TVector2Array.from_polar(fj.pt, fj.phi)
         fj['msd_raw'] = (fj.subjets * (1 - fj.subjets.rawFactor)).sum().mass
@@ -680,7 +686,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         j = events.Jet
         j['isgood'] = isGoodJet(j.pt, j.eta, j.jetId, j.puId, j.neHEF, j.chHEF)
         j['isHEM'] = isHEMJet(j.pt, j.eta, j.phi)
-        j['isclean'] = ~match(j,e_loose,0.4)&~match(j,mu_loose,0.4)&~match(j,pho_loose,0.4)
+        j['isclean'] = ~match(j,[e_loose,mu_loose,pho_loose],0.4)
         j['isiso'] = ~match(j,fj_clean[fj_clean.pt.argmax()],1.5)
         j['isdcsvL'] = (j.btagDeepB>deepcsvWPs['loose'])
         j['isdflvL'] = (j.btagDeepFlavB>deepflavWPs['loose'])
@@ -743,6 +749,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             'wmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))),
             'tmcr'  : np.sqrt(2*leading_mu.pt.sum()*met.pt*(1-np.cos(met.T.delta_phi(leading_mu.T.sum())))) 
         }
+        timer.lap('objects')
 
         ###
         #Calculating weights
@@ -1170,6 +1177,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             btag['zmcr'], btagUp['zmcr'], btagDown['zmcr'] = np.ones(events.size), np.ones(events.size), np.ones(events.size)
             btag['zecr'], btagUp['zecr'], btagDown['zecr'] = np.ones(events.size), np.ones(events.size), np.ones(events.size)
             btag['gcr'],  btagUp['gcr'],  btagDown['gcr']  = np.ones(events.size), np.ones(events.size), np.ones(events.size)
+        timer.lap('weights')
 
         ###
         # Selections
@@ -1224,6 +1232,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         selection.add('noHEMmet', noHEMmet)
         selection.add('met120',(met.pt<120))
         selection.add('met100',(met.pt>100))
+        timer.lap('selections')
         #selection.add('mindphimet',(abs(met.T.delta_phi(j_clean.T)).min())>0.7)
 
         regions = {
@@ -1238,6 +1247,48 @@ class AnalysisProcessor(processor.ProcessorABC):
             'gcr': ['isoneA','fatjet','noHEMj','met_filters','singlephoton_triggers']
         }
 
+        ###
+        # Weights common to all regions, the regional ones are added in the loop
+        ###
+
+        if not isData:
+            shared_weights = Weights(events.size)
+            if 'L1PreFiringWeight' in events.columns: shared_weights.add('prefiring',events.L1PreFiringWeight.Nom)
+            shared_weights.add('genw',events.genWeight)
+            shared_weights.add('nlo_qcd',nlo_qcd)
+            shared_weights.add('nlo_ewk',nlo_ewk)
+            if 'cen' in nnlo_nlo:
+                #shared_weights.add('nnlo_nlo',nnlo_nlo['cen'])
+                shared_weights.add('qcd1',np.ones(events.size), nnlo_nlo['qcd1up']/nnlo_nlo['cen'], nnlo_nlo['qcd1do']/nnlo_nlo['cen'])
+                shared_weights.add('qcd2',np.ones(events.size), nnlo_nlo['qcd2up']/nnlo_nlo['cen'], nnlo_nlo['qcd2do']/nnlo_nlo['cen'])
+                shared_weights.add('qcd3',np.ones(events.size), nnlo_nlo['qcd3up']/nnlo_nlo['cen'], nnlo_nlo['qcd3do']/nnlo_nlo['cen'])
+                shared_weights.add('ew1',np.ones(events.size), nnlo_nlo['ew1up']/nnlo_nlo['cen'], nnlo_nlo['ew1do']/nnlo_nlo['cen'])
+                shared_weights.add('ew2G',np.ones(events.size), nnlo_nlo['ew2Gup']/nnlo_nlo['cen'], nnlo_nlo['ew2Gdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3G',np.ones(events.size), nnlo_nlo['ew3Gup']/nnlo_nlo['cen'], nnlo_nlo['ew3Gdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew2W',np.ones(events.size), nnlo_nlo['ew2Wup']/nnlo_nlo['cen'], nnlo_nlo['ew2Wdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3W',np.ones(events.size), nnlo_nlo['ew3Wup']/nnlo_nlo['cen'], nnlo_nlo['ew3Wdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew2Z',np.ones(events.size), nnlo_nlo['ew2Zup']/nnlo_nlo['cen'], nnlo_nlo['ew2Zdo']/nnlo_nlo['cen'])
+                shared_weights.add('ew3Z',np.ones(events.size), nnlo_nlo['ew3Zup']/nnlo_nlo['cen'], nnlo_nlo['ew3Zdo']/nnlo_nlo['cen'])
+                shared_weights.add('mix',np.ones(events.size), nnlo_nlo['mixup']/nnlo_nlo['cen'], nnlo_nlo['mixdo']/nnlo_nlo['cen'])
+                shared_weights.add('muF',np.ones(events.size), nnlo_nlo['muFup']/nnlo_nlo['cen'], nnlo_nlo['muFdo']/nnlo_nlo['cen'])
+                shared_weights.add('muR',np.ones(events.size), nnlo_nlo['muRup']/nnlo_nlo['cen'], nnlo_nlo['muRdo']/nnlo_nlo['cen'])
+            shared_weights.add('pileup',pu)
+
+        ###
+        # Derived columns used by several selections and histograms, computed
+        # once per chunk (and region)
+        ###
+
+        memo = self._common['Memo'](self.timing)
+        memo.define('recoil',                lambda region: u[region].mag)
+        memo.define('mindphirecoil',         lambda region: abs(u[region].delta_phi(j_clean.T)).min())
+        memo.define('minDphirecoil',         lambda region: abs(u[region].delta_phi(fj_clean.T)).min())
+        memo.define('CaloMinusPfOverRecoil', lambda region: abs(calomet.pt - met.pt) / u[region].mag)
+        memo.define('mindphimet',            lambda: abs(met.T.delta_phi(j_clean.T)).min())
+        memo.define('minDphimet',            lambda: abs(met.T.delta_phi(fj_clean.T)).min())
+        memo.define('fjmass',                lambda: leading_fj.msd_corr.sum())
+        memo.define('ZHbbvsQCD',             lambda: leading_fj.ZHbbvsQCD.sum())
+
         isFilled = False
 
         #for region in selected_regions: 
@@ -1249,25 +1300,26 @@ class AnalysisProcessor(processor.ProcessorABC):
             # Adding recoil and minDPhi requirements
             ###
 
-            selection.add('recoil_'+region, (u[region].mag>250))
-            selection.add('mindphi_'+region, (abs(u[region].delta_phi(j_clean.T)).min()>0.5))
-            selection.add('minDphi_'+region, (abs(u[region].delta_phi(fj_clean.T)).min()>1.5))
-            selection.add('calo_'+region, ( (abs(calomet.pt - met.pt) / u[region].mag) < 0.5))
+            selection.add('recoil_'+region, (memo('recoil', region)>250))
+            selection.add('mindphi_'+region, (memo('mindphirecoil', region)>0.5))
+            selection.add('minDphi_'+region, (memo('minDphirecoil', region)>1.5))
+            selection.add('calo_'+region, (memo('CaloMinusPfOverRecoil', region) < 0.5))
             #regions[region].update({'recoil_'+region,'mindphi_'+region})
             regions[region].insert(0, 'recoil_'+region)
             regions[region].insert(3, 'mindphi_'+region)
             regions[region].insert(4, 'minDphi_'+region)
             regions[region].insert(5, 'calo_'+region)
             print('Selection:',regions[region])
+            timer.lap('selections')
             variables = {
-                'recoil':                 u[region].mag,
-                'mindphirecoil':          abs(u[region].delta_phi(j_clean.T)).min(),
-                'minDphirecoil':          abs(u[region].delta_phi(fj_clean.T)).min(),
-                'CaloMinusPfOverRecoil':  abs(calomet.pt - met.pt) / u[region].mag,
+                'recoil':                 memo('recoil', region),
+                'mindphirecoil':          memo('mindphirecoil', region),
+                'minDphirecoil':          memo('minDphirecoil', region),
+                'CaloMinusPfOverRecoil':  memo('CaloMinusPfOverRecoil', region),
                 'met':                    met.pt,
                 'metphi':                 met.phi,
-                'mindphimet':             abs(met.T.delta_phi(j_clean.T)).min(),
-                'minDphimet':             abs(met.T.delta_phi(fj_clean.T)).min(),
+                'mindphimet':             memo('mindphimet'),
+                'minDphimet':             memo('minDphimet'),
                 'j1pt':                   leading_j.pt,
                 'j1eta':                  leading_j.eta,
                 'j1phi':                  leading_j.phi,
@@ -1309,10 +1361,8 @@ class AnalysisProcessor(processor.ProcessorABC):
                 flat_gentype = {k: (~np.isnan(v[cut])*gentype[cut]).flatten() for k, v in variables.items()}
                 flat_weight = {k: (~np.isnan(v[cut])*weight[cut]).flatten() for k, v in variables.items()}
             
-                for histname, h in hout.items():
-                    if not isinstance(h, hist.Hist):
-                        continue
-                    if histname not in variables:
+                for histname in variables:
+                    if histname not in self.accumulator:
                         continue
                     elif histname == 'sumw':
                         continue
@@ -1320,11 +1370,11 @@ class AnalysisProcessor(processor.ProcessorABC):
                         continue
                     else:
                         flat_variable = {histname: flat_variables[histname]}
-                        h.fill(dataset=dataset, 
-                               region=region, 
-                               gentype=flat_gentype[histname], 
-                               **flat_variable, 
-                               weight=flat_weight[histname])
+                        hout[histname].fill(dataset=dataset, 
+                                            region=region, 
+                                            gentype=flat_gentype[histname], 
+                                            **flat_variable, 
+                                            weight=flat_weight[histname])
 
             if isData:
                 if not isFilled:
@@ -1335,39 +1385,20 @@ class AnalysisProcessor(processor.ProcessorABC):
                                       region=region,
                                       systematic='nominal',
                                       gentype=np.zeros(events.size, dtype=np.int),
-                                      recoil=u[region].mag,
-                                      fjmass=leading_fj.msd_corr.sum(),
-                                      ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                      recoil=memo('recoil', region),
+                                      fjmass=memo('fjmass'),
+                                      ZHbbvsQCD=memo('ZHbbvsQCD'),
                                       weight=np.ones(events.size)*cut)
                 fill(dataset, np.zeros(events.size, dtype=np.int), np.ones(events.size), cut)
             else:
-                weights = processor.Weights(len(events))
-                if 'L1PreFiringWeight' in events.columns: weights.add('prefiring',events.L1PreFiringWeight.Nom)
-                weights.add('genw',events.genWeight)
-                weights.add('nlo_qcd',nlo_qcd)
-                weights.add('nlo_ewk',nlo_ewk)
-                if 'cen' in nnlo_nlo:
-                    #weights.add('nnlo_nlo',nnlo_nlo['cen'])
-                    weights.add('qcd1',np.ones(events.size), nnlo_nlo['qcd1up']/nnlo_nlo['cen'], nnlo_nlo['qcd1do']/nnlo_nlo['cen'])
-                    weights.add('qcd2',np.ones(events.size), nnlo_nlo['qcd2up']/nnlo_nlo['cen'], nnlo_nlo['qcd2do']/nnlo_nlo['cen'])
-                    weights.add('qcd3',np.ones(events.size), nnlo_nlo['qcd3up']/nnlo_nlo['cen'], nnlo_nlo['qcd3do']/nnlo_nlo['cen'])
-                    weights.add('ew1',np.ones(events.size), nnlo_nlo['ew1up']/nnlo_nlo['cen'], nnlo_nlo['ew1do']/nnlo_nlo['cen'])
-                    weights.add('ew2G',np.ones(events.size), nnlo_nlo['ew2Gup']/nnlo_nlo['cen'], nnlo_nlo['ew2Gdo']/nnlo_nlo['cen'])
-                    weights.add('ew3G',np.ones(events.size), nnlo_nlo['ew3Gup']/nnlo_nlo['cen'], nnlo_nlo['ew3Gdo']/nnlo_nlo['cen'])
-                    weights.add('ew2W',np.ones(events.size), nnlo_nlo['ew2Wup']/nnlo_nlo['cen'], nnlo_nlo['ew2Wdo']/nnlo_nlo['cen'])
-                    weights.add('ew3W',np.ones(events.size), nnlo_nlo['ew3Wup']/nnlo_nlo['cen'], nnlo_nlo['ew3Wdo']/nnlo_nlo['cen'])
-                    weights.add('ew2Z',np.ones(events.size), nnlo_nlo['ew2Zup']/nnlo_nlo['cen'], nnlo_nlo['ew2Zdo']/nnlo_nlo['cen'])
-                    weights.add('ew3Z',np.ones(events.size), nnlo_nlo['ew3Zup']/nnlo_nlo['cen'], nnlo_nlo['ew3Zdo']/nnlo_nlo['cen'])
-                    weights.add('mix',np.ones(events.size), nnlo_nlo['mixup']/nnlo_nlo['cen'], nnlo_nlo['mixdo']/nnlo_nlo['cen'])
-                    weights.add('muF',np.ones(events.size), nnlo_nlo['muFup']/nnlo_nlo['cen'], nnlo_nlo['muFdo']/nnlo_nlo['cen'])
-                    weights.add('muR',np.ones(events.size), nnlo_nlo['muRup']/nnlo_nlo['cen'], nnlo_nlo['muRdo']/nnlo_nlo['cen'])
-                weights.add('pileup',pu)
+                weights = shared_weights.copy()
                 weights.add('trig', trig[region])
                 weights.add('ids', ids[region])
                 weights.add('reco', reco[region])
                 weights.add('isolation', isolation[region])
                 weights.add('csev', csev[region])
                 weights.add('btag',btag[region], btagUp[region], btagDown[region])
+                timer.lap('weights')
 
                 wgentype = {
                     'xbb' : (
@@ -1478,8 +1509,8 @@ class AnalysisProcessor(processor.ProcessorABC):
 
                 if 'WJets' in dataset or 'ZJets' in dataset or 'DY' in dataset or 'GJets' in dataset:
                     if not isFilled:
-                        hout['sumw'].fill(dataset='HF--'+dataset, sumw=1, weight=events.genWeight.sum())
-                        hout['sumw'].fill(dataset='LF--'+dataset, sumw=1, weight=events.genWeight.sum())
+                        hout['sumw'].fill(dataset='HF--'+dataset, sumw=1, weight=get_sumw(events))
+                        hout['sumw'].fill(dataset='LF--'+dataset, sumw=1, weight=get_sumw(events))
                         isFilled=True
                     whf = ((gen[gen.isb].counts>0)|(gen[gen.isc].counts>0)).astype(np.int)
                     wlf = (~(whf.astype(np.bool))).astype(np.int)
@@ -1519,36 +1550,29 @@ class AnalysisProcessor(processor.ProcessorABC):
                                               region=region,
                                               systematic=sname,
                                               gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                              recoil=memo('recoil', region),
+                                              fjmass=memo('fjmass'),
+                                              ZHbbvsQCD=memo('ZHbbvsQCD'),
                                               weight=weights.weight(modifier=systematic)*whf*cut)
                         hout['template'].fill(dataset='LF--'+dataset,
                                               region=region,
                                               systematic=sname,
                                               gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                              recoil=memo('recoil', region),
+                                              fjmass=memo('fjmass'),
+                                              ZHbbvsQCD=memo('ZHbbvsQCD'),
                                               weight=weights.weight(modifier=systematic)*wlf*cut)
 
-                    ## Cutflow loop
-                    vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=weights.weight()*whf)
-                    hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=weights.weight()*wlf)
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
-                        vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset='HF--'+dataset, region=region, cut=vcut, weight=weights.weight()*jcut*whf)
-                        hout['cutflow'].fill(dataset='LF--'+dataset, region=region, cut=vcut, weight=weights.weight()*jcut*wlf)
+                    ## Cutflow
+                    npassed = cutflow(selection, cuts)
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight()*whf, dataset='HF--'+dataset, region=region)
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight()*wlf, dataset='LF--'+dataset, region=region)
 
                     fill('HF--'+dataset, vgentype, weights.weight()*whf, cut)
                     fill('LF--'+dataset, vgentype, weights.weight()*wlf, cut)
                 else:
                     if not isFilled:
-                        hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
+                        hout['sumw'].fill(dataset=dataset, sumw=1, weight=get_sumw(events))
                         isFilled=True
                     cut = selection.all(*regions[region])
                     for systematic in [None, 'btagUp', 'btagDown']:
@@ -1557,25 +1581,20 @@ class AnalysisProcessor(processor.ProcessorABC):
                                               region=region,
                                               systematic=sname,
                                               gentype=vgentype,
-                                              recoil=u[region].mag,
-                                              fjmass=leading_fj.msd_corr.sum(),
-                                              ZHbbvsQCD=leading_fj.ZHbbvsQCD.sum(),
+                                              recoil=memo('recoil', region),
+                                              fjmass=memo('fjmass'),
+                                              ZHbbvsQCD=memo('ZHbbvsQCD'),
                                               #TvsQCD=leading_fj.TvsQCD.sum(),
                                               #XvsQCD=leading_fj.XvsQCD.sum(),
                                               weight=weights.weight(modifier=systematic)*cut)
-                    ## Cutflow loop
-                    vcut=np.zeros(events.size, dtype=np.int)
-                    hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=weights.weight())
-                    allcuts = set()
-                    for i, icut in enumerate(cuts):
-                        allcuts.add(icut)
-                        jcut = selection.all(*allcuts)
-                        vcut = (i+1)*jcut
-                        hout['cutflow'].fill(dataset=dataset, region=region, cut=vcut, weight=weights.weight()*jcut)
+                    ## Cutflow
+                    npassed = cutflow(selection, cuts)
+                    fill_cutflow(hout['cutflow'], npassed, len(cuts), weights.weight(), dataset=dataset, region=region)
 
                     fill(dataset, vgentype, weights.weight(), cut)
+            timer.lap('fill inputs')
 
-        return hout
+        return timer.output(memo.output(hout.accumulator()))
 
     def postprocess(self, accumulator):
         scale = {}
@@ -129,6 +129,7 @@ class AnalysisProcessor(processor.ProcessorABC):
         isHEMJet        = self._ids['isHEMJet']  
 
         match = self._common['match']
+        get_sumw = self._common['get_sumw']
 
         ###
         #Initialize physics objects
@@ -215,7 +216,7 @@ class AnalysisProcessor(processor.ProcessorABC):
             cut = selection.all(*selection.names)
 
             if not isFilled:
-                hout['sumw'].fill(dataset=dataset, sumw=1, weight=events.genWeight.sum())
+                hout['sumw'].fill(dataset=dataset, sumw=1, weight=get_sumw(events))
                 isFilled=True
             hout['reweighting'].fill(dataset=dataset,
                                     tau21=leading_fj.tau21.sum(),
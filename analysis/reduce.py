@@ -7,81 +7,59 @@ import numpy as np
 from collections import defaultdict, OrderedDict
 from coffea import hist, processor 
 from coffea.util import load, save
-from helpers.futures_patch import patch_mp_connection_bpo_17560
+from helpers import histogram, manifest
+from helpers.reduction import Reduction
 
-def add(chunk_tmp_arr):
-     print('Job started')
-     return np.sum(chunk_tmp_arr)
+def reduce(folder,_dataset=None,_exclude=None,variable=None,workers=32,fanin=4,inflight=None,rebuild=False,scratch=None):
 
-def futuresum(tmp_arr):
-     while np.size(tmp_arr)>1:
-          chunk_sum=[]
-          chunk_tmp_arr = np.array_split(tmp_arr, int(np.size(tmp_arr)/2))
-          if len(chunk_tmp_arr)>1:
-               with concurrent.futures.ProcessPoolExecutor(max_workers=32) as executor:
-                    futures = set()
-                    futures.update(executor.submit(add,chunk_tmp_arr[i]) for i in range(0,len(chunk_tmp_arr)))
-                    if(len(futures)==0): continue
-                    try:
-                         total = len(futures)
-                         processed = 0
-                         while len(futures) > 0:
-                              finished = set(job for job in futures if job.done())
-                              for job in finished:
-                                   chunk_i = job.result()
-                                   chunk_sum.append(chunk_i)
-                              futures -= finished
-                         del finished
-                    except KeyboardInterrupt:
-                         print("Ok quitter")
-                         for job in futures: job.cancel()
-                    except:
-                         for job in futures: job.cancel()
-                         raise
-          else:
-               chunk_sum.append(add(chunk_tmp_arr[0]))
-          tmp_arr=np.array(chunk_sum)
-          print(tmp_arr)
-     return tmp_arr
-
-
-def reduce(folder,_dataset=None,_exclude=None,variable=None):
-
-     lists = {}
-     for filename in os.listdir(folder):
-          if '.futures' not in filename: continue
-          if filename.split("____")[0] not in lists: lists[filename.split("____")[0]] = []
-          lists[filename.split("____")[0]].append(folder+'/'+filename)
+     with Reduction(workers, fanin, inflight, scratch) as reduction:
+          lists = {}
+          for filename in os.listdir(folder):
+               if '.futures' not in filename: continue
+               if filename.split("____")[0] not in lists: lists[filename.split("____")[0]] = []
+               lists[filename.split("____")[0]].append(folder+'/'+filename)
           
-     for pdi in lists.keys():
-          if _dataset is not None:
-               if not any(_d in pdi for _d in _dataset.split(',')): continue
-          if _exclude is not None:
-               if any(_d in pdi for _d in _exclude.split(',')): continue
-          print(pdi)
-          tmp={}
-          for filename in lists[pdi]:
-               print('Opening:',filename)
-               hin = load(filename)
-               for k in hin.keys():
-                    if variable is not None:
-                         if not any(v==k for v in variable.split(',')): continue
-                    print('Considering variable',k)
-                    if k not in tmp: tmp[k]=[hin[k]]
-                    else: tmp[k].append(hin[k])
-               del hin
-          for k in tmp:
-               tmp_arr=futuresum(np.array(tmp[k]))
-               hists = {}
-               hists[k]=tmp_arr[0]
-               dataset = hist.Cat("dataset", "dataset", sorting='placement')
-               dataset_cats = ("dataset",)
-               dataset_map = OrderedDict()
-               for d in hists[k].identifiers('dataset'):
-                    if d.name.split("____")[0] not in dataset_map: dataset_map[d.name.split("____")[0]] = (d.name.split("____")[0]+"*",)
-               hists[k] = hists[k].group(dataset_cats, dataset, dataset_map)
-               print(hists)
-               save(hists, folder+'/'+k+'--'+pdi+'.reduced')
+          for pdi in lists.keys():
+               if _dataset is not None:
+                    if not any(_d in pdi for _d in _dataset.split(',')): continue
+               if _exclude is not None:
+                    if any(_d in pdi for _d in _exclude.split(',')): continue
+               print(pdi)
+               tmp={}
+               digests={}
+               for filename in lists[pdi]:
+                    digests[filename]=manifest.digest(filename)
+                    for k in histogram.keys(filename):
+                         if variable is not None:
+                              if not any(v==k for v in variable.split(',')): continue
+                         if k not in tmp: tmp[k]=[filename]
+                         else: tmp[k].append(filename)
+               for k in tmp:
+                    output = folder+'/'+k+'--'+pdi+'.reduced'
+                    entries = {os.path.basename(filename): {'md5': digests[filename]} for filename in tmp[k]}
+                    old = {} if rebuild else manifest.load(output)
+                    added, stale = manifest.compare(old, entries)
+                    if old and not added and not stale:
+                         print('Variable',k,'is up to date')
+                         continue
+                    # Only new files can be added to the existing sum, a changed
+                    # or removed file means summing the dataset again
+                    files = tmp[k]
+                    if old and not stale: files = [filename for filename in tmp[k] if os.path.basename(filename) in added]
+                    print('Reducing variable',k,'from',len(files),'files')
+                    tmp_sum=reduction.sum(files, k)
+                    hists = {}
+                    hists[k]=tmp_sum.to_hist()
+                    dataset = hist.Cat("dataset", "dataset", sorting='placement')
+                    dataset_cats = ("dataset",)
+                    dataset_map = OrderedDict()
+                    for d in hists[k].identifiers('dataset'):
+                         if d.name.split("____")[0] not in dataset_map: dataset_map[d.name.split("____")[0]] = (d.name.split("____")[0]+"*",)
+                    hists[k] = histogram.DenseHist.from_hist(hists[k].group(dataset_cats, dataset, dataset_map), tmp_sum.dtype)
+                    if files is not tmp[k]: hists[k] = histogram.load(output, [k])[k].add(hists[k])
+                    print(hists)
+                    histogram.save(hists, output)
+                    manifest.save(output, entries)
 
 if __name__ == '__main__':
     from optparse import OptionParser
@@ -90,7 +68,11 @@ if __name__ == '__main__':
     parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default=None)
     parser.add_option('-e', '--exclude', help='exclude', dest='exclude', default=None)
     parser.add_option('-v', '--variable', help='variable', dest='variable', default=None)
+    parser.add_option('-w', '--workers', help='Number of workers', dest='workers', type=int, default=32)
+    parser.add_option('--fanin', help='Number of histograms added by each worker task', dest='fanin', type=int, default=4)
+    parser.add_option('--inflight', help='Maximum number of histograms read or held at once (default: twice the workers)', dest='inflight', type=int)
+    parser.add_option('--scratch', help='Directory where the partial sums are handed between the workers (default: /dev/shm, or $TMPDIR when full)', dest='scratch')
+    parser.add_option('--rebuild', action='store_true', dest='rebuild', help='Sum all the files again, even the ones already in the .reduced files')
     (options, args) = parser.parse_args()
 
-    patch_mp_connection_bpo_17560()    
-    reduce(options.folder,options.dataset,options.exclude,options.variable)
+    reduce(options.folder,options.dataset,options.exclude,options.variable,options.workers,options.fanin,options.inflight,options.rebuild,options.scratch)
@@ -48,3 +48,4 @@ echo "python reduce.py --folder ${1} --variable ${2} --dataset ${3}"
 python reduce.py --folder ${1} --variable ${2} --dataset ${3}
 ls ${1}/${2}--${3}.reduced
 cp ${1}/${2}--${3}.reduced ${_CONDOR_SCRATCH_DIR}/${2}_${3}.reduced
+cp ${1}/${2}--${3}.manifest ${_CONDOR_SCRATCH_DIR}/${2}_${3}.manifest
@@ -13,7 +13,7 @@ from optparse import OptionParser
 import uproot, uproot_methods
 import numpy as np
 from coffea import hist
-from coffea.util import load
+from helpers import histogram
 
 parser = OptionParser()
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default='')
@@ -33,6 +33,7 @@ if options.tar:
               '--exclude=\'analysis/results\' '
               '--exclude=\'analysis/hists/*/*.reduced\' '
               '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.manifest\' '
               '../../decaf')
     os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
 
@@ -54,7 +55,7 @@ Transfer_Input_Files = reduce.sh, /tmp/x509up_u556950957
 Output = logs/condor/reduce/out/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/reduce/err/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/reduce/log/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(VARIABLE)_$ENV(SAMPLE).reduced=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).reduced"
+TransferOutputRemaps = "$ENV(VARIABLE)_$ENV(SAMPLE).reduced=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).reduced;$ENV(VARIABLE)_$ENV(SAMPLE).manifest=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).manifest"
 Arguments = $ENV(FOLDER) $ENV(VARIABLE) $ENV(SAMPLE) $ENV(CLUSTER) $ENV(USER)
 JobBatchName = $ENV(VARIABLE)
 accounting_group=group_cms
@@ -74,7 +75,7 @@ Transfer_Input_Files = reduce.sh
 Output = logs/condor/reduce/out/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/reduce/err/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/reduce/log/$ENV(TAG)_$ENV(SAMPLE)_$ENV(VARIABLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(VARIABLE)_$ENV(SAMPLE).reduced=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).reduced"
+TransferOutputRemaps = "$ENV(VARIABLE)_$ENV(SAMPLE).reduced=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).reduced;$ENV(VARIABLE)_$ENV(SAMPLE).manifest=$ENV(PWD)/$ENV(FOLDER)/$ENV(VARIABLE)--$ENV(SAMPLE).manifest"
 Arguments = $ENV(FOLDER) $ENV(VARIABLE) $ENV(SAMPLE) $ENV(CLUSTER) $ENV(USER)
 request_cpus = 16
 request_disk = 10G
@@ -93,7 +94,7 @@ for filename in os.listdir(options.folder):
     if filename.split("____")[0] not in pd: pd.append(filename.split("____")[0])
 
 tag=options.folder.split('/')[-1]
-variables=load(options.folder+'/'+futurefile).keys()
+variables=histogram.keys(options.folder+'/'+futurefile)
 for pdi in pd:
     if options.dataset:
         if not any(_dataset in pdi for _dataset in options.dataset.split(',')): continue
@@ -5,14 +5,23 @@ import json
 import time
 import cloudpickle
 import gzip
+import hashlib
 import os
+import resource
 from optparse import OptionParser
 
 import uproot
 import numpy as np
 from coffea import hist, processor
 from coffea.util import load, save
+from coffea.processor.executor import FileMeta
 from coffea.nanoaod.methods import collection_methods, LorentzVector, FatJet 
+from helpers.catalog import Catalog
+from helpers import scheduler
+from helpers.columns import discover
+from helpers import skim
+from helpers.cache import Cache
+from helpers import histogram
 
 collection_methods['AK15Puppi'] = FatJet
 collection_methods['AK15PuppiSubJet'] = LorentzVector
@@ -23,39 +32,207 @@ parser.add_option('-p', '--processor', help='processor', dest='processor')
 parser.add_option('-m', '--metadata', help='metadata', dest='metadata')
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset')
 parser.add_option('-w', '--workers', help='Number of workers to use for multi-worker executors (e.g. futures or condor)', dest='workers', type=int, default=8)
+parser.add_option('-k', '--catalog', help='File catalog', dest='catalog', default='metadata/catalog.db')
+parser.add_option('-g', '--global', action='store_true', dest='schedule', help='Process the chunks of all datasets from a single pool')
+parser.add_option('-j', '--journal', help='Directory where processed chunks are journaled, to resume interrupted runs', dest='journal')
+parser.add_option('-c', '--columns', action='store_true', dest='columns', help='Read only the branches used by the processor, traced on a few events')
+parser.add_option('-t', '--timing', action='store_true', dest='timing', help='Time the stages of the processor and print a summary')
+parser.add_option('-s', '--skim', action='store_true', dest='skim', help='Process the skims written by skim.py instead of the original files')
+parser.add_option('--chunksize', help='Number of entries per chunk (initial value, if adaptive)', dest='chunksize', type=int, default=100000)
+parser.add_option('--target-chunk-seconds', help='Adapt the chunk size to take about this many seconds per chunk', dest='target_seconds', type=float)
+parser.add_option('--max-worker-mem', help='Adapt the chunk size to keep the memory of each worker below this many MB', dest='max_memory', type=float)
+parser.add_option('--cache', help='Directory where the remote input files are copied ahead of processing', dest='cache')
+parser.add_option('--float32', action='store_true', dest='float32', help='Store the histograms in single precision')
+parser.add_option('--cache-size', help='Maximum size of the cache directory, in GB', dest='cache_size', type=float, default=100)
 (options, args) = parser.parse_args()
 
+adaptive = options.target_seconds is not None or options.max_memory is not None
+max_memory = options.max_memory*1e6 if options.max_memory is not None else None
+
+cache = None
+if options.cache:
+    cache = Cache(options.cache, options.cache_size*1e9)
+
 processor_instance=load('data/'+options.processor+'.processor')
+if options.timing: processor_instance.timing = True
+with open('data/'+options.processor+'.processor', 'rb') as fin:
+    version = hashlib.md5(fin.read()).hexdigest()
 
 fileslice = slice(None)
 with open("metadata/"+options.metadata+".json") as fin:
     samplefiles = json.load(fin)
 
+catalog = None
+if os.path.exists(options.catalog):
+    catalog = Catalog(options.catalog)
+
+timing = processor.dict_accumulator({
+    'events':  processor.value_accumulator(int),
+    'seconds': processor.defaultdict_accumulator(float),
+})
+memo = processor.dict_accumulator({
+    'hits':   processor.defaultdict_accumulator(int),
+    'misses': processor.defaultdict_accumulator(int),
+})
+
+def report(timing):
+    nevents = timing['events'].value
+    seconds = timing['seconds']
+    total = sum(seconds.values())
+    print('%-30s %10s %6s %12s' % ('Stage', 'Seconds', '%', 'Events/s'))
+    for stage in sorted(seconds, key=seconds.get, reverse=True):
+        print('%-30s %10.1f %6.1f %12.0f' % (stage, seconds[stage], 100*seconds[stage]/total, nevents/seconds[stage] if seconds[stage] else 0))
+    print('%-30s %10.1f %6.1f %12.0f' % ('Total', total, 100, nevents/total if total else 0))
+
+def report_memo(memo):
+    print('%-30s %10s %10s %8s' % ('Column', 'Computed', 'Reused', 'Hit %'))
+    for name in sorted(memo['misses']):
+        hits, misses = memo['hits'][name], memo['misses'][name]
+        print('%-30s %10d %10d %8.1f' % (name, misses, hits, 100*hits/(hits+misses)))
+
+def store(dataset, output, usage):
+    if 'timing' in output: timing.add(output.pop('timing'))
+    if 'memo' in output: memo.add(output.pop('memo'))
+    #nbins = sum(sum(arr.size for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
+    #nfilled = sum(sum(np.sum(arr > 0) for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
+    #print("Filled %.1fM bins" % (nbins/1e6, ))
+    #print("Nonzero bins: %.1f%%" % (100*nfilled/nbins, ))
+
+    os.system("mkdir -p hists/"+options.processor)
+    histogram.save(histogram.compact(output, np.float32 if options.float32 else np.float64),'hists/'+options.processor+'/'+dataset+'.futures')        
+
+    ###
+    # Throughput and memory report, written next to the .futures file
+    ###
+
+    stats = dict(usage)
+    stats.update({
+        'dataset':   dataset,
+        'processor': options.processor,
+        'version':   version,
+        'workers':   options.workers,
+        'date':      time.time(),
+    })
+    if usage['events'] and usage['wall']:
+        stats['events_per_second'] = usage['events']/usage['wall']
+        stats['cpu_per_event'] = usage['cpu']/usage['events']
+    with open('hists/'+options.processor+'/'+dataset+'.stats', 'w') as fout:
+        json.dump(stats, fout, indent=4)
+    print("%d events in %.1f s (%.0f events/s), %.1f s CPU (%.0f us/event), %.1f MB read, %.0f MB peak RSS" % (
+        usage['events'], usage['wall'], stats.get('events_per_second', 0), usage['cpu'],
+        1e6*stats.get('cpu_per_event', 0), (usage['bytes'] or 0)/1e6, usage['maxrss']/1e6))
+
+def failed(filename, error):
+    if catalog: catalog.mark([filename], good=False, error=repr(error))
+
+fileset = {}
 for dataset, info in samplefiles.items():
-    filelist = {}
     if options.dataset:
         if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
-    print('Processing:',dataset)
     files = []
     for file in info['files'][fileslice]:
         files.append(file)
-    filelist[dataset] = files
+    if catalog:
+        bad = catalog.bad(files)
+        if bad: print('Skipping',len(bad),'files of',dataset,'that could not be read')
+        files = [file for file in files if file not in bad]
+    fileset[dataset] = files
+
+columns = None
+if options.columns and not options.skim:
+    columns = discover(options.processor, processor_instance, fileset)
+
+if options.skim:
+    catalog = None
+    for dataset, files in fileset.items():
+        skims = [skim.path('skims/'+options.processor, dataset, file) for file in files]
+        missing = [file for file in skims if not os.path.exists(file)]
+        if missing: print(len(missing),'files of',dataset,'have not been skimmed yet, run skim.py first')
+        fileset[dataset] = [file for file in skims if file not in missing]
 
+if options.schedule:
     tstart = time.time()
-    output = processor.run_uproot_job(filelist,
-                                      treename='Events',
-                                      processor_instance=processor_instance,
-                                      executor=processor.futures_executor,
-                                      executor_args={'nano': True, 'workers': options.workers},
-                                      )
-    
-    #nbins = sum(sum(arr.size for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
-    #nfilled = sum(sum(np.sum(arr > 0) for arr in h._sumw.values()) for h in output.values() if isinstance(h, hist.Hist))
-    #print("Filled %.1fM bins" % (nbins/1e6, ))
-    #print("Nonzero bins: %.1f%%" % (100*nfilled/nbins, ))
+    nentries = None
+    if catalog: nentries = catalog.nentries([file for files in fileset.values() for file in files])
+    scheduler.run(fileset,
+                  processor_instance=processor_instance,
+                  callback=store,
+                  workers=options.workers,
+                  nentries=nentries,
+                  chunksize=options.chunksize,
+                  journal=options.journal,
+                  columns=columns,
+                  target_seconds=options.target_seconds,
+                  max_memory=max_memory,
+                  cache=cache,
+                  failed=failed,
+                  version=options.processor+':'+version,
+                  )
+    if catalog: catalog.mark([file for files in fileset.values() for file in files], good=True)
+    print("%.1f s overall" % (time.time() - tstart, ))
+else:
+    datasets = list(fileset.keys())
+    for i, (dataset, files) in enumerate(fileset.items()):
+        print('Processing:',dataset)
+        filelist = {}
+        filelist[dataset] = files
+        tstart = time.time()
+        if cache and i+1 < len(datasets): cache.prefetch(fileset[datasets[i+1]])
+        if options.journal or options.columns or options.skim or adaptive:
+            nentries = None
+            if catalog: nentries = catalog.nentries(files)
+            scheduler.run(filelist,
+                          processor_instance=processor_instance,
+                          callback=store,
+                          workers=options.workers,
+                          nentries=nentries,
+                          chunksize=options.chunksize,
+                          journal=options.journal,
+                          columns=columns,
+                          target_seconds=options.target_seconds,
+                          max_memory=max_memory,
+                          cache=cache,
+                          failed=failed,
+                          version=options.processor+':'+version,
+                          )
+        else:
+            metadata_cache = None
+            if catalog: metadata_cache = catalog.metadata_cache(files)
+            if cache:
+                local = {file: cache.get(file) for file in files}
+                filelist[dataset] = [local[file] for file in files]
+                if metadata_cache: metadata_cache = {FileMeta(meta.dataset, local[meta.filename], meta.treename): value for meta, value in metadata_cache.items()}
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            try:
+                output, metrics = processor.run_uproot_job(filelist,
+                                                           treename='Events',
+                                                           processor_instance=processor_instance,
+                                                           executor=processor.futures_executor,
+                                                           executor_args={'nano': True, 'workers': options.workers, 'savemetrics': True},
+                                                           chunksize=options.chunksize,
+                                                           metadata_cache=metadata_cache,
+                                                           )
+            except Exception:
+                # coffea does not tell which file failed: inspect them all
+                # again, so that the ones that cannot be read are marked bad
+                if catalog: catalog.fill(files, workers=options.workers, refresh=True)
+                raise
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            # The workers have exited: their CPU time is in RUSAGE_CHILDREN,
+            # and ru_maxrss is the largest RSS of any worker so far
+            store(dataset, output, {
+                'events': metrics['entries'].value,
+                'bytes':  metrics['bytesread'].value if 'bytesread' in metrics else None,
+                'cpu':    (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime),
+                'maxrss': after.ru_maxrss * 1024,
+                'wall':   time.time() - tstart,
+            })
+            if cache: cache.release(files)
+        if catalog: catalog.mark(files, good=True)
 
-    os.system("mkdir -p hists/"+options.processor)
-    save(output,'hists/'+options.processor+'/'+dataset+'.futures')        
-    dt = time.time() - tstart
-    nworkers = options.workers
-    print("%.2f us*cpu overall" % (1e6*dt*nworkers, ))
+if options.timing:
+    report(timing)
+    report_memo(memo)
+if cache:
+    print('Input files read from the cache:',cache.hits,'times, remotely:',cache.misses,'times')
+    cache.close()
@@ -46,4 +46,5 @@ echo "python run.py --metadata ${1} --dataset ${2} --processor ${3}"
 python run.py --metadata ${1} --dataset ${2} --processor ${3}
 ls hists/${3}/${2}.futures
 cp hists/${3}/${2}.futures ${_CONDOR_SCRATCH_DIR}/${3}_${2}.futures
+cp hists/${3}/${2}.stats ${_CONDOR_SCRATCH_DIR}/${3}_${2}.stats
 
@@ -13,6 +13,7 @@ from optparse import OptionParser
 import uproot, uproot_methods
 import numpy as np
 from coffea import hist
+from helpers.catalog import Catalog
 
 parser = OptionParser()
 parser.add_option('-d', '--dataset', help='dataset', dest='dataset', default='')
@@ -22,6 +23,7 @@ parser.add_option('-m', '--metadata', help='metadata', dest='metadata', default=
 parser.add_option('-c', '--cluster', help='cluster', dest='cluster', default='lpc')
 parser.add_option('-t', '--tar', action='store_true', dest='tar')
 parser.add_option('-x', '--copy', action='store_true', dest='copy')
+parser.add_option('-k', '--catalog', help='File catalog', dest='catalog', default='metadata/catalog.db')
 (options, args) = parser.parse_args()
 
 os.system("mkdir -p hists/"+options.processor)
@@ -32,9 +34,11 @@ if options.tar:
               '--exclude=\'analysis/plots\' '
               '--exclude=\'analysis/datacards\' '
               '--exclude=\'analysis/results\' '
+              '--exclude=\'analysis/skims\' '
               '--exclude=\'analysis/data/models\' '
               '--exclude=\'analysis/hists/*/*.futures\' '
               '--exclude=\'analysis/hists/*/*.merged\' '
+              '--exclude=\'analysis/hists/*/*.manifest\' '
               '--exclude=\'analysis/hists/*/*.reduced\' '
               '../../decaf')
     os.system('tar --exclude-caches-all --exclude-vcs -czvf ../../pylocal.tgz -C ~/.local/lib/python3.6/ site-packages')
@@ -57,7 +61,7 @@ Transfer_Input_Files = run.sh, /tmp/x509up_u556950957
 Output = logs/condor/run/out/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/run/err/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/run/log/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures"
+TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures;$ENV(PROCESSOR)_$ENV(SAMPLE).stats=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).stats"
 Arguments = $ENV(METADATA) $ENV(SAMPLE) $ENV(PROCESSOR) $ENV(CLUSTER) $ENV(USER)
 accounting_group=group_cms
 JobBatchName = $ENV(BTCN)
@@ -77,7 +81,7 @@ Transfer_Input_Files = run.sh
 Output = logs/condor/run/out/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stdout
 Error = logs/condor/run/err/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).stderr
 Log = logs/condor/run/log/$ENV(PROCESSOR)_$ENV(SAMPLE)_$(Cluster)_$(Process).log
-TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures"
+TransferOutputRemaps = "$ENV(PROCESSOR)_$ENV(SAMPLE).futures=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).futures;$ENV(PROCESSOR)_$ENV(SAMPLE).stats=$ENV(PWD)/hists/$ENV(PROCESSOR)/$ENV(SAMPLE).stats"
 Arguments = $ENV(METADATA) $ENV(SAMPLE) $ENV(PROCESSOR) $ENV(CLUSTER) $ENV(USER) 
 JobBatchName = $ENV(BTCN)
 request_cpus = 8
@@ -91,11 +95,21 @@ jdl_file.close()
 with open('metadata/'+options.metadata+'.json') as fin:
     datadef = json.load(fin)
 
+catalog = None
+if os.path.exists(options.catalog):
+    catalog = Catalog(options.catalog)
+
 for dataset, info in datadef.items():
     if options.dataset:
         if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
     if options.exclude:
         if any(_dataset in dataset for _dataset in options.exclude.split(',')): continue
+    if catalog:
+        bad = catalog.bad(info['files'])
+        if len(bad) == len(info['files']):
+            print('Skipping',dataset,'as none of its files can be read')
+            continue
+        if bad: print(len(bad),'files in',dataset,'will be skipped')
     os.system('mkdir -p logs/condor/run/err/')
     os.system('rm -rf logs/condor/run/err/*'+options.processor+'*'+dataset+'*')
     os.system('mkdir -p logs/condor/run/log/')
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+import json
+import time
+import os
+import concurrent.futures
+from optparse import OptionParser
+
+from coffea.util import load
+from coffea.nanoaod.methods import collection_methods, LorentzVector, FatJet
+from helpers.catalog import Catalog
+from helpers.columns import discover
+from helpers import skim
+
+collection_methods['AK15Puppi'] = FatJet
+collection_methods['AK15PuppiSubJet'] = LorentzVector
+FatJet.subjetmap['AK15Puppi'] = 'AK15PuppiSubJet'
+
+parser = OptionParser()
+parser.add_option('-p', '--processor', help='processor', dest='processor')
+parser.add_option('-m', '--metadata', help='metadata', dest='metadata')
+parser.add_option('-d', '--dataset', help='dataset', dest='dataset')
+parser.add_option('-w', '--workers', help='Number of workers', dest='workers', type=int, default=8)
+parser.add_option('-k', '--catalog', help='File catalog', dest='catalog', default='metadata/catalog.db')
+parser.add_option('-x', '--exclude', help='Comma-separated prefixes of the cuts left out of the preselection', dest='exclude', default='mindphi_,minDphi_,calo_')
+parser.add_option('-r', '--refresh', action='store_true', dest='refresh', help='Skim again the files that already have a skim')
+(options, args) = parser.parse_args()
+
+processor_instance=load('data/'+options.processor+'.processor')
+skim._processor = processor_instance
+directory = 'skims/'+options.processor
+exclude = [cut for cut in options.exclude.split(',') if cut]
+
+with open("metadata/"+options.metadata+".json") as fin:
+    samplefiles = json.load(fin)
+
+catalog = None
+if os.path.exists(options.catalog):
+    catalog = Catalog(options.catalog)
+
+fileset = {}
+for dataset, info in samplefiles.items():
+    if options.dataset:
+        if not any(_dataset in dataset for _dataset in options.dataset.split(',')): continue
+    files = info['files']
+    if catalog:
+        bad = catalog.bad(files)
+        files = [file for file in files if file not in bad]
+    fileset[dataset] = files
+
+columns = discover(options.processor, processor_instance, fileset)
+
+tstart = time.time()
+nread, nkept = 0, 0
+with concurrent.futures.ProcessPoolExecutor(max_workers=options.workers) as executor:
+    futures = {}
+    for dataset, files in fileset.items():
+        for file in files:
+            output = skim.path(directory, dataset, file)
+            if os.path.exists(output) and not options.refresh: continue
+            futures[executor.submit(skim.skim, dataset, file, output, columns[dataset], exclude)] = file
+    print('Skimming',len(futures),'files, leaving out the cuts',', '.join(exclude))
+    try:
+        for job in concurrent.futures.as_completed(futures):
+            try:
+                read, kept = job.result()
+            except Exception as e:
+                print('Could not skim',futures[job]+':',e)
+                continue
+            nread += read
+            nkept += kept
+    except KeyboardInterrupt:
+        print("Ok quitter")
+        for job in futures: job.cancel()
+
+if nread: print('Kept %d of %d events (%.2f%%)' % (nkept, nread, 100.*nkept/nread))
+print('Skims written in %s in %.0f s' % (directory, time.time() - tstart))
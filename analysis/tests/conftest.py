@@ -0,0 +1,31 @@
+import ast
+import importlib
+import os
+import sys
+
+import pytest
+
+analysis = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, analysis)
+
+def functions(script, **namespace):
+    """
+    Functions defined in script (relative to analysis/), without running
+    the rest of it. namespace provides the modules they use.
+    """
+    with open(os.path.join(analysis, script)) as fin:
+        tree = ast.parse(fin.read())
+    tree.body = [node for node in tree.body if isinstance(node, ast.FunctionDef)]
+    exec(compile(tree, script, 'exec'), namespace)
+    return namespace
+
+@pytest.fixture
+def common(tmp_path, monkeypatch):
+    """
+    utils/common.py, imported in a temporary directory since it saves
+    data/common.coffea when it is imported.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    import utils.common
+    return importlib.reload(utils.common)
@@ -0,0 +1,66 @@
+import os
+import time
+
+import pytest
+
+from helpers import cache as _cache
+from helpers.cache import Cache
+
+@pytest.fixture
+def xrdcp(monkeypatch):
+    """
+    xrdcp writing 100 bytes per file, failing for the urls with 'bad'.
+    """
+    copied = []
+    def call(command):
+        url, output = command[-2:]
+        if 'bad' in url: return 1
+        copied.append(url)
+        with open(output, 'wb') as fout:
+            fout.write(b'x'*100)
+        time.sleep(0.01)
+        return 0
+    monkeypatch.setattr(_cache.subprocess, 'call', call)
+    return copied
+
+def wait(cache):
+    """
+    Wait for the copies started so far, with a single worker.
+    """
+    cache._executor.submit(lambda: None).result()
+
+def test_get(tmp_path, xrdcp):
+    cache = Cache(str(tmp_path), 1000, workers=1)
+    assert cache.get('/local/file.root') == '/local/file.root'
+    assert cache.get('root://eos//a.root') == 'root://eos//a.root'
+    cache.prefetch(['root://eos//a.root', '/local/file.root'])
+    wait(cache)
+    assert xrdcp == ['root://eos//a.root']
+    assert cache.get('root://eos//a.root') == cache.path('root://eos//a.root')
+    assert os.path.getsize(cache.path('root://eos//a.root')) == 100
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_evict(tmp_path, xrdcp):
+    cache = Cache(str(tmp_path), 250, workers=1)
+    cache.prefetch(['root://eos//a.root'])
+    wait(cache)
+    cache.get('root://eos//a.root')
+    cache.prefetch(['root://eos//b.root', 'root://eos//c.root', 'root://eos//d.root'])
+    wait(cache)
+    # a is being read, b is the least recently used of the others
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(cache.path(url)) for url in ['root://eos//a.root', 'root://eos//d.root'])
+    cache.release(['root://eos//a.root'])
+    cache.prefetch(['root://eos//e.root'])
+    wait(cache)
+    assert sorted(os.listdir(str(tmp_path))) == sorted(os.path.basename(cache.path(url)) for url in ['root://eos//d.root', 'root://eos//e.root'])
+
+def test_failed(tmp_path, xrdcp):
+    cache = Cache(str(tmp_path), 1000, workers=1)
+    with pytest.warns(UserWarning):
+        cache.prefetch(['root://eos//bad.root'])
+        wait(cache)
+    assert os.listdir(str(tmp_path)) == []
+    assert cache.get('root://eos//bad.root') == 'root://eos//bad.root'
+    # Not tried again
+    cache.prefetch(['root://eos//bad.root'])
+    assert not cache._fetching
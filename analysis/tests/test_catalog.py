@@ -0,0 +1,34 @@
+from helpers import catalog
+from helpers.catalog import Catalog
+
+def inspect(url):
+    if 'bad' in url: return {'good': 0, 'error': 'cannot open', 'lastseen': 0.}
+    return {'nevents': 10, 'bytes': 100, 'uuid': '00', 'branches': '[]', 'sumw': 5., 'sumw2': 5., 'ngen': 10., 'good': 1, 'error': None, 'lastseen': 0.}
+
+def test_fill(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'inspect', inspect)
+    c = Catalog(str(tmp_path/'catalog.db'))
+    c.fill(['a.root', 'bad.root'])
+    assert c.get('a.root')['nevents'] == 10
+    assert c.known(['a.root', 'bad.root', 'b.root']) == {'a.root', 'bad.root'}
+    assert c.bad(['a.root', 'bad.root']) == {'bad.root'}
+    assert c.nentries(['a.root', 'bad.root', 'b.root']) == {'a.root': 10}
+    c.close()
+
+def test_mark(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, 'inspect', inspect)
+    c = Catalog(str(tmp_path/'catalog.db'))
+    c.fill(['a.root'])
+    # As run.py does for files that were never inspected
+    c.mark(['a.root', 'b.root'], good=True)
+    assert c.get('b.root') is None
+    assert c.known(['a.root', 'b.root']) == {'a.root'}
+    c.mark(['a.root'], good=False, error='failed')
+    assert c.bad(['a.root']) == {'a.root'}
+    assert c.get('a.root')['nevents'] == 10
+    # Rows without the content of the file, as left by the older mark()
+    c.update('c.root', good=1)
+    assert c.known(['c.root']) == set()
+    c.fill(['a.root', 'b.root', 'c.root'])
+    assert c.nentries(['a.root', 'b.root', 'c.root']) == {'b.root': 10, 'c.root': 10}
+    c.close()
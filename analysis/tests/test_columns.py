@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+
+from helpers import columns
+
+class Tree(object):
+    """
+    Flat branches answering uproot's TTree.arrays().
+    """
+
+    def __init__(self, **branches):
+        self._branches = branches
+        self.read = None
+
+    def keys(self):
+        return [k.encode() for k in self._branches]
+
+    def arrays(self, branches, entrystart, entrystop, flatten, namedecode):
+        self.read = list(branches)
+        offsets = np.concatenate([[0], np.cumsum(self._branches['nJet'])]).astype(int)
+        out = {}
+        for branch in branches:
+            if branch.startswith('Jet_'):
+                out[branch] = self._branches[branch][offsets[entrystart]:offsets[entrystop]]
+            else:
+                out[branch] = self._branches[branch][entrystart:entrystop]
+        return out
+
+def tree():
+    rng = np.random.RandomState(0)
+    njet = rng.randint(0, 4, 100).astype(np.uint32)
+    return Tree(nJet=njet, Jet_pt=rng.rand(njet.sum()).astype(np.float32), Jet_eta=rng.rand(njet.sum()).astype(np.float32), MET_pt=rng.rand(100).astype(np.float32), MET_phi=rng.rand(100).astype(np.float32))
+
+def test_load(capsys):
+    t = tree()
+    events = columns.load(t, ['nJet', 'Jet_pt', 'MET_pt', 'Photon_pt'], 10, 60, {'dataset': 'A'})
+    assert sorted(t.read) == ['Jet_pt', 'MET_pt', 'nJet']
+    assert events.size == 50
+    assert events.metadata['dataset'] == 'A'
+    np.testing.assert_array_equal(events.MET.pt, t._branches['MET_pt'][10:60])
+    np.testing.assert_array_equal(events.Jet.counts, t._branches['nJet'][10:60])
+    offsets = np.concatenate([[0], np.cumsum(t._branches['nJet'])]).astype(int)
+    np.testing.assert_array_equal(events.Jet.pt.flatten(), t._branches['Jet_pt'][offsets[10]:offsets[60]])
+    assert capsys.readouterr().out == ''
+
+def test_tracer():
+    tracer = columns.Tracer()
+    tracer['file;Events;0-100;Jet_pt'] = 1
+    tracer['file;Events;0-100;nJet'] = 2
+    assert tracer.branches == {'Jet_pt', 'nJet'}
+    assert tracer['file;Events;0-100;nJet'] == 2
+
+def test_discover(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('data')
+    with open('data/test.processor', 'w') as fout:
+        fout.write('')
+    traced = []
+    def trace(processor_instance, dataset, filename):
+        traced.append(dataset)
+        return ['MET_pt', dataset]
+    monkeypatch.setattr(columns, 'trace', trace)
+    fileset = {'TTJets____0_': ['a.root'], 'TTJets____1_': ['b.root'], 'MET____0_': ['c.root'], 'WJets____0_': []}
+    found = columns.discover('test', None, fileset)
+    assert sorted(traced) == ['MET____0_', 'TTJets____0_']
+    assert found['TTJets____1_'] == found['TTJets____0_']
+    assert 'WJets____0_' not in found
+    # Cached, until the processor file changes
+    traced.clear()
+    assert columns.discover('test', None, fileset) == found
+    assert traced == []
+    mtime = os.path.getmtime('data/test.columns')
+    os.utime('data/test.processor', (mtime+1, mtime+1))
+    columns.discover('test', None, fileset)
+    assert sorted(traced) == ['MET____0_', 'TTJets____0_']
+    with open('data/test.columns') as fin:
+        assert sorted(json.load(fin)) == ['MET', 'TTJets']
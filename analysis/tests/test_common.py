@@ -0,0 +1,131 @@
+import numpy as np
+import pytest
+from coffea import hist, processor
+from coffea.analysis_objects import JaggedCandidateArray
+
+class Events(object):
+
+    def __init__(self, genWeight, **metadata):
+        self.genWeight = np.asarray(genWeight)
+        self.metadata = metadata
+
+class Runs(object):
+
+    def __init__(self, **branches):
+        self._branches = branches
+
+    def keys(self):
+        return [k.encode() for k in self._branches]
+
+    def array(self, branch):
+        return np.asarray(self._branches[branch])
+
+def test_get_sumw(common, monkeypatch):
+    files = {
+        'runs.root':   {'Runs': Runs(genEventSumw=[10., 5.])},
+        'legacy.root': {'Runs': Runs(genEventSumw_=[7.])},
+        'nosumw.root': {'Runs': Runs(genEventCount=[3.])},
+    }
+    monkeypatch.setattr(common.uproot, 'open', lambda filename: files[filename])
+    get_sumw = common.get_sumw
+    assert get_sumw(Events([1., 2.])) == 3.
+    assert get_sumw(Events([1., 2.], filename='runs.root', entrystart=0)) == 15.
+    assert get_sumw(Events([1., 2.], filename='runs.root', entrystart=2)) == 0.
+    assert get_sumw(Events([1., 2.], filename='legacy.root', entrystart=0)) == 7.
+    with pytest.warns(UserWarning):
+        assert get_sumw(Events([1., 2.], filename='nosumw.root', entrystart=0)) == 3.
+    assert get_sumw(Events([4.], filename='nosumw.root', entrystart=2)) == 4.
+    # Skims carry the sum of the original file
+    assert get_sumw(Events([1.], filename='a.parquet', entrystart=0, sumw=20.)) == 20.
+    assert get_sumw(Events([1.], filename='a.parquet', entrystart=1, sumw=20.)) == 0.
+    with pytest.raises(RuntimeError):
+        get_sumw(Events([1.], filename='b.parquet', entrystart=0))
+    # A Runs tree that cannot be read is an error
+    with pytest.raises(KeyError):
+        get_sumw(Events([1.], filename='missing.root', entrystart=0))
+
+def collection(rng, counts):
+    n = counts.sum()
+    return JaggedCandidateArray.candidatesfromcounts(counts, pt=rng.rand(n)*100+10, eta=rng.rand(n)*5-2.5, phi=rng.rand(n)*2*np.pi-np.pi, mass=np.zeros(n))
+
+def test_match(common):
+    rng = np.random.RandomState(0)
+    a = collection(rng, rng.randint(0, 4, 500))
+    b = collection(rng, rng.randint(0, 3, 500))
+    c = collection(rng, rng.randint(0, 3, 500))
+    def naive(a, b, val):
+        out = []
+        for a_eta, a_phi, b_eta, b_phi in zip(a.eta, a.phi, b.eta, b.phi):
+            for eta, phi in zip(a_eta, a_phi):
+                dphi = (phi - b_phi + np.pi) % (2*np.pi) - np.pi
+                out.append(bool(((eta - b_eta)**2 + dphi**2 < val**2).any()))
+        return np.array(out, dtype=bool)
+    for val in [0.4, 1.5]:
+        assert (common.match(a, b, val).flatten() == naive(a, b, val)).all()
+        assert (common.match(a, [b, c], val).flatten() == (naive(a, b, val) | naive(a, c, val))).all()
+    assert (common.match(a, b, 0.4).counts == a.counts).all()
+
+def empty():
+    return hist.Hist('Events',
+                     hist.Cat('dataset', 'dataset'),
+                     hist.Cat('region', 'region'),
+                     hist.Cat('systematic', 'systematic'),
+                     hist.Bin('recoil', 'recoil', [250, 310, 370, 470, 590, 3000]),
+                     hist.Bin('fjmass', 'fjmass', [0, 40, 60, 80, 110, 150, 250]))
+
+def assert_same(a, b):
+    va, vb = a.values(sumw2=True, overflow='all'), b.values(sumw2=True, overflow='all')
+    assert va.keys() == vb.keys()
+    for k in va:
+        np.testing.assert_allclose(va[k][0], vb[k][0])
+        np.testing.assert_allclose(va[k][1], vb[k][1])
+
+def test_fill_multi(common):
+    rng = np.random.RandomState(1)
+    n = 2000
+    recoil, fjmass = rng.rand(n)*1000+200, rng.rand(n)*300
+    weights = rng.rand(n, 4)*(rng.rand(n, 1) < 0.4)
+    labels = ['nominal', 'aUp', 'aDown', 'b']
+    ref, h = empty(), empty()
+    for i, label in enumerate(labels):
+        ref.fill(dataset='x', region='sr', systematic=label, recoil=recoil, fjmass=fjmass, weight=weights[:, i])
+    common.fill_multi(h, 'systematic', labels, weights, dataset='x', region='sr', recoil=recoil, fjmass=fjmass)
+    assert_same(ref, h)
+
+def test_weights(common):
+    rng = np.random.RandomState(3)
+    n = 100
+    a, b, c = rng.rand(n), rng.rand(n), rng.rand(n)
+    a[:10] = 0
+    ref, weights = processor.Weights(n), common.Weights(n)
+    for w in (ref, weights):
+        w.add('a', a.copy(), a*1.1, a*0.9)
+        w.add('b', b.copy(), b*1.2)
+        w.add('c', c.copy())
+    modifiers = [None, 'aUp', 'aDown', 'bUp', 'bDown']
+    for modifier in modifiers:
+        np.testing.assert_allclose(ref.weight(modifier), weights.weight(modifier))
+    np.testing.assert_allclose(np.stack([ref.weight(m) for m in modifiers], axis=1), weights.stack(modifiers))
+    assert ref.variations == weights.variations
+    copy = weights.copy()
+    copy.add('d', c*2)
+    np.testing.assert_allclose(weights.weight(), ref.weight())
+    np.testing.assert_allclose(copy.weight('aUp'), ref.weight('aUp')*c*2)
+
+def test_cutflow(common):
+    rng = np.random.RandomState(2)
+    n = 2000
+    cuts = ['a', 'b', 'c', 'd', 'e']
+    selection = processor.PackedSelection()
+    for cut in cuts:
+        selection.add(cut, rng.rand(n) < 0.8)
+    weight, z = rng.rand(n), rng.rand(n)
+    def empty():
+        return hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Cat('region', 'region'), hist.Bin('cut', 'cut', list(range(12))), hist.Bin('z', 'z', [0, 0.5, 1]))
+    ref, h = empty(), empty()
+    ref.fill(dataset='x', region='sr', cut=np.zeros(n), z=z, weight=weight)
+    for i in range(len(cuts)):
+        passed = selection.all(*cuts[:i+1])
+        ref.fill(dataset='x', region='sr', cut=np.full(n, i+1)[passed], z=z[passed], weight=weight[passed])
+    common.fill_cutflow(h, common.cutflow(selection, cuts), len(cuts), weight, dataset='x', region='sr', z=z)
+    assert_same(ref, h)
@@ -0,0 +1,127 @@
+import pickle
+
+import numpy as np
+import pytest
+from coffea import hist, processor
+from coffea.util import save
+
+from helpers import histogram
+from helpers.histogram import DenseHist
+
+def empty():
+    return hist.Hist('Events',
+                     hist.Cat('dataset', 'dataset'),
+                     hist.Cat('region', 'region'),
+                     hist.Bin('x', 'x', [0, .2, .5, 1]),
+                     hist.Cat('systematic', 'systematic'),
+                     hist.Bin('y', 'y', 4, 0, 1))
+
+def filled(datasets, weighted=True, seed=0):
+    rng = np.random.RandomState(seed)
+    h = empty()
+    for dataset in datasets:
+        for region in ['sr', 'wecr']:
+            for systematic in ['nominal', 'up']:
+                weight = {'weight': rng.rand(50)} if weighted else {}
+                h.fill(dataset=dataset, region=region, systematic=systematic, x=rng.rand(50), y=rng.rand(50), **weight)
+    return h
+
+def assert_same(a, b):
+    va, vb = a.values(sumw2=True, overflow='all'), b.values(sumw2=True, overflow='all')
+    assert va.keys() == vb.keys()
+    for k in va:
+        np.testing.assert_allclose(va[k][0], vb[k][0], rtol=1e-6)
+        np.testing.assert_allclose(va[k][1], vb[k][1], rtol=1e-6)
+
+def test_roundtrip():
+    h = filled(['A', 'B'])
+    assert_same(h, DenseHist.from_hist(h).to_hist())
+    assert_same(h, pickle.loads(pickle.dumps(DenseHist.from_hist(h))).to_hist())
+
+def test_add():
+    h1, h2, h3 = filled(['A', 'B'], seed=1), filled(['B', 'C'], seed=2), filled(['D'], weighted=False, seed=3)
+    ref = h1.copy()
+    ref.add(h2)
+    ref.add(h3)
+    d = DenseHist.from_hist(h1)
+    d.add(DenseHist.from_hist(h2))
+    d.add(h3)
+    assert_same(ref, d.to_hist())
+
+def test_float32():
+    h = filled(['A'])
+    d = DenseHist.from_hist(h, np.float32)
+    assert d.dtype == np.float32
+    assert_same(h, d.to_hist())
+
+def test_unweighted():
+    h = empty()
+    h.fill(dataset='MET', region='sr', systematic='nominal', x=np.random.rand(20), y=np.random.rand(20), weight=np.ones(20))
+    assert_same(h, DenseHist.from_hist(h).to_hist())
+
+def test_no_sparse_axes():
+    h = hist.Hist('Events', hist.Bin('x', 'x', 3, 0, 1))
+    h.fill(x=np.random.rand(5), weight=np.random.rand(5))
+    ref = h.copy()
+    ref.add(h)
+    d = DenseHist.from_hist(h)
+    d.add(DenseHist.from_hist(h))
+    assert_same(ref, d.to_hist())
+
+def test_split_join():
+    h = filled(['A', 'B', 'C'])
+    blocks = [block for _, block in DenseHist.from_hist(h).split('dataset')]
+    assert len(blocks) == 3
+    assert_same(h, DenseHist.join(blocks, 'dataset').to_hist())
+
+def test_compact_expand():
+    output = processor.dict_accumulator({'h': filled(['A']), 'n': processor.value_accumulator(int, 3)})
+    compacted = histogram.compact(output)
+    assert isinstance(compacted['h'], DenseHist)
+    expanded = histogram.expand(compacted)
+    assert isinstance(expanded['h'], hist.Hist)
+    assert expanded['n'].value == 3
+    assert_same(output['h'], expanded['h'])
+
+def test_save_load(tmp_path):
+    filename = str(tmp_path/'out.futures')
+    h, other = filled(['A', 'B', 'C']), filled(['A'], seed=1)
+    histogram.save(histogram.compact({'h': h, 'other': other, 'n': processor.value_accumulator(int, 3)}), filename)
+    assert sorted(histogram.keys(filename)) == ['h', 'n', 'other']
+    assert sorted(histogram.datasets(filename, 'h')) == ['A', 'B', 'C']
+    loaded = histogram.expand(histogram.load(filename))
+    assert_same(h, loaded['h'])
+    assert_same(other, loaded['other'])
+    assert loaded['n'].value == 3
+
+def test_load_filtered(tmp_path):
+    filename = str(tmp_path/'out.futures')
+    h = filled(['A', 'B', 'C'])
+    histogram.save(histogram.compact({'h': h, 'other': filled(['A'])}), filename)
+    loaded = histogram.load(filename, ['h'], lambda d: d != 'B')
+    assert list(loaded.keys()) == ['h']
+    ref = h.integrate('dataset', ['A', 'C'], overflow='all')
+    assert_same(ref, loaded['h'].to_hist().integrate('dataset', overflow='all'))
+    assert [d.name for d in loaded['h'].to_hist().identifiers('dataset')] == ['A', 'C']
+    # No dataset selected: an empty histogram with the same axes
+    none = histogram.load(filename, ['h'], lambda d: False)['h'].to_hist()
+    assert none.values() == {}
+    assert [ax.name for ax in none.axes()] == [ax.name for ax in h.axes()]
+
+def test_legacy(tmp_path):
+    filename = str(tmp_path/'out.futures')
+    h = filled(['A', 'B'])
+    save(processor.dict_accumulator({'h': h, 'other': filled(['A'])}), filename)
+    assert sorted(histogram.keys(filename)) == ['h', 'other']
+    assert sorted(histogram.datasets(filename, 'h')) == ['A', 'B']
+    loaded = histogram.load(filename, ['h'])
+    assert list(loaded.keys()) == ['h']
+    assert_same(h, loaded['h'])
+
+def test_truncated(tmp_path):
+    filename = str(tmp_path/'out.futures')
+    histogram.save(histogram.compact({'h': filled(['A'])}), filename)
+    with open(filename, 'r+b') as fout:
+        fout.truncate(100)
+    with pytest.raises(IOError):
+        histogram.load(filename)
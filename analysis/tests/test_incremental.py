@@ -0,0 +1,63 @@
+import os
+import shutil
+
+import numpy as np
+from coffea import hist
+
+import merge
+import reduce
+from helpers import histogram, manifest
+
+def write(folder, pd, i, n, seed):
+    rng = np.random.RandomState(seed)
+    h = hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 10, 0, 1))
+    h.fill(dataset='%s____%d_' % (pd, i), x=rng.rand(n), weight=rng.rand(n))
+    histogram.save(histogram.compact({'h': h}), os.path.join(folder, '%s____%d_.futures' % (pd, i)))
+
+def run(folder, rebuild=False):
+    reduce.reduce(folder, workers=2, rebuild=rebuild)
+    merge.merge(folder, workers=2, rebuild=rebuild)
+    return histogram.expand(histogram.load(os.path.join(folder, 'h.merged')))['h'].values(sumw2=True)
+
+def assert_same(a, b):
+    assert a.keys() == b.keys()
+    for k in a:
+        np.testing.assert_allclose(a[k][0], b[k][0])
+        np.testing.assert_allclose(a[k][1], b[k][1])
+
+def test_incremental(tmp_path):
+    folder = str(tmp_path)
+    for pd in ['A', 'B', 'C']:
+        for i in range(3):
+            write(folder, pd, i, 100, seed=10*ord(pd)+i)
+    run(folder)
+    # A new file, a changed one, and one that is gone
+    write(folder, 'A', 3, 10, seed=1)
+    write(folder, 'B', 0, 1000, seed=2)
+    os.remove(os.path.join(folder, 'C____2_.futures'))
+    incremental = run(folder)
+    assert_same(incremental, run(folder, rebuild=True))
+    # Nothing changed
+    mtime = os.path.getmtime(os.path.join(folder, 'h.merged'))
+    assert_same(incremental, run(folder))
+    assert os.path.getmtime(os.path.join(folder, 'h.merged')) == mtime
+
+def test_manifest_mismatch(tmp_path):
+    folder = str(tmp_path)
+    for pd in ['A', 'B']:
+        write(folder, pd, 0, 100, seed=ord(pd))
+    reduce.reduce(folder, workers=2)
+    expected = histogram.load(os.path.join(folder, 'h--A.reduced'))['h'].to_hist().values(sumw2=True)
+    # An output replaced behind the back of its manifest, as when it is
+    # brought back from a condor job without it
+    shutil.copy(os.path.join(folder, 'h--B.reduced'), os.path.join(folder, 'h--A.reduced'))
+    assert manifest.load(os.path.join(folder, 'h--A.reduced')) == {}
+    reduce.reduce(folder, workers=2)
+    assert_same(expected, histogram.load(os.path.join(folder, 'h--A.reduced'))['h'].to_hist().values(sumw2=True))
+
+def test_compare():
+    old = {'a': {'md5': '1'}, 'b': {'md5': '2'}, 'c': {'md5': '3'}}
+    entries = {'a': {'md5': '1'}, 'b': {'md5': '4'}, 'd': {'md5': '5'}}
+    added, stale = manifest.compare(old, entries)
+    assert sorted(added) == ['b', 'd']
+    assert sorted(stale) == ['b', 'c']
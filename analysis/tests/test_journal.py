@@ -0,0 +1,55 @@
+import os
+
+from coffea import processor
+
+from helpers.journal import Journal
+from helpers.scheduler import gaps
+
+def test_replay(tmp_path):
+    path = str(tmp_path/'dataset.journal')
+    journal = Journal(path, 'darkhiggs2018:1')
+    for i in range(3):
+        journal.record(('file.root', 10*i, 10*(i+1)), processor.value_accumulator(int, i+1))
+    accumulator = processor.value_accumulator(int)
+    assert Journal(path, 'darkhiggs2018:1').replay(accumulator) == {('file.root', 0, 10), ('file.root', 10, 20), ('file.root', 20, 30)}
+    assert accumulator.value == 6
+    journal.remove()
+    assert not os.path.exists(path)
+    assert Journal(path, 'darkhiggs2018:1').replay(accumulator) == set()
+
+def test_truncated(tmp_path):
+    path = str(tmp_path/'dataset.journal')
+    journal = Journal(path, 'darkhiggs2018:1')
+    journal.record(('file.root', 0, 10), processor.value_accumulator(int, 1))
+    size = os.path.getsize(path)
+    journal.record(('file.root', 10, 20), processor.value_accumulator(int, 2))
+    with open(path, 'r+b') as fout:
+        fout.truncate(os.path.getsize(path)-5)
+    accumulator = processor.value_accumulator(int)
+    assert journal.replay(accumulator) == {('file.root', 0, 10)}
+    assert accumulator.value == 1
+    assert os.path.getsize(path) == size
+    # Records made after the crash follow the last complete one
+    journal.record(('file.root', 10, 20), processor.value_accumulator(int, 2))
+    accumulator = processor.value_accumulator(int)
+    assert len(journal.replay(accumulator)) == 2
+    assert accumulator.value == 3
+
+def test_version(tmp_path):
+    path = str(tmp_path/'dataset.journal')
+    Journal(path, 'darkhiggs2018:1').record(('file.root', 0, 10), processor.value_accumulator(int, 1))
+    for version in ['darkhiggs2018:2', 'monojet2018:1', None]:
+        accumulator = processor.value_accumulator(int)
+        journal = Journal(path, version)
+        assert journal.replay(accumulator) == set()
+        assert accumulator.value == 0
+        assert not os.path.exists(path)
+        journal.record(('file.root', 0, 10), processor.value_accumulator(int, 1))
+    assert Journal(path, None).replay(processor.value_accumulator(int)) == {('file.root', 0, 10)}
+
+def test_gaps():
+    assert gaps(100, set()) == [(0, 100)]
+    assert gaps(100, {(0, 30), (50, 60)}) == [(30, 50), (60, 100)]
+    assert gaps(100, {(0, 50), (40, 100)}) == []
+    assert gaps(0, set()) == [(0, 0)]
+    assert gaps(0, {(0, 0)}) == []
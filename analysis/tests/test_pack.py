@@ -0,0 +1,55 @@
+import concurrent.futures
+
+from conftest import functions
+
+class EOS(object):
+    """
+    Directory tree {path: (mtime, [(name, isdir)])} answering xrdfs calls.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.listed = []
+
+    def ls(self, path):
+        self.listed.append(path)
+        mtime, entries = self.tree[path]
+        return [(path+'/'+name, isdir, self.tree[path+'/'+name][0] if isdir else '0') for name, isdir in entries]
+
+    def mtime(self, path):
+        return self.tree[path][0]
+
+def pack(eos):
+    namespace = functions('macros/pack.py', concurrent=concurrent)
+    namespace['xrdls'] = eos.ls
+    namespace['xrdmtime'] = eos.mtime
+    return namespace
+
+def test_find():
+    eos = EOS({
+        '/ds':           ('1', [('crab', True)]),
+        '/ds/crab':      ('1', [('0000', True), ('0001', True)]),
+        '/ds/crab/0000': ('1', [('a.root', False)]),
+        '/ds/crab/0001': ('1', [('b.root', False)]),
+    })
+    cache = {}
+    files = pack(eos)['find']([('/ds', None)], cache, 2)
+    assert sorted(files['/ds']) == ['/ds/crab/0000/a.root', '/ds/crab/0001/b.root']
+    # Nothing changed: nothing is listed again
+    eos.listed = []
+    assert sorted(pack(eos)['find']([('/ds', None)], cache, 2)['/ds']) == sorted(files['/ds'])
+    assert eos.listed == []
+    # A file added to an existing directory only changes the mtime of that directory
+    eos.tree['/ds/crab/0000'] = ('2', [('a.root', False), ('c.root', False)])
+    files = pack(eos)['find']([('/ds', None)], cache, 2)
+    assert sorted(files['/ds']) == ['/ds/crab/0000/a.root', '/ds/crab/0000/c.root', '/ds/crab/0001/b.root']
+    assert eos.listed == ['/ds/crab/0000']
+
+def test_balance():
+    balance = functions('macros/pack.py')['balance']
+    sizes = {'a': 5, 'b': 3, 'c': 4, 'd': 10, 'e': 1}
+    assert balance(list('abcde'), sizes, 8) == [['a', 'b'], ['c', 'd'], ['e']]
+    assert balance(list('abcde'), sizes, 100) == [list('abcde')]
+    assert balance(list('abcde'), sizes, 1) == [[url] for url in 'abcde']
+    assert balance([], sizes, 8) == [[]]
+    assert sum(balance(list('abcde'), sizes, 8), []) == list('abcde')
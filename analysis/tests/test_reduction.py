@@ -0,0 +1,55 @@
+import collections
+import os
+import shutil
+
+import numpy as np
+from coffea import hist
+
+from helpers import histogram
+from helpers import reduction
+from helpers.reduction import Reduction
+
+def write(directory, n):
+    """
+    n files with a histogram h each, and their sum.
+    """
+    rng = np.random.RandomState(0)
+    filenames, total = [], None
+    for i in range(n):
+        h = hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 10, 0, 1))
+        h.fill(dataset='A%d' % (i % 3), x=rng.rand(100), weight=rng.rand(100))
+        total = h if total is None else total + h
+        filenames.append(os.path.join(directory, 'f%d.futures' % i))
+        histogram.save(histogram.compact({'h': h}), filenames[-1])
+    return filenames, total
+
+def assert_same(a, b):
+    va, vb = a.values(sumw2=True), b.values(sumw2=True)
+    assert va.keys() == vb.keys()
+    for k in va:
+        np.testing.assert_allclose(va[k][0], vb[k][0])
+        np.testing.assert_allclose(va[k][1], vb[k][1])
+
+def test_sum(tmp_path):
+    filenames, total = write(str(tmp_path), 11)
+    scratch = tmp_path/'scratch'
+    scratch.mkdir()
+    with Reduction(workers=2, fanin=2, inflight=3, directory=str(scratch)) as r:
+        assert_same(total, r.sum(filenames, 'h').to_hist())
+        first = histogram.expand(histogram.load(filenames[0]))['h']
+        assert_same(first, r.sum(filenames[:1], 'h').to_hist())
+    assert os.listdir(str(scratch)) == []
+
+def test_put_fallback(tmp_path, monkeypatch):
+    full, spare = tmp_path/'full', tmp_path/'spare'
+    full.mkdir()
+    spare.mkdir()
+    usage = shutil.disk_usage
+    Usage = collections.namedtuple('Usage', 'total used free')
+    monkeypatch.setattr(shutil, 'disk_usage', lambda d: Usage(1, 1, 0) if d == str(full) else usage(d))
+    h = histogram.DenseHist.from_hist(hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 10, 0, 1)))
+    out = reduction._put(h, [str(full), str(spare)])
+    assert os.listdir(str(full)) == []
+    assert os.listdir(str(spare)) != []
+    reduction._get(out)
+    assert os.listdir(str(spare)) == []
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from coffea import hist
+
+from macros.scale import resolve, scale
+
+def hists(sumw):
+    """
+    sumw and x histograms for a TTJets dataset with sumw as sum of the
+    generator weights, and for a MET dataset.
+    """
+    h = {
+        'sumw': hist.Hist('sumw', hist.Cat('dataset', 'dataset'), hist.Bin('sumw', 'Weight value', [0.])),
+        'x':    hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 2, 0, 2)),
+    }
+    h['sumw'].fill(dataset='TTJets', sumw=np.ones(1), weight=np.full(1, sumw))
+    h['sumw'].fill(dataset='MET', sumw=np.ones(1), weight=np.ones(1))
+    h['x'].fill(dataset='TTJets', x=np.array([0.5, 1.5, 1.5]))
+    h['x'].fill(dataset='MET', x=np.array([0.5]))
+    return h
+
+def tt(bkg):
+    return bkg['x'].values()[('TT',)]
+
+def test_metadata():
+    bkg, sig, data = scale(hists(10.))
+    np.testing.assert_allclose(tt(bkg), [0.1, 0.2])
+    np.testing.assert_allclose(data['x'].values()[('MET',)], [1., 0.])
+    # The metadata sum is used when the processed files agree with it
+    bkg, sig, data = scale(hists(10.), {'TTJets': 10.0000001})
+    np.testing.assert_allclose(tt(bkg), [1/10.0000001, 2/10.0000001])
+    # and not when some files were left out
+    with pytest.warns(UserWarning):
+        bkg, sig, data = scale(hists(10.), {'TTJets': 20.})
+    np.testing.assert_allclose(tt(bkg), [0.1, 0.2])
+
+def test_resolve():
+    datasets = ['TTJets', 'TTToHadronic', 'HF--WJets', 'LF--WJets', 'MET', 'bb--QCD_HT', 'b--QCD_HT']
+    resolved = resolve({'TT': ('TT*',), 'W+HF': ('HF--WJets*',), 'QCD (b)': ('b--QCD*'), 'none': ('ZJets*',)}, datasets)
+    assert list(resolved) == ['TT', 'W+HF', 'QCD (b)', 'none']
+    assert resolved == {'TT': ['TTJets', 'TTToHadronic'], 'W+HF': ['HF--WJets'], 'QCD (b)': ['b--QCD_HT'], 'none': []}
+    # As hist.Hist.group matches them
+    h = hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 1, 0, 1))
+    for d in datasets:
+        h.fill(dataset=d, x=np.array([0.5]))
+    for process, pattern in [('TT', 'TT*'), ('W+HF', 'HF--WJets*'), ('QCD (b)', 'b--QCD*')]:
+        grouped = h.group(('dataset',), hist.Cat('process', 'process'), {process: (pattern,)})
+        assert grouped.values()[(process,)][0] == len(resolved[process])
+
+def test_scale():
+    sumw = {'TTJets': 10., 'HF--WJetsToLNu': 4., 'LF--WJetsToLNu': 4., 'Mz200_mhs50_Mdm100': 2., 'ZJetsToNuNu': 3., 'MET': 1.}
+    counts = {'TTJets': 3, 'HF--WJetsToLNu': 2, 'LF--WJetsToLNu': 5, 'Mz200_mhs50_Mdm100': 4, 'MET': 6}
+    h = {
+        'sumw': hist.Hist('sumw', hist.Cat('dataset', 'dataset'), hist.Bin('sumw', 'Weight value', [0.])),
+        'x':    hist.Hist('Events', hist.Cat('dataset', 'dataset'), hist.Bin('x', 'x', 1, 0, 1)),
+    }
+    for d, w in sumw.items():
+        h['sumw'].fill(dataset=d, sumw=np.ones(1), weight=np.full(1, w))
+    for d, n in counts.items():
+        h['x'].fill(dataset=d, x=np.full(n, 0.5))
+    bkg, sig, data = scale(h)
+    values = lambda h: {k[0]: v[0] for k, v in h.values().items()}
+    assert values(bkg['x']) == pytest.approx({'TT': 0.3, 'W+HF': 0.5, 'W+LF': 1.25})
+    assert values(data['x']) == {'MET': 6.}
+    assert values(sig['x']) == pytest.approx({'Mz200_mhs50_Mdm100': 2*0.06606})
+    # A simulated dataset without sumw is an error
+    h['x'].fill(dataset='WW', x=np.full(1, 0.5))
+    with pytest.raises(KeyError):
+        scale(h)
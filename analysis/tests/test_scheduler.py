@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from coffea import processor
+
+from helpers import scheduler, skim
+from helpers.scheduler import Controller
+
+class Counter(processor.ProcessorABC):
+    """
+    Number of events and sum of MET_pt per dataset.
+    """
+
+    def __init__(self, interrupt=False):
+        self._interrupt = interrupt
+        self._accumulator = processor.dict_accumulator({
+            'events': processor.defaultdict_accumulator(int),
+            'met':    processor.defaultdict_accumulator(float),
+        })
+
+    @property
+    def accumulator(self):
+        return self._accumulator
+
+    def process(self, events):
+        if self._interrupt: raise KeyboardInterrupt
+        output = self.accumulator.identity()
+        output['events'][events.metadata['dataset']] += events.size
+        output['met'][events.metadata['dataset']] += events.MET.pt.sum()
+        return output
+
+    def postprocess(self, accumulator):
+        return accumulator
+
+def skims(directory):
+    """
+    Two datasets of two Parquet files each, and their MET_pt.
+    """
+    rng = np.random.RandomState(0)
+    fileset, met = {}, {}
+    for dataset in ['A', 'B']:
+        fileset[dataset], met[dataset] = [], []
+        for i in range(2):
+            filename = str(directory/dataset/('%d.parquet' % i))
+            met[dataset].append(rng.rand(250+100*i))
+            skim.write(filename, {'MET_pt': met[dataset][-1]}, sumw=1., row_group_size=100)
+            fileset[dataset].append(filename)
+    return fileset, {dataset: np.concatenate(values) for dataset, values in met.items()}
+
+def test_run(tmp_path):
+    fileset, met = skims(tmp_path)
+    outputs = {}
+    def callback(dataset, output, usage):
+        outputs[dataset] = (output, usage)
+    scheduler.run(fileset, Counter(), callback, workers=2, chunksize=120)
+    assert sorted(outputs) == ['A', 'B']
+    for dataset, (output, usage) in outputs.items():
+        assert output['events'][dataset] == len(met[dataset]) == usage['events']
+        assert np.isclose(output['met'][dataset], met[dataset].sum())
+
+def test_interrupt(tmp_path):
+    fileset, met = skims(tmp_path)
+    outputs = {}
+    def callback(dataset, output, usage):
+        outputs[dataset] = output
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(fileset, Counter(interrupt=True), callback, workers=2, chunksize=120)
+    assert outputs == {}
+
+def test_controller():
+    controller = Controller(100000)
+    controller.update({'events': 1000, 'seconds': 1., 'rss': 0, 'maxrss': 0})
+    assert controller.chunksize == 100000
+    controller = Controller(100000, target_seconds=10.)
+    controller.update({'events': 0, 'seconds': 0., 'rss': 0, 'maxrss': 0})
+    assert controller.chunksize == 100000
+    controller.update({'events': 1000, 'seconds': 1., 'rss': 0, 'maxrss': 0})
+    assert controller.chunksize == 10000
+    controller.update({'events': 1000, 'seconds': 3., 'rss': 0, 'maxrss': 0})
+    assert controller.chunksize == 5000
+    # The memory ceiling wins when it gives smaller chunks
+    controller = Controller(100000, target_seconds=10., max_memory=2000)
+    controller.update({'events': 1000, 'seconds': 1., 'rss': 1000, 'maxrss': 1100})
+    assert controller.chunksize == 10000
+    controller = Controller(100000, target_seconds=10., max_memory=2000, minimum=10)
+    controller.update({'events': 1000, 'seconds': 1., 'rss': 1000, 'maxrss': 1500})
+    assert controller.chunksize == 2000
+    controller = Controller(100000, target_seconds=0.001)
+    controller.update({'events': 1000, 'seconds': 1., 'rss': 0, 'maxrss': 0})
+    assert controller.chunksize == 1000
+
+def test_adaptive(tmp_path):
+    fileset, met = skims(tmp_path)
+    outputs = {}
+    def callback(dataset, output, usage):
+        outputs[dataset] = output
+    scheduler.run(fileset, Counter(), callback, workers=2, chunksize=50, target_seconds=1e-3)
+    for dataset in fileset:
+        assert outputs[dataset]['events'][dataset] == len(met[dataset])
+        assert np.isclose(outputs[dataset]['met'][dataset], met[dataset].sum())
@@ -0,0 +1,78 @@
+import awkward
+import numpy as np
+
+from helpers import skim
+
+def arrays(n, seed=0):
+    rng = np.random.RandomState(seed)
+    njet = rng.randint(0, 4, n).astype(np.int32)
+    return {
+        'nJet':   njet,
+        'Jet_pt': awkward.JaggedArray.fromcounts(njet, rng.rand(njet.sum()).astype(np.float32)),
+        'MET_pt': rng.rand(n).astype(np.float32),
+    }
+
+def test_path():
+    a = skim.path('skims', 'TTJets____0_', 'root://eos//a/nano_1.root')
+    b = skim.path('skims', 'TTJets____0_', 'root://eos//b/nano_1.root')
+    assert a != b
+    assert a.startswith('skims/TTJets____0_/nano_1_') and a.endswith('.parquet')
+
+def test_load(tmp_path, capsys):
+    filename = str(tmp_path/'skim.parquet')
+    original = arrays(250)
+    skim.write(filename, original, sumw=12.5, row_group_size=100)
+    assert skim.numentries(filename) == 250
+    for entrystart, entrystop in [(0, 250), (0, 100), (90, 210), (200, 250), (120, 130)]:
+        metadata = {'filename': filename, 'entrystart': entrystart, 'entrystop': entrystop}
+        events = skim.load(filename, entrystart, entrystop, metadata)
+        assert metadata['sumw'] == 12.5
+        assert events.size == entrystop - entrystart
+        np.testing.assert_array_equal(events.MET.pt, original['MET_pt'][entrystart:entrystop])
+        np.testing.assert_array_equal(events.Jet.counts, original['nJet'][entrystart:entrystop])
+        np.testing.assert_array_equal(events.Jet.pt.flatten(), original['Jet_pt'][entrystart:entrystop].flatten())
+    assert capsys.readouterr().out == ''
+
+class Tree(object):
+
+    def __init__(self, arrays):
+        self._arrays = arrays
+        self.numentries = len(arrays['MET_pt'])
+
+    def keys(self):
+        return [k.encode() for k in self._arrays]
+
+    def arrays(self, branches, entrystart, entrystop, namedecode):
+        return {branch: self._arrays[branch][entrystart:entrystop] for branch in branches}
+
+class Runs(object):
+
+    def keys(self):
+        return [b'genEventSumw']
+
+    def array(self, branch):
+        return np.array([3., 4.])
+
+class Preselection(object):
+    """
+    Keeps the events with MET_pt above 0.5, in preselection mode.
+    """
+
+    def process(self, events):
+        assert events.metadata['skim'] == ['mindphi_']
+        return events.MET.pt > 0.5
+
+def test_skim(tmp_path, monkeypatch):
+    original = arrays(250, seed=1)
+    del original['Jet_pt']
+    monkeypatch.setattr(skim.uproot, 'open', lambda filename: {'Events': Tree(original), 'Runs': Runs()})
+    monkeypatch.setattr(skim, '_processor', Preselection())
+    output = str(tmp_path/'TTJets'/'skim.parquet')
+    read, kept = skim.skim('TTJets', 'nano.root', output, ['MET_pt', 'nJet', 'Photon_pt'], ['mindphi_'], chunksize=100)
+    mask = original['MET_pt'] > 0.5
+    assert (read, kept) == (250, mask.sum())
+    metadata = {}
+    events = skim.load(output, 0, kept, metadata)
+    assert metadata['sumw'] == 7.
+    np.testing.assert_array_equal(events.MET.pt, original['MET_pt'][mask])
+    np.testing.assert_array_equal(events.nJet, original['nJet'][mask])
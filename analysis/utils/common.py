@@ -1,11 +1,340 @@
 from coffea.util import save
+from coffea import hist, processor
+from collections import defaultdict
+import time
+import warnings
 import awkward
+import numba
 import uproot, uproot_methods
 import numpy as np
 
+@numba.njit
+def _match_kernel(a_offsets, a_eta, a_phi, b_offsets, b_eta, b_phi, val, out):
+    for i in range(len(a_offsets)-1):
+        for j in range(a_offsets[i], a_offsets[i+1]):
+            if out[j]: continue
+            for k in range(b_offsets[i], b_offsets[i+1]):
+                deta = a_eta[j] - b_eta[k]
+                dphi = (a_phi[j] - b_phi[k] + np.pi) % (2*np.pi) - np.pi
+                if deta*deta + dphi*dphi < val*val:
+                    out[j] = True
+                    break
+
 def match(a, b, val):
-    combinations = a.cross(b, nested=True)
-    return (combinations.i0.delta_r(combinations.i1)<val).any()
+    """
+    Whether each object of a is within delta R < val of an object of b, or
+    of any of the collections in b if it is a list. Loops on the flat
+    eta/phi arrays, event by event, without building the pairs.
+    """
+    if not isinstance(b, (list, tuple)): b = [b]
+    a_offsets = np.concatenate([[0], np.cumsum(a.counts)])
+    a_eta, a_phi = a.eta.flatten(), a.phi.flatten()
+    out = np.zeros(len(a_eta), dtype=np.bool_)
+    for _b in b:
+        b_offsets = np.concatenate([[0], np.cumsum(_b.counts)])
+        _match_kernel(a_offsets, a_eta, a_phi, b_offsets, _b.eta.flatten(), _b.phi.flatten(), val, out)
+    return awkward.JaggedArray.fromcounts(a.counts, out)
+
+runs_sumw = {}
+
+def get_sumw(events):
+    """
+    Sum of the generator weights to be filled for a chunk. The genEventSumw
+    of the whole file is read from its Runs tree and assigned to the chunk
+    that starts at the first entry, so that the normalisation does not
+    depend on summing genWeight over every chunk. Only files whose Runs
+    tree has no genEventSumw fall back, with a warning, to genWeight.sum();
+    a Runs tree that cannot be read is an error, so that the chunks of a
+    dataset are never normalised in two different ways. Skims have no
+    Runs tree: the sum of the original file must come in
+    events.metadata['sumw'], since the surviving events alone would give
+    the wrong normalisation.
+    """
+    filename = events.metadata.get('filename')
+    entrystart = events.metadata.get('entrystart')
+    if filename is None or entrystart is None:
+        return events.genWeight.sum()
+    if filename not in runs_sumw:
+        sumw = events.metadata.get('sumw')
+        if sumw is None and filename.endswith('.parquet'):
+            raise RuntimeError('The skim '+filename+' has no genEventSumw, skim it again')
+        if sumw is None:
+            runs = uproot.open(filename)['Runs']
+            for branch in ['genEventSumw', 'genEventSumw_']:
+                if branch.encode() not in runs.keys(): continue
+                sumw = runs.array(branch).sum()
+                break
+            else:
+                warnings.warn('No genEventSumw in the Runs tree of '+filename+', summing genWeight instead')
+        runs_sumw[filename] = sumw
+    if runs_sumw[filename] is None:
+        return events.genWeight.sum()
+    if entrystart > 0:
+        return 0.
+    return runs_sumw[filename]
+
+def _add(h, values, sumw, sumw2):
+    """
+    Add the dense arrays sumw and sumw2 to the bin of the sparse axes of h
+    given by values.
+    """
+    if h._sumw2 is None: h._init_sumw2()
+    key = tuple(d.index(values[d.name]) for d in h.sparse_axes())
+    if key not in h._sumw:
+        h._sumw[key] = np.zeros(shape=h._dense_shape, dtype=h._dtype)
+        h._sumw2[key] = np.zeros(shape=h._dense_shape, dtype=h._dtype)
+    h._sumw[key] += sumw
+    h._sumw2[key] += sumw2
+
+def fill_multi(h, axis, labels, weights, **values):
+    """
+    Fill h once for each label of its sparse axis, with the matching column
+    of the (events x labels) weights matrix. The bins of the dense axes are
+    found once for all labels, and all columns are scattered with a single
+    bincount. Events with no weight in any column are skipped.
+    """
+    dense_shape = h._dense_shape
+    nbins = int(np.prod(dense_shape))
+    xy = np.atleast_1d(np.ravel_multi_index(tuple(d.index(values[d.name]) for d in h.dense_axes()), dense_shape))
+    weights = np.asarray(weights, dtype=np.float64)
+    selected = (weights != 0).any(axis=1)
+    xy, weights = xy[selected], weights[selected]
+    index = (xy[:, None] + nbins*np.arange(len(labels))[None, :]).ravel()
+    sumw = np.bincount(index, weights=weights.ravel(), minlength=nbins*len(labels)).reshape((len(labels),)+dense_shape)
+    sumw2 = np.bincount(index, weights=(weights**2).ravel(), minlength=nbins*len(labels)).reshape((len(labels),)+dense_shape)
+    for i, label in enumerate(labels):
+        values[axis] = label
+        _add(h, values, sumw[i], sumw2[i])
+
+def cutflow(selection, cuts):
+    """
+    Number of leading cuts of the list cuts passed by each event, with one
+    AND per cut.
+    """
+    passed = selection.all()
+    npassed = np.zeros(passed.size, dtype=np.int64)
+    for cut in cuts:
+        passed &= selection.all(cut)
+        npassed += passed
+    return npassed
+
+def fill_cutflow(h, npassed, ncuts, weight, axis='cut', **values):
+    """
+    Fill the cutflow h, where bin i of axis counts the events that pass the
+    first i cuts, from npassed (see cutflow). The events are counted per
+    number of cuts passed with one bincount and accumulated from the last
+    cut down, then added to h at once.
+    """
+    dense = h.dense_axes()
+    dense_shape = h._dense_shape
+    position = [d.name for d in dense].index(axis)
+    stride = int(np.prod(dense_shape[position+1:]))
+    values[axis] = np.zeros(len(npassed))
+    base = np.atleast_1d(np.ravel_multi_index(tuple(d.index(values[d.name]) for d in dense), dense_shape))
+    offsets = stride*(dense[position].index(np.arange(ncuts+1)) - dense[position].index(0))
+    bases, inverse = np.unique(base, return_inverse=True)
+    weight = np.asarray(weight, dtype=np.float64)
+    index = np.minimum(npassed, ncuts)*len(bases) + inverse
+    sumw = np.zeros(int(np.prod(dense_shape)))
+    sumw2 = np.zeros(int(np.prod(dense_shape)))
+    target = (bases[None, :] + offsets[:, None]).ravel()
+    for out, w in [(sumw, weight), (sumw2, weight**2)]:
+        counts = np.bincount(index, weights=w, minlength=(ncuts+1)*len(bases)).reshape(ncuts+1, len(bases))
+        np.add.at(out, target, np.cumsum(counts[::-1], axis=0)[::-1].ravel())
+    _add(h, values, sumw.reshape(dense_shape), sumw2.reshape(dense_shape))
+
+class Weights(object):
+    """
+    Event weights with their systematic variations, as processor.Weights.
+    The product of the nominal weights is kept as they are added, and every
+    source with variations keeps the ratio of each variation to its
+    nominal, so that a variation is a single multiplication. The weights
+    returned are computed once and kept until a new weight is added.
+    copy() lets the weights common to all regions be added once per chunk.
+    """
+
+    def __init__(self, size):
+        self._weight = np.ones(size)
+        self._modifiers = {}
+        self._cache = {}
+
+    def add(self, name, weight, weightUp=None, weightDown=None):
+        weight = np.asarray(weight, dtype=np.float64)
+        self._weight = self._weight * weight
+        self._cache = {}
+        nonzero = weight != 0
+        for modifier, varied in [(name+'Up', weightUp), (name+'Down', weightDown)]:
+            if varied is None: continue
+            ratio = np.array(varied, dtype=np.float64)
+            ratio[nonzero] /= weight[nonzero]
+            self._modifiers[modifier] = ratio
+
+    def _ratio(self, modifier):
+        if modifier in self._modifiers:
+            return self._modifiers[modifier]
+        if modifier.endswith('Down') and modifier[:-4]+'Up' in self._modifiers:
+            return 1. / self._modifiers[modifier[:-4]+'Up']
+        raise KeyError('Unknown weight variation '+modifier)
+
+    def weight(self, modifier=None):
+        if modifier is None:
+            return self._weight
+        if modifier not in self._cache:
+            self._cache[modifier] = self._weight * self._ratio(modifier)
+        return self._cache[modifier]
+
+    def stack(self, modifiers):
+        """
+        (events x modifiers) array of the weights of modifiers, None being
+        the nominal weight.
+        """
+        out = np.empty((len(self._weight), len(modifiers)))
+        for i, modifier in enumerate(modifiers):
+            if modifier is None or modifier in self._cache:
+                out[:, i] = self.weight(modifier)
+            else:
+                np.multiply(self._weight, self._ratio(modifier), out=out[:, i])
+        return out
+
+    @property
+    def variations(self):
+        return set(self._modifiers) | set(modifier[:-2]+'Down' for modifier in self._modifiers if modifier.endswith('Up'))
+
+    def copy(self):
+        other = type(self)(0)
+        other._weight = self._weight
+        other._modifiers = dict(self._modifiers)
+        return other
+
+class LazyOutput(dict):
+    """
+    Output of a chunk in which the histograms of the processor accumulator
+    are only created, empty, when they are first used, so that a chunk does
+    not pay for creating, pickling and merging the ones it does not fill.
+    accumulator() returns the ones that were used, as a dict_accumulator
+    that the executors merge into the full accumulator. watch is called
+    with each new histogram (see Timer.watch).
+    """
+
+    def __init__(self, template, watch=None):
+        super().__init__()
+        self._template = template
+        self._watch = watch
+
+    def __missing__(self, key):
+        value = self[key] = self._template[key].identity()
+        if self._watch is not None: self._watch({key: value})
+        return value
+
+    def accumulator(self):
+        return processor.dict_accumulator(self)
+
+class Timer(object):
+    """
+    Opt-in timing of the stages of a processor, doing nothing when it is
+    disabled. lap(stage) adds the time elapsed since the previous lap to
+    stage. The functions wrapped with wrap(stage, function) are timed on
+    their own, and their time is not counted in the laps that contain them.
+    """
+
+    def __init__(self, enabled, nevents):
+        self._enabled = enabled
+        self._nevents = nevents
+        self._seconds = defaultdict(float)
+        self._nested = 0.
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        if not self._enabled: return
+        now = time.perf_counter()
+        self._seconds[stage] += now - self._last - self._nested
+        self._last = now
+        self._nested = 0.
+
+    def wrap(self, stage, function):
+        if not self._enabled: return function
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._seconds[stage] += elapsed
+                self._nested += elapsed
+        return timed
+
+    def watch(self, hout):
+        """
+        Time the fills of every histogram in hout separately.
+        """
+        if not self._enabled: return
+        for histname, h in hout.items():
+            if isinstance(h, hist.Hist): h.fill = self.wrap('fill '+histname, h.fill)
+
+    def output(self, hout):
+        """
+        Unwrap the fills and add the times to hout, as a 'timing' entry
+        that is merged across chunks like the histograms.
+        """
+        if not self._enabled: return hout
+        for h in hout.values():
+            if isinstance(h, hist.Hist): h.__dict__.pop('fill', None)
+        seconds = processor.defaultdict_accumulator(float)
+        seconds.update(self._seconds)
+        hout['timing'] = processor.dict_accumulator({
+            'events':  processor.value_accumulator(int, self._nevents),
+            'seconds': seconds,
+        })
+        return hout
+
+class Memo(object):
+    """
+    Per-chunk cache of the derived columns used by several selections and
+    histograms. define(name, function) tells how to compute a column, with
+    function(region) for the columns that depend on the region. memo(name)
+    or memo(name, region) computes it the first time and returns the same
+    array afterwards. When enabled, the hits and misses of every column are
+    counted and added to the output.
+    """
+
+    def __init__(self, enabled=False):
+        self._enabled = enabled
+        self._functions = {}
+        self._values = {}
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+
+    def define(self, name, function):
+        self._functions[name] = function
+
+    def __call__(self, name, region=None):
+        key = (name, region)
+        if key in self._values:
+            self._hits[name] += 1
+            return self._values[key]
+        self._misses[name] += 1
+        if region is None:
+            value = self._functions[name]()
+        else:
+            value = self._functions[name](region)
+        self._values[key] = value
+        return value
+
+    def output(self, hout):
+        """
+        Add the hits and misses to hout, as a 'memo' entry that is merged
+        across chunks like the histograms.
+        """
+        if not self._enabled: return hout
+        hits = processor.defaultdict_accumulator(int)
+        hits.update(self._hits)
+        misses = processor.defaultdict_accumulator(int)
+        misses.update(self._misses)
+        hout['memo'] = processor.dict_accumulator({
+            'hits':   hits,
+            'misses': misses,
+        })
+        return hout
 
 def sigmoid(x,a,b,c,d):
     """
@@ -57,5 +386,13 @@ btagWPs = {
 common = {}
 common['match'] = match
 common['sigmoid'] = sigmoid
+common['get_sumw'] = get_sumw
+common['Timer'] = Timer
+common['Memo'] = Memo
+common['LazyOutput'] = LazyOutput
+common['fill_multi'] = fill_multi
+common['Weights'] = Weights
+common['cutflow'] = cutflow
+common['fill_cutflow'] = fill_cutflow
 common['btagWPs'] = btagWPs
 save(common, 'data/common.coffea')